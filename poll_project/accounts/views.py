@@ -3,7 +3,9 @@ from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from pollApp.models import Question, Choice
+from django.db.models import Prefetch
+from pollApp.models import Question, Vote
+from pollApp.routers import use_replica
 
 
 def register(request):
@@ -56,20 +58,32 @@ def logout_view(request):
 
 
 @login_required
+@use_replica
 def profile(request):
     """User profile showing voting history"""
     user = request.user
     
     # Get all votes by this user
-    user_votes = Choice.objects.filter(vote__user=user).select_related('question')
+    user_votes = Vote.objects.filter(user=user)
     
-    # Get questions the user voted on
-    voted_questions = Question.objects.filter(
-        choice__vote__user=user
-    ).distinct().order_by('-pub_date')
+    # Get questions the user voted on, with the user's own votes attached
+    # as question.user_votes so the template doesn't query per choice
+    voted_questions = list(
+        # pk__in a subquery lets the database start from the user's votes
+        # (Vote(user, question) index) instead of scanning every poll
+        Question.objects.filter(pk__in=user_votes.values('question_id'))
+        .order_by('-pub_date')
+        .prefetch_related(Prefetch(
+            'vote_set',
+            queryset=user_votes.select_related('choice').order_by('choice_id'),
+            to_attr='user_votes',
+        ))
+    )
     
     # Get polls the user is invited to (private polls)
-    invited_polls = user.invited_polls.filter(is_draft=False).order_by('-pub_date')
+    invited_polls = list(
+        user.invited_polls.filter(is_draft=False).select_related('created_by').order_by('-pub_date')
+    )
     
     context = {
         'user': user,
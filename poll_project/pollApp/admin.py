@@ -1,5 +1,11 @@
-from django.contrib import admin
-from .models import Question, Choice, Vote, Category, Comment
+from django import forms
+from django.contrib import admin, messages
+from django.http import FileResponse, Http404
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.html import format_html
+from .models import Question, Choice, Vote, Category, Comment, Job
+from .services import jobs
 
 admin.site.site_header = "The Poll Mall"
 admin.site.site_title = "Voting Admin Area"
@@ -19,12 +25,33 @@ class ChoiceInLine(admin.TabularInline):
     fields = ['choice_text', 'description', 'image', 'votes']
 
 
+class QuestionAdminForm(forms.ModelForm):
+    """Takes a new poll password in the clear and stores its hash"""
+    new_password = forms.CharField(
+        label='Password', required=False, widget=forms.PasswordInput,
+        help_text='Required if visibility is password protected. Leave blank to keep the current password.',
+    )
+    
+    class Meta:
+        model = Question
+        exclude = ['password']
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('new_password'):
+            # Set before model validation, which requires a password for password polls
+            self.instance.set_password(cleaned_data['new_password'])
+        return cleaned_data
+
+
 @admin.register(Question)
 class QuestionAdmin(admin.ModelAdmin):
-    list_display = ['question_text', 'category', 'is_draft', 'visibility', 'pub_date', 'is_active', 'total_votes']
-    list_filter = ['is_draft', 'visibility', 'category', 'pub_date', 'created_at']
+    form = QuestionAdminForm
+    list_display = ['question_text', 'category', 'is_draft', 'visibility', 'pub_date', 'status', 'total_votes', 'unique_voters']
+    list_select_related = ['category']
+    list_filter = ['status', 'is_draft', 'visibility', 'category', 'pub_date', 'created_at']
     search_fields = ['question_text', 'description']
-    readonly_fields = ['created_at', 'updated_at', 'total_votes']
+    readonly_fields = ['status', 'created_at', 'updated_at', 'total_votes', 'unique_voters']
     filter_horizontal = ['invited_users']
     
     fieldsets = [
@@ -32,38 +59,82 @@ class QuestionAdmin(admin.ModelAdmin):
             'fields': ['question_text', 'description', 'category', 'image']
         }),
         ('Date & Time', {
-            'fields': ['pub_date', 'start_date', 'end_date'],
+            'fields': ['pub_date', 'start_date', 'end_date', 'status'],
             'description': 'Control when poll is visible and active'
         }),
         ('Settings', {
-            'fields': ['is_draft', 'visibility', 'password', 'allow_multiple_choices', 'invited_users'],
+            'fields': ['is_draft', 'visibility', 'new_password', 'allow_multiple_choices', 'ranking_method', 'invited_users'],
             'classes': ['collapse'],
             'description': 'For private polls, select users who should have access'
         }),
         ('Metadata', {
-            'fields': ['created_by', 'created_at', 'updated_at'],
+            'fields': ['created_by', 'created_at', 'updated_at', 'total_votes', 'unique_voters'],
             'classes': ['collapse']
         }),
     ]
     
     inlines = [ChoiceInLine]
+    actions = ['reconcile_counts', 'rebuild_timelines', 'export_votes']
     
     def save_model(self, request, obj, form, change):
         if not change:  # If creating new object
             obj.created_by = request.user
         super().save_model(request, obj, form, change)
+    
+    # Deleting a poll cascades through all its votes, so it happens in a background job:
+    # the poll becomes a draft at once and a worker deletes it in chunks
+    
+    def get_deleted_objects(self, objs, request):
+        """Counts for the confirmation page, instead of collecting every vote"""
+        question_ids = [obj.pk for obj in objs]
+        model_count = {
+            'polls': len(question_ids),
+            'choices': Choice.objects.filter(question_id__in=question_ids).count(),
+            'votes': Vote.objects.filter(question_id__in=question_ids).count(),
+            'comments': Comment.objects.filter(question_id__in=question_ids).count(),
+        }
+        return [str(obj) for obj in objs], model_count, set(), []
+    
+    def delete_model(self, request, obj):
+        jobs.schedule_delete([obj.pk], request.user)
+    
+    def delete_queryset(self, request, queryset):
+        queued = jobs.schedule_delete(list(queryset.values_list('pk', flat=True)), request.user)
+        self.message_user(request, f'{len(queued)} polls were hidden and will be deleted by the background workers.')
+    
+    def response_delete(self, request, obj_display, obj_id):
+        self.message_user(request, f'“{obj_display}” was hidden and will be deleted by the background workers.')
+        return super().response_delete(request, obj_display, obj_id)
+    
+    def _enqueue(self, request, kind, payload, description):
+        job = jobs.enqueue(kind, payload, request.user)
+        url = reverse('admin:pollApp_job_change', args=[job.pk])
+        self.message_user(request, format_html('{} queued as <a href="{}">job #{}</a>.', description, url, job.pk))
+    
+    @admin.action(description='Reconcile vote counts (background)')
+    def reconcile_counts(self, request, queryset):
+        self._enqueue(request, 'reconcile_votes', {'question_ids': list(queryset.values_list('pk', flat=True))}, 'Reconciliation')
+    
+    @admin.action(description='Rebuild vote timelines (background)')
+    def rebuild_timelines(self, request, queryset):
+        self._enqueue(request, 'backfill_rollups', {'question_ids': list(queryset.values_list('pk', flat=True))}, 'Timeline rebuild')
+    
+    @admin.action(description='Export votes as CSV (background)')
+    def export_votes(self, request, queryset):
+        self._enqueue(request, 'export_votes', {'question_ids': list(queryset.values_list('pk', flat=True))}, 'Export')
 
 
 @admin.register(Choice)
 class ChoiceAdmin(admin.ModelAdmin):
     list_display = ['choice_text', 'question', 'votes', 'vote_percentage']
+    list_select_related = ['question']
     list_filter = ['question']
     search_fields = ['choice_text', 'question__question_text']
 
 
 @admin.register(Vote)
 class VoteAdmin(admin.ModelAdmin):
-    list_display = ['user', 'question', 'choice', 'voted_at']
+    list_display = ['user', 'question', 'choice', 'rank', 'voted_at']
     list_filter = ['voted_at', 'question']
     search_fields = ['user__username', 'question__question_text']
     readonly_fields = ['voted_at']
@@ -78,4 +149,62 @@ class CommentAdmin(admin.ModelAdmin):
     
     def text_preview(self, obj):
         return obj.text[:50] + '...' if len(obj.text) > 50 else obj.text
-    text_preview.short_description = 'Comment'
\ No newline at end of file
+    text_preview.short_description = 'Comment'
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'kind', 'status', 'progress', 'attempts', 'run_after', 'created_by', 'created_at', 'finished_at', 'download']
+    list_filter = ['status', 'kind']
+    readonly_fields = [
+        'kind', 'payload', 'status', 'progress', 'attempts', 'max_attempts', 'run_after', 'result', 'download',
+        'error', 'worker', 'heartbeat_at', 'created_by', 'created_at', 'started_at', 'finished_at',
+    ]
+    exclude = ['progress_done', 'progress_total']
+    actions = ['retry']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_retry_permission(self, request):
+        return request.user.has_perm('pollApp.change_job')
+    
+    @admin.display(description='Progress')
+    def progress(self, obj):
+        return format_html(
+            '<progress max="100" value="{}"></progress> {}% ({}/{})',
+            obj.progress_percent(), obj.progress_percent(), obj.progress_done, obj.progress_total,
+        )
+    
+    @admin.display(description='File')
+    def download(self, obj):
+        if obj.kind != 'export_votes' or obj.status != 'done':
+            return ''
+        return format_html('<a href="{}">Download</a>', reverse('admin:pollApp_job_download', args=[obj.pk]))
+    
+    def get_urls(self):
+        return [
+            path('<int:job_id>/download/', self.admin_site.admin_view(self.download_view), name='pollApp_job_download'),
+        ] + super().get_urls()
+    
+    def download_view(self, request, job_id):
+        """Serve the file of a finished export job to staff who can see jobs"""
+        job = Job.objects.filter(pk=job_id, kind='export_votes', status='done').first()
+        if job is None or not self.has_view_permission(request, job):
+            raise Http404('No such export.')
+        storage = jobs.export_storage()
+        name = job.result['file']
+        if not storage.exists(name):
+            raise Http404('The export file is gone.')
+        return FileResponse(storage.open(name, 'rb'), as_attachment=True, filename=name)
+    
+    @admin.action(description='Retry selected jobs now', permissions=['retry'])
+    def retry(self, request, queryset):
+        # Failed jobs get a fresh set of attempts; queued ones skip their backoff
+        retried = queryset.filter(status__in=['queued', 'failed']).update(
+            status='queued', attempts=0, run_after=timezone.now(), finished_at=None,
+        )
+        self.message_user(request, f'{retried} jobs queued again.', messages.SUCCESS)
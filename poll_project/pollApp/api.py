@@ -0,0 +1,341 @@
+"""Versioned JSON API for polls, results, votes and comments
+
+Rows are serialized straight from values() querysets; a single Question
+instance is only loaded where the access rules and the results cache need
+one. Poll and results responses carry an ETag built from
+Question.updated_at and Question.results_version (and a Last-Modified
+header where votes cannot change the body), so clients polling an
+unchanged poll get an empty 304. Authentication is the normal session
+cookie, so unsafe requests need the CSRF token like any form post.
+"""
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import require_http_methods
+
+from .models import Choice, Comment, Question
+from .pagination import paginate_newest_first, paginate_ranked, page_url
+from .routers import use_replica
+from .services import access, unlock
+from .services.results_cache import get_results
+from .services.rollups import GRANULARITIES, timeline
+from .services.search import search_polls
+from .services.throttle import throttle
+from .services.voting import record_vote
+
+
+POLL_FIELDS = (
+    'id', 'question_text', 'description', 'pub_date', 'start_date', 'end_date', 'status', 'visibility',
+    'allow_multiple_choices', 'ranking_method', 'total_votes', 'unique_voters', 'image',
+    'category__slug', 'category__name',
+)
+CHOICE_FIELDS = ('id', 'choice_text', 'description', 'image')
+COMMENT_FIELDS = ('id', 'text', 'created_at', 'is_edited', 'user__username')
+COMMENTS_PER_PAGE = 50
+MAX_PAGE_SIZE = 100
+
+
+def _error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def _media_url(name):
+    return default_storage.url(name) if name else None
+
+
+def _poll_json(row):
+    """API representation of a values() row with POLL_FIELDS"""
+    category = None
+    if row['category__slug']:
+        category = {'slug': row['category__slug'], 'name': row['category__name']}
+    return {
+        'id': row['id'],
+        'url': reverse('api:poll_detail', args=(row['id'],)),
+        'question_text': row['question_text'],
+        'description': row['description'],
+        'category': category,
+        'pub_date': row['pub_date'],
+        'start_date': row['start_date'],
+        'end_date': row['end_date'],
+        'status': row['status'],
+        'visibility': row['visibility'],
+        'allow_multiple_choices': row['allow_multiple_choices'],
+        'ranking_method': row['ranking_method'] or None,
+        'total_votes': row['total_votes'],
+        'unique_voters': row['unique_voters'],
+        'image': _media_url(row['image']),
+    }
+
+
+def _question_row(question):
+    """The POLL_FIELDS row of an already loaded question (category via select_related)"""
+    row = {field: getattr(question, field) for field in POLL_FIELDS if '__' not in field}
+    row['image'] = question.image.name
+    row['category__slug'] = question.category.slug if question.category else None
+    row['category__name'] = question.category.name if question.category else None
+    return row
+
+
+def _etag(question):
+    updated = int(question.updated_at.timestamp() * 1000000) if question.updated_at else 0
+    return f'"{question.pk}-{updated}-{question.results_version}-{question.status}"'
+
+
+def _last_modified(question, now):
+    """When the poll itself last changed: an edit, or it opening or closing"""
+    moments = [question.updated_at, question.start_date, question.end_date]
+    moments = [moment for moment in moments if moment and moment <= now]
+    return max(moments) if moments else None
+
+
+def _conditional(request, question, now, last_modified=True):
+    """A 304 response if the client's copy is current, else None
+
+    Last-Modified is only offered for representations that do not change
+    with votes; vote counts do not touch updated_at, so results rely on the
+    ETag alone.
+    """
+    modified = _last_modified(question, now) if last_modified else None
+    return get_conditional_response(
+        request, etag=_etag(question), last_modified=int(modified.timestamp()) if modified else None,
+    )
+
+
+def _with_validators(response, question, now, last_modified=True):
+    response['ETag'] = _etag(question)
+    modified = _last_modified(question, now) if last_modified else None
+    if modified:
+        response['Last-Modified'] = http_date(modified.timestamp())
+    # Access depends on who is logged in
+    patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+def _json_body(request):
+    """Decoded JSON object body, or None if it is not one"""
+    try:
+        data = json.loads(request.body or b'{}')
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def poll_endpoint(require_unlock=True):
+    """Load the poll, apply the access rules and pass the Question on to the view"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, question_id, *args, **kwargs):
+            question = Question.objects.select_related('category').filter(pk=question_id).first()
+            if question is None or not access.can_access(request.user, question, request):
+                # Polls the user may not see are indistinguishable from missing ones
+                return _error('Poll not found.', 404)
+            if require_unlock and not unlock.is_unlocked(request, question):
+                return _error('This poll is password protected. Unlock it first.', 403)
+            return view(request, question, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _throttled(request, retry_after):
+    response = _error(f'Too many requests. Try again in {retry_after} seconds.', 429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def login_required_json(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return _error('Authentication required.', 401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+@require_http_methods(['GET'])
+@use_replica
+def poll_list(request):
+    """Polls visible to the user, newest first (best match first when searching), with cursor pagination"""
+    polls = Question.objects.visible_to(request.user)
+
+    category_slug = request.GET.get('category')
+    if category_slug:
+        polls = polls.filter(category__slug=category_slug)
+    search_query = request.GET.get('search')
+    ranked_ids = search_polls(search_query) if search_query else None
+    status = request.GET.get('status', 'active')
+    if status == 'upcoming':
+        polls = polls.upcoming()
+    elif status == 'expired':
+        polls = polls.expired()
+    elif status == 'active':
+        polls = polls.active()
+
+    per_page = settings.POLLS_PER_PAGE
+    limit = request.GET.get('limit', '')
+    if limit.isdigit():
+        per_page = min(max(int(limit), 1), MAX_PAGE_SIZE)
+    polls = polls.values(*POLL_FIELDS)
+    if ranked_ids is not None:
+        page = paginate_ranked(polls, ranked_ids, request.GET.get('cursor'), per_page)
+    else:
+        page = paginate_newest_first(polls, request.GET.get('cursor'), per_page)
+    return JsonResponse({
+        'results': [_poll_json(row) for row in page],
+        'next': request.path + page_url(request, page.next_cursor) if page.has_next else None,
+    })
+
+
+@require_http_methods(['GET'])
+@poll_endpoint()
+def poll_detail(request, question):
+    """A poll with its choices (tallies are in the results endpoint)"""
+    now = timezone.now()
+    not_modified = _conditional(request, question, now)
+    if not_modified:
+        return _with_validators(not_modified, question, now)
+
+    data = _poll_json(_question_row(question))
+    # Counts change with every vote; keeping them out lets Last-Modified stay truthful
+    del data['total_votes'], data['unique_voters']
+    data['choices'] = [
+        {**choice, 'image': _media_url(choice['image'])}
+        for choice in Choice.objects.filter(question=question).values(*CHOICE_FIELDS)
+    ]
+    data['results_url'] = reverse('api:poll_results', args=(question.pk,))
+    return _with_validators(JsonResponse(data), question, now)
+
+
+@require_http_methods(['GET'])
+@use_replica
+@poll_endpoint()
+def poll_results(request, question):
+    """Tallies and percentages from the results cache"""
+    now = timezone.now()
+    not_modified = _conditional(request, question, now, last_modified=False)
+    if not_modified:
+        return _with_validators(not_modified, question, now, last_modified=False)
+
+    results = get_results(question)
+    data = {
+        'poll': question.pk,
+        'version': question.results_version,
+        'total_votes': results['total_votes'],
+        'unique_voters': question.unique_voters,
+        'choices': [
+            {'id': choice['id'], 'choice_text': choice['choice_text'],
+             'votes': choice['votes'], 'percentage': choice['percentage']}
+            for choice in results['choices']
+        ],
+    }
+    if 'tabulation' in results:
+        data['tabulation'] = results['tabulation']
+    return _with_validators(JsonResponse(data), question, now, last_modified=False)
+
+
+@require_http_methods(['GET'])
+@use_replica
+@poll_endpoint()
+def poll_timeline(request, question):
+    """Votes per choice per minute, hour or day, read from the rollups
+
+    ?granularity= asks for the finest buckets wanted; coarser ones are used
+    when the poll spans more than POLL_TIMELINE_MAX_BUCKETS of them.
+    """
+    granularity = request.GET.get('granularity') or None
+    if granularity is not None and granularity not in GRANULARITIES:
+        return _error(f'granularity must be one of {", ".join(GRANULARITIES)}.', 400)
+    now = timezone.now()
+    not_modified = _conditional(request, question, now, last_modified=False)
+    if not_modified:
+        return _with_validators(not_modified, question, now, last_modified=False)
+
+    data = {'poll': question.pk, 'version': question.results_version, **timeline(question, granularity, now)}
+    return _with_validators(JsonResponse(data), question, now, last_modified=False)
+
+
+@require_http_methods(['POST'])
+@throttle('vote', on_limit=_throttled)
+@login_required_json
+@poll_endpoint()
+def poll_vote(request, question):
+    """Cast or change a ballot: {"choices": [id, ...]} (best first on ranked polls) or {"choice": id}"""
+    if not question.accepts_votes():
+        return _error('This poll is not currently accepting votes.', 409)
+
+    data = _json_body(request)
+    if data is None:
+        return _error('Expected a JSON object.', 400)
+    choice_ids = data.get('choices', [data['choice']] if 'choice' in data else [])
+    if not isinstance(choice_ids, list) or not choice_ids:
+        return _error('You must select at least one choice.', 400)
+
+    try:
+        result = record_vote(request.user, question, choice_ids)
+    except Choice.DoesNotExist:
+        return _error('You did not select a valid choice.', 400)
+
+    return JsonResponse(
+        {'poll': question.pk, 'choices': result.ranking or sorted(result.choice_ids), 'updated': result.is_update},
+        status=200 if result.is_update else 201,
+    )
+
+
+@require_http_methods(['GET', 'POST'])
+@throttle('comment', on_limit=_throttled)
+@poll_endpoint()
+def poll_comments(request, question):
+    """Newest comments first (paged with ?before=<id>), or add one: {"text": "..."}"""
+    if request.method == 'POST':
+        return _add_comment(request, question)
+
+    comments = Comment.objects.filter(question=question).order_by('-pk')
+    before = request.GET.get('before', '')
+    if before.isdigit():
+        comments = comments.filter(pk__lt=int(before))
+    rows = list(comments.values(*COMMENT_FIELDS)[:COMMENTS_PER_PAGE + 1])
+
+    results = [
+        {'id': row['id'], 'user': row['user__username'], 'text': row['text'],
+         'created_at': row['created_at'], 'is_edited': row['is_edited']}
+        for row in rows[:COMMENTS_PER_PAGE]
+    ]
+    next_url = None
+    if len(rows) > COMMENTS_PER_PAGE:
+        next_url = f'{request.path}?before={rows[COMMENTS_PER_PAGE - 1]["id"]}'
+    return JsonResponse({'results': results, 'next': next_url})
+
+
+@login_required_json
+def _add_comment(request, question):
+    data = _json_body(request)
+    text = str(data.get('text') or '').strip() if data is not None else ''
+    if not text:
+        return _error('Comment cannot be empty.', 400)
+    if len(text) > Comment._meta.get_field('text').max_length:
+        return _error('Comment is too long.', 400)
+
+    comment = Comment.objects.create(question=question, user=request.user, text=text)
+    return JsonResponse({
+        'id': comment.pk, 'user': request.user.username, 'text': comment.text,
+        'created_at': comment.created_at, 'is_edited': comment.is_edited,
+    }, status=201)
+
+
+@require_http_methods(['POST'])
+@throttle('unlock', on_limit=_throttled)
+@poll_endpoint(require_unlock=False)
+def poll_unlock(request, question):
+    """Unlock a password-protected poll with a signed cookie: {"password": "..."}"""
+    if question.visibility != 'password':
+        return JsonResponse({'unlocked': True})
+    data = _json_body(request)
+    if data is None or not question.check_password(str(data.get('password') or '')):
+        return _error('Incorrect password.', 403)
+    return unlock.grant(JsonResponse({'unlocked': True}), question)
@@ -0,0 +1,14 @@
+from django.urls import path
+from . import api
+
+app_name = 'api'
+
+urlpatterns = [
+    path('polls/', api.poll_list, name='poll_list'),
+    path('polls/<int:question_id>/', api.poll_detail, name='poll_detail'),
+    path('polls/<int:question_id>/results/', api.poll_results, name='poll_results'),
+    path('polls/<int:question_id>/timeline/', api.poll_timeline, name='poll_timeline'),
+    path('polls/<int:question_id>/vote/', api.poll_vote, name='poll_vote'),
+    path('polls/<int:question_id>/comments/', api.poll_comments, name='poll_comments'),
+    path('polls/<int:question_id>/unlock/', api.poll_unlock, name='poll_unlock'),
+]
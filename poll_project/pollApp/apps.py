@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PollappConfig(AppConfig):
     name = 'pollApp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,19 @@
+from django.urls import path
+from . import async_views, views
+
+# Same routes as pollApp.urls with the async detail/results/vote views, mounted
+# as a second instance of the 'polls' namespace. Templates rendered here
+# resolve {% url 'polls:...' %} back to this instance, so users stay on the
+# async views while browsing.
+app_name = 'polls'
+
+urlpatterns = [
+    path('', views.index, name='index'),
+    path('<int:question_id>/', async_views.detail, name='detail'),
+    path('<int:question_id>/results/', async_views.results, name='results'),
+    path('<int:question_id>/results/stream/', async_views.results_stream, name='results_stream'),
+    path('<int:question_id>/vote/', async_views.vote, name='vote'),
+    path('<int:question_id>/comment/', views.add_comment, name='add_comment'),
+    path('comment/<int:comment_id>/delete/', views.delete_comment, name='delete_comment'),
+    path('category/<slug:slug>/', views.category_polls, name='category'),
+]
@@ -0,0 +1,274 @@
+"""Async versions of the detail, results and vote views, plus live results
+
+Served under ASGI (poll_project.asgi) at /polls/async/. Database, cache and
+session work is awaited so a worker's event loop can keep many slow clients
+in flight; only the vote write itself, which needs a transaction, runs in a
+thread. Everything a template touches is loaded before rendering, because
+lazy queries are not allowed from async code.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseForbidden, HttpResponseRedirect, StreamingHttpResponse
+from django.shortcuts import render
+from django.urls import reverse
+
+from .models import Choice, Question, Vote
+from .routers import use_replica
+from .services import access, unlock
+from .services.broadcast import get_broadcaster
+from .services.results_cache import aget_results
+from .services.throttle import throttle
+from .services.voting import ranking_from_form, record_vote
+
+
+def _redirect(request, name, *args):
+    """Redirect within the namespace the request came in on (sync or async views)"""
+    namespace = request.resolver_match.namespace if request.resolver_match else None
+    return HttpResponseRedirect(reverse(f'polls:{name}', args=args, current_app=namespace))
+
+
+async def _aget_question(question_id):
+    try:
+        return await Question.objects.select_related('category').aget(pk=question_id)
+    except Question.DoesNotExist:
+        raise Http404('No Question matches the given query.')
+
+
+async def _auser(request):
+    """Resolve the user once, so the auth context processor never queries lazily"""
+    user = await request.auser()
+    request.user = user
+    return user
+
+
+async def _adeny_access(request, user, question, action):
+    """Redirect with an error if the user may not access the poll, else None"""
+    if await access.acan_access(user, question, request):
+        return None
+    if question.is_draft:
+        messages.error(request, 'This poll is not available.')
+    else:
+        messages.error(request, f'You do not have permission to {action} this poll.')
+    return _redirect(request, 'index')
+
+
+async def _acomments_context(question):
+    """Latest comments with their authors, plus the total count"""
+    return {
+        'comments': [comment async for comment in question.comments.select_related('user')[:20]],
+        'comment_count': await question.comments.acount(),
+    }
+
+
+@throttle('unlock')
+async def detail(request, question_id):
+    """Show poll details and voting interface"""
+    question = await _aget_question(question_id)
+    user = await _auser(request)
+
+    # Check draft status and visibility
+    denied = await _adeny_access(request, user, question, 'view')
+    if denied:
+        return denied
+
+    # Handle password-protected polls
+    unlocked_now = False
+    if question.visibility == 'password':
+        if not unlock.is_unlocked(request, question):
+            # Check if password is being submitted
+            if request.method == 'POST' and 'poll_password' in request.POST:
+                entered_password = request.POST.get('poll_password')
+                # Hashing is deliberately slow, so keep it off the event loop
+                if await sync_to_async(question.check_password)(entered_password):
+                    unlocked_now = True
+                else:
+                    messages.error(request, 'Incorrect password.')
+                    return render(request, 'polls/password.html', {'question': question})
+            else:
+                return render(request, 'polls/password.html', {'question': question})
+
+    # Check if user already voted
+    user_ranks = {}
+    if user.is_authenticated:
+        user_ranks = {
+            choice_id: rank async for choice_id, rank in
+            Vote.objects.filter(user=user, question=question).values_list('choice_id', 'rank')
+        }
+
+    choices = [choice async for choice in question.choice_set.all()]
+    for choice in choices:
+        choice.user_rank = user_ranks.get(choice.id)
+
+    context = {
+        'question': question,
+        'choices': choices,
+        'is_invited': await access.ais_invited(user, question, request),
+        'user_votes': list(user_ranks),
+        **await _acomments_context(question),
+    }
+    response = render(request, 'polls/detail.html', context)
+    if unlocked_now:
+        unlock.grant(response, question)
+    return response
+
+
+@use_replica
+async def results(request, question_id):
+    """Display poll results"""
+    question = await _aget_question(question_id)
+    user = await _auser(request)
+
+    # Check draft status and visibility (same as detail)
+    denied = await _adeny_access(request, user, question, 'view')
+    if denied:
+        return denied
+
+    # Handle password-protected polls
+    if question.visibility == 'password':
+        if not unlock.is_unlocked(request, question):
+            messages.warning(request, 'This poll is password protected. Please enter the password first.')
+            return _redirect(request, 'detail', question_id)
+
+    # Check if user voted
+    user_votes = []
+    if user.is_authenticated:
+        user_votes = [
+            vote async for vote in
+            Vote.objects.filter(user=user, question=question).select_related('choice')
+        ]
+
+    # Tallies, percentages and chart data come from the versioned results cache
+    results = await aget_results(question)
+
+    context = {
+        'question': question,
+        'results': results,
+        'choices': results['choices'],
+        'is_invited': await access.ais_invited(user, question, request),
+        'user_votes': user_votes,
+        'user_choice_ids': [vote.choice_id for vote in user_votes],
+        # Live updates need the SSE stream, which is only served under ASGI
+        'live_results': question.is_active() and isinstance(request, ASGIRequest),
+        **await _acomments_context(question),
+    }
+    return render(request, 'polls/results.html', context)
+
+
+@throttle('vote')
+@login_required(login_url='accounts:login')
+async def vote(request, question_id):
+    """Handle voting with support for single and multiple choice"""
+    question = await _aget_question(question_id)
+    user = await _auser(request)
+
+    # Check visibility and password protection
+    denied = await _adeny_access(request, user, question, 'vote on')
+    if denied:
+        return denied
+
+    if question.visibility == 'password':
+        if not unlock.is_unlocked(request, question):
+            messages.warning(request, 'Please enter the password to access this poll.')
+            return _redirect(request, 'detail', question_id)
+
+    # Check if poll is active
+    if not question.accepts_votes():
+        messages.error(request, 'This poll is not currently accepting votes.')
+        return _redirect(request, 'results', question_id)
+
+    if request.method != 'POST':
+        return _redirect(request, 'detail', question_id)
+
+    if question.ranking_method:
+        selected_choices = ranking_from_form(request.POST)
+        if not selected_choices:
+            messages.error(request, 'You must rank at least one choice.')
+            return _redirect(request, 'detail', question_id)
+    elif question.allow_multiple_choices:
+        selected_choices = request.POST.getlist('choice')
+        if not selected_choices:
+            messages.error(request, 'You must select at least one choice.')
+            return _redirect(request, 'detail', question_id)
+    else:
+        selected_choices = request.POST.getlist('choice')[-1:]
+
+    # The ballot is written in one transaction, which has to run in a thread
+    try:
+        if not selected_choices:
+            raise Choice.DoesNotExist
+        result = await sync_to_async(record_vote)(user, question, selected_choices)
+    except Choice.DoesNotExist:
+        messages.error(request, 'You did not select a valid choice.')
+        return _redirect(request, 'detail', question_id)
+
+    if question.ranking_method:
+        messages.success(request, f'Your ranking has been recorded! ({len(result.ranking)} choices)')
+    elif question.allow_multiple_choices:
+        messages.success(request, f'Your votes have been recorded! ({len(result.choice_ids)} choices)')
+    elif result.is_update:
+        messages.success(request, 'Your vote has been updated!')
+    else:
+        messages.success(request, 'Your vote has been recorded!')
+
+    return _redirect(request, 'results', question.id)
+
+
+def _sse(event, data):
+    """Encode one Server-Sent Event; the results version doubles as the event id"""
+    payload = json.dumps(data, separators=(',', ':'))
+    return f'id: {data["v"]}\nevent: {event}\ndata: {payload}\n\n'
+
+
+async def _stream_results(question_id):
+    broadcaster = get_broadcaster()
+    queue = await broadcaster.subscribe(question_id)
+    loop = asyncio.get_running_loop()
+    keepalive = getattr(settings, 'POLL_LIVE_RESULTS_KEEPALIVE', 15)
+    # Streams are recycled now and then; EventSource reconnects on its own
+    deadline = loop.time() + getattr(settings, 'POLL_LIVE_RESULTS_MAX_DURATION', 300)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            timeout = min(keepalive, deadline - loop.time())
+            if timeout <= 0:
+                break
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if event is None:
+                break
+            yield _sse(*event)
+    finally:
+        broadcaster.unsubscribe(question_id, queue)
+
+
+async def results_stream(request, question_id):
+    """Server-Sent Events stream of a poll's vote tallies
+
+    Sends a snapshot ({"v": version, "t": total, "c": {choice id: votes}})
+    on connect, then "tally" events carrying only the choices that changed.
+    Needs ASGI: a WSGI worker would be tied up for the whole stream.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse('Live results need the ASGI server.', status=501, content_type='text/plain')
+
+    question = await _aget_question(question_id)
+    user = await _auser(request)
+    if not await access.acan_access(user, question, request):
+        return HttpResponseForbidden()
+    if not unlock.is_unlocked(request, question):
+        return HttpResponseForbidden()
+
+    response = StreamingHttpResponse(_stream_results(question.pk), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
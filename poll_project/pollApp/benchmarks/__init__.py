@@ -0,0 +1,7 @@
+"""Benchmark scenarios run by ``manage.py bench``
+
+Each scenario module registers itself with ``base.scenario``; importing the
+package loads them all.
+"""
+from .base import SCENARIOS, scenario  # noqa: F401
+from . import asgi, hotpath, render, search, sqlite, tabulation  # noqa: F401
@@ -0,0 +1,74 @@
+import asyncio
+import itertools
+import time
+
+from django.test import AsyncClient
+
+from . import fixtures
+from .base import Measurement, replay, reset_caches, scenario
+
+
+# (page, WSGI path, ASGI path) for one poll
+PAGES = [
+    ('detail', '/polls/{id}/', '/polls/async/{id}/'),
+    ('results', '/polls/{id}/results/', '/polls/async/{id}/results/'),
+]
+
+
+def _paths(template, question_ids, count):
+    ids = itertools.islice(itertools.cycle(question_ids), count)
+    return [template.format(id=question_id) for question_id in ids]
+
+
+def run_wsgi(label, paths, users, concurrency):
+    """Replay paths through the WSGI handler from a pool of threads"""
+    return replay(label, [('get', path, None) for path in paths], users, concurrency)
+
+
+def run_asgi(label, paths, users, concurrency):
+    """Replay paths through the ASGI handler from concurrent tasks on one event loop"""
+    clients = []
+    for index in range(concurrency):
+        client = AsyncClient()
+        client.force_login(users[index % len(users)])
+        clients.append(client)
+
+    async def worker(client, chunk, latencies):
+        for path in chunk:
+            started = time.perf_counter()
+            response = await client.get(path)
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200, (path, response.status_code)
+
+    async def main():
+        latencies = []
+        await asyncio.gather(*(
+            worker(client, paths[index::concurrency], latencies)
+            for index, client in enumerate(clients)
+        ))
+        return latencies
+
+    started = time.perf_counter()
+    latencies = asyncio.run(main())
+    return Measurement(label, latencies, time.perf_counter() - started)
+
+
+@scenario('asgi', 'Requests/second of the detail and results pages, WSGI views vs async views under ASGI')
+def asgi_vs_wsgi(options, write):
+    data = fixtures.seed(polls=options['polls'], users=max(options['concurrency'], 10))
+    count = options['requests']
+    concurrency = options['concurrency']
+
+    measurements = []
+    for page, wsgi_path, asgi_path in PAGES:
+        reset_caches()
+        wsgi = run_wsgi(f'{page} (WSGI, threads)', _paths(wsgi_path, data['question_ids'], count),
+                        data['users'], concurrency)
+        reset_caches()
+        asgi = run_asgi(f'{page} (ASGI, async)', _paths(asgi_path, data['question_ids'], count),
+                        data['users'], concurrency)
+        write(wsgi.summary())
+        write(asgi.summary())
+        write(f'{page}: ASGI/WSGI throughput ratio {asgi.rate / wsgi.rate if wsgi.rate else 0:.2f}')
+        measurements += [wsgi, asgi]
+    return measurements
@@ -0,0 +1,216 @@
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.core.cache import cache
+from django.db import OperationalError, connection, connections
+from django.test import Client
+from django.test.utils import override_settings
+
+from ..services.results_cache import clear_local_results_cache
+
+
+# name -> (function, help text)
+SCENARIOS = {}
+
+
+def scenario(name, help=''):
+    """Register a benchmark; the function gets the command options and a write callable
+
+    It may return a list of Measurements, which go into the JSON report.
+    """
+    def register(func):
+        SCENARIOS[name] = (func, help)
+        return func
+    return register
+
+
+class Measurement:
+    """Latencies of one benchmark run, the wall time it took and, if counted, queries per request"""
+
+    def __init__(self, label, latencies, elapsed, queries=None, locked=0):
+        self.label = label
+        self.latencies = sorted(latencies)
+        self.elapsed = elapsed
+        self.queries = queries
+        # Requests that failed with "database is locked", left out of the latencies
+        self.locked = locked
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    @property
+    def rate(self):
+        return self.requests / self.elapsed if self.elapsed else 0
+
+    def percentile(self, pct):
+        if not self.latencies:
+            return 0
+        index = min(len(self.latencies) - 1, round(pct / 100 * (len(self.latencies) - 1)))
+        return self.latencies[index]
+
+    @property
+    def queries_per_request(self):
+        return statistics.fmean(self.queries) if self.queries else None
+
+    def summary(self):
+        line = (
+            f'{self.label:<28} {self.requests:>6} req {self.rate:>9.1f} req/s  '
+            f'p50 {self.percentile(50) * 1000:7.2f} ms  p95 {self.percentile(95) * 1000:7.2f} ms  '
+            f'p99 {self.percentile(99) * 1000:7.2f} ms  '
+            f'mean {statistics.fmean(self.latencies) * 1000 if self.latencies else 0:7.2f} ms'
+        )
+        if self.queries:
+            line += f'  {self.queries_per_request:5.1f} queries/req'
+        if self.locked:
+            line += f'  {self.locked} "database is locked"'
+        return line
+
+    def as_dict(self):
+        """JSON-ready figures, times in milliseconds"""
+        return {
+            'label': self.label,
+            'requests': self.requests,
+            'rate': round(self.rate, 2),
+            'p50_ms': round(self.percentile(50) * 1000, 3),
+            'p95_ms': round(self.percentile(95) * 1000, 3),
+            'p99_ms': round(self.percentile(99) * 1000, 3),
+            'mean_ms': round(statistics.fmean(self.latencies) * 1000, 3) if self.latencies else 0,
+            'queries_per_request': self.queries_per_request,
+            'locked': self.locked,
+        }
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def replay(label, requests, users, concurrency, expect=None):
+    """Send (method, path, data) requests through the WSGI handler from concurrent test clients
+
+    Each client logs in as one of the users and takes every concurrency-th
+    request. Queries are counted per request on each client's own
+    connection. With a concurrency of 1 the requests run in the calling
+    thread, so they see its (test) transaction. Requests that fail with
+    "database is locked" are counted, as the sqlite scenario does, rather
+    than ending the run.
+    """
+    expect = expect or {'get': 200, 'post': 302}
+    chunks = [requests[i::concurrency] for i in range(concurrency)]
+
+    def worker(index):
+        client = Client()
+        client.force_login(users[index % len(users)])
+        latencies, queries = [], []
+        locked = 0
+        counter = {'queries': 0}
+
+        def count(execute, sql, params, many, context):
+            counter['queries'] += 1
+            return execute(sql, params, many, context)
+
+        try:
+            with connection.execute_wrapper(count):
+                for method, path, data in chunks[index]:
+                    counter['queries'] = 0
+                    started = time.perf_counter()
+                    try:
+                        response = getattr(client, method)(path, data or {})
+                    except OperationalError:
+                        locked += 1
+                        continue
+                    latencies.append(time.perf_counter() - started)
+                    queries.append(counter['queries'])
+                    assert response.status_code == expect[method], (method, path, response.status_code)
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connection.close()
+        return latencies, queries, locked
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        results = [worker(0)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return Measurement(
+        label,
+        [latency for latencies, _, _ in results for latency in latencies],
+        elapsed,
+        [count for _, queries, _ in results for count in queries],
+        sum(locked for _, _, locked in results),
+    )
+
+
+def compare(baseline, current, tolerance=0.25):
+    """Compare two bench JSON reports; returns (report lines, regressions)
+
+    A measurement regresses when its p95 latency is more than tolerance
+    (a fraction) above the baseline's, or when it makes more queries per
+    request. Measurements are matched by scenario and label.
+    """
+    lines, regressions = [], []
+    for name, measurements in current['scenarios'].items():
+        old = {m['label']: m for m in baseline.get('scenarios', {}).get(name, [])}
+        for new in measurements:
+            before = old.get(new['label'])
+            if before is None:
+                lines.append(f'{name}: {new["label"]}: no baseline')
+                continue
+            change = new['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0
+            line = (
+                f'{name}: {new["label"]:<28} p95 {before["p95_ms"]:8.2f} -> {new["p95_ms"]:8.2f} ms '
+                f'({change:+.0%})'
+            )
+            problems = []
+            if change > tolerance:
+                problems.append('slower')
+            if new['queries_per_request'] is not None and before['queries_per_request'] is not None:
+                line += f'  queries/req {before["queries_per_request"]:.1f} -> {new["queries_per_request"]:.1f}'
+                if new['queries_per_request'] > before['queries_per_request'] + 0.01:
+                    problems.append('more queries')
+            if problems:
+                line += f'  REGRESSION: {", ".join(problems)}'
+                regressions.append(line)
+            lines.append(line)
+    return lines, regressions
+
+
+def reset_caches():
+    """Start a run with cold results and invitation caches"""
+    cache.clear()
+    clear_local_results_cache()
+
+
+@contextmanager
+def benchmark_database(alias='default'):
+    """Run against a throwaway test database, never the real one
+
+    SQLite gets a file-backed test database so that the threads of a
+    concurrent run all see the same data.
+    """
+    connection = connections[alias]
+    tmpdir = None
+    if connection.vendor == 'sqlite':
+        tmpdir = tempfile.TemporaryDirectory(prefix='poll-bench-')
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = str(Path(tmpdir.name) / 'bench.sqlite3')
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        # Production-like settings: no query log, and the test client's host allowed.
+        # No throttling: the benchmark clients vote far faster than any person.
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver'], POLL_THROTTLE_RATES={}):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if tmpdir is not None:
+            connection.settings_dict['TEST'].pop('NAME', None)
+            tmpdir.cleanup()
@@ -0,0 +1,53 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import Choice, Question, Vote
+from ..services.search import index_questions
+from ..services.voting import reconcile_vote_counts
+
+
+@transaction.atomic
+def seed(polls=20, choices=4, users=50, votes_per_poll=25, seed=0):
+    """Fill the benchmark database with public polls, users and votes
+
+    Returns the created question ids, each poll's choice ids and the users. Counters are rebuilt with
+    reconcile_vote_counts and the polls are indexed for search, the same way
+    an operator would after a bulk load.
+    """
+    rng = random.Random(seed)
+    password = make_password('bench-password')
+    User.objects.bulk_create([
+        User(username=f'bench-user-{i}', password=password) for i in range(users)
+    ])
+    voters = list(User.objects.filter(username__startswith='bench-user-').order_by('pk'))
+
+    now = timezone.now()
+    questions = Question.objects.bulk_create([
+        Question(
+            question_text=f'Benchmark poll {i}', description='Seeded for benchmarks',
+            pub_date=now - timedelta(minutes=i), created_by=voters[0],
+        )
+        for i in range(polls)
+    ])
+    Choice.objects.bulk_create([
+        Choice(question=question, choice_text=f'Option {j}')
+        for question in questions for j in range(choices)
+    ])
+
+    choice_ids = {}
+    for question_id, choice_id in Choice.objects.values_list('question_id', 'id'):
+        choice_ids.setdefault(question_id, []).append(choice_id)
+    Vote.objects.bulk_create([
+        Vote(user=user, question_id=question.pk, choice_id=rng.choice(choice_ids[question.pk]), single_choice=True)
+        for question in questions
+        for user in rng.sample(voters, min(votes_per_poll, len(voters)))
+    ])
+    reconcile_vote_counts()
+    index_questions([question.pk for question in questions])
+
+    return {'question_ids': [question.pk for question in questions], 'choice_ids': choice_ids, 'users': voters}
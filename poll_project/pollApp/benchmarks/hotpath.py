@@ -0,0 +1,39 @@
+import itertools
+import random
+
+from django.urls import reverse
+
+from . import fixtures
+from .base import replay, reset_caches, scenario
+
+
+def hot_path_requests(data, count, rng):
+    """(page, requests) for each page of the hot path, spread over the seeded polls"""
+    question_ids = list(itertools.islice(itertools.cycle(data['question_ids']), count))
+    return [
+        ('index', [('get', reverse('polls:index'), None)] * count),
+        ('detail', [('get', reverse('polls:detail', args=(pk,)), None) for pk in question_ids]),
+        ('results', [('get', reverse('polls:results', args=(pk,)), None) for pk in question_ids]),
+        # A different choice each time, so most ballots change something
+        ('vote', [
+            ('post', reverse('polls:vote', args=(pk,)), {'choice': rng.choice(data['choice_ids'][pk])})
+            for pk in question_ids
+        ]),
+        ('profile', [('get', reverse('accounts:profile'), None)] * count),
+    ]
+
+
+@scenario('hotpath', 'Latency percentiles and queries per request of index, detail, results, vote and profile')
+def hot_path(options, write):
+    data = fixtures.seed(
+        polls=options['polls'], choices=options['choices'], users=options['users'],
+        votes_per_poll=options['votes_per_poll'],
+    )
+    rng = random.Random(0)
+    measurements = []
+    for page, requests in hot_path_requests(data, options['requests'], rng):
+        reset_caches()
+        measurement = replay(page, requests, data['users'], options['concurrency'])
+        write(measurement.summary())
+        measurements.append(measurement)
+    return measurements
@@ -0,0 +1,41 @@
+import time
+
+from django.test import Client
+from django.test.utils import override_settings
+
+from . import fixtures
+from .base import Measurement, reset_caches, scenario
+
+
+CARDS_PER_PAGE = 50
+
+
+def measure_page(label, client, path, count):
+    client.get(path)  # warm up: template compilation and, when enabled, the card cache
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(count):
+        began = time.perf_counter()
+        response = client.get(path)
+        latencies.append(time.perf_counter() - began)
+        assert response.status_code == 200, (path, response.status_code)
+    return Measurement(label, latencies, time.perf_counter() - started)
+
+
+@scenario('render', f'Front page with {CARDS_PER_PAGE} poll cards, with and without the card cache')
+def render_time(options, write):
+    data = fixtures.seed(polls=CARDS_PER_PAGE)
+    anonymous = Client()
+    member = Client()
+    member.force_login(data['users'][0])
+
+    measurements = []
+    with override_settings(POLLS_PER_PAGE=CARDS_PER_PAGE):
+        for label, timeout in (('no card cache', 0), ('card cache', 600)):
+            with override_settings(POLL_CARD_CACHE_TIMEOUT=timeout):
+                for viewer, client in (('anonymous', anonymous), ('logged in', member)):
+                    reset_caches()
+                    measurement = measure_page(f'{label}, {viewer}', client, '/polls/?status=all', options['requests'])
+                    write(measurement.summary())
+                    measurements.append(measurement)
+    return measurements
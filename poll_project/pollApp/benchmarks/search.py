@@ -0,0 +1,92 @@
+import itertools
+import random
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import Choice, Question
+from ..services.search import get_backend, index_questions, search_polls
+from .base import Measurement, scenario
+
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'po', 'da', 'fe', 'gu', 'hi', 'jo', 'bel']
+
+
+def vocabulary(size, rng):
+    """Deterministic pseudo-words, so queries hit a realistic spread of rare and common terms"""
+    words = {''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(size * 2)}
+    return sorted(words)[:size]
+
+
+def seed_polls(count, rng, write, batch_size=10000):
+    words = vocabulary(5000, rng)
+    # Zipf-like skew: a few words are very common, most are rare
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    now = timezone.now()
+
+    def text(length):
+        return ' '.join(rng.choices(words, cum_weights=cum_weights, k=length))
+
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        with transaction.atomic():
+            questions = Question.objects.bulk_create([
+                Question(
+                    question_text=text(6), description=text(12),
+                    pub_date=now - timedelta(seconds=created + i),
+                )
+                for i in range(size)
+            ])
+            Choice.objects.bulk_create([
+                Choice(question=question, choice_text=text(2))
+                for question in questions for _ in range(3)
+            ])
+            index_questions([question.pk for question in questions])
+        created += size
+        if created % (batch_size * 10) == 0 or created == count:
+            write(f'  seeded {created} polls')
+    return words
+
+
+def measure(label, queries, run):
+    latencies = []
+    started = time.perf_counter()
+    for query in queries:
+        began = time.perf_counter()
+        run(query)
+        latencies.append(time.perf_counter() - began)
+    return Measurement(label, latencies, time.perf_counter() - started)
+
+
+@scenario('search', 'Full-text search latency against the old icontains scan (default 1M polls)')
+def search_latency(options, write):
+    rng = random.Random(0)
+    count = options['search_polls']
+    write(f'Seeding {count} polls ({get_backend().name} backend)...')
+    words = seed_polls(count, rng, write)
+
+    common, rare = words[:50], words[-2000:]
+    queries = list(itertools.chain(
+        rng.sample(rare, 40),
+        (f'{rng.choice(common)} {rng.choice(rare)}' for _ in range(40)),
+        (word[:3] for word in rng.sample(common, 20)),
+    ))
+    rng.shuffle(queries)
+
+    indexed = measure('search index', queries, search_polls)
+    write(indexed.summary())
+
+    def icontains(query):
+        list(
+            Question.objects.filter(Q(question_text__icontains=query) | Q(description__icontains=query))
+            .order_by('-pub_date').values_list('pk', flat=True)[:20]
+        )
+
+    # The scan is slow, so only a sample of the same queries
+    scan = measure('icontains scan', queries[:10], icontains)
+    write(scan.summary())
+    return [indexed, scan]
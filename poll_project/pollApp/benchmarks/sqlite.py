@@ -0,0 +1,95 @@
+import multiprocessing
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connection, connections
+
+from ..models import Choice, Question
+from ..services.voting import record_vote
+from . import fixtures
+from .base import scenario
+
+
+# (label, SQLITE_PROFILE, database settings for that profile); both start
+# write transactions with BEGIN IMMEDIATE, as settings.py does
+PROFILES = [
+    ('default', 'default', {'CONN_MAX_AGE': 0, 'OPTIONS': {'transaction_mode': 'IMMEDIATE'}}),
+    ('performance', 'performance', {'CONN_MAX_AGE': 600, 'OPTIONS': {'transaction_mode': 'IMMEDIATE'}}),
+]
+
+
+def _use_profile(profile, db_settings):
+    """Point the default connection at a profile; takes effect on the next connection"""
+    connections.close_all()
+    connection.settings_dict.update(db_settings)
+    settings.SQLITE_PROFILE = profile
+
+
+def _voter(worker, users, ballots, results):
+    """Cast ballots like a request would, closing the connection when the profile says so"""
+    rng = random.Random(worker)
+    cast = locked = 0
+    for user_id, question_id in ballots:
+        try:
+            user = users[user_id]
+            question = Question.objects.get(pk=question_id)
+            choice_id = rng.choice(list(Choice.objects.filter(question_id=question_id).values_list('pk', flat=True)))
+            record_vote(user, question, [choice_id])
+            cast += 1
+        except OperationalError:
+            locked += 1
+        # End of "request": CONN_MAX_AGE decides whether the connection survives
+        close_old_connections()
+    connections.close_all()
+    results.put((cast, locked))
+
+
+def run_profile(label, profile, db_settings, ballots_per_worker, workers, data):
+    """Vote from forked worker processes against the benchmark database file"""
+    _use_profile(profile, db_settings)
+    with connection.cursor() as cursor:
+        # WAL is persistent in the file, so switch back explicitly for the baseline
+        cursor.execute(f"PRAGMA journal_mode = {'WAL' if profile == 'performance' else 'DELETE'}")
+    connections.close_all()
+
+    users = {user.pk: user for user in data['users']}
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    rng = random.Random(0)
+    processes = []
+    for worker in range(workers):
+        # Each worker votes as its own users, as separate browsers would
+        own_users = list(users)[worker::workers]
+        ballots = [
+            (rng.choice(own_users), rng.choice(data['question_ids']))
+            for _ in range(ballots_per_worker)
+        ]
+        processes.append(context.Process(target=_voter, args=(worker, users, ballots, results)))
+
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    cast = sum(done for done, _ in totals)
+    locked = sum(failed for _, failed in totals)
+    return f'{label:<12} {workers} workers  {cast:>6} votes  {cast / elapsed:>8.1f} votes/s  {locked:>5} "database is locked"'
+
+
+@scenario('sqlite', 'Vote throughput from several worker processes, default SQLite settings vs the performance profile')
+def sqlite_profiles(options, write):
+    if connection.vendor != 'sqlite':
+        write('Skipped: the default database is not SQLite.')
+        return
+    workers = options['workers']
+    data = fixtures.seed(polls=options['polls'], users=max(workers * 10, 50))
+    original = (settings.SQLITE_PROFILE, {key: connection.settings_dict.get(key) for key in ('CONN_MAX_AGE', 'OPTIONS')})
+    try:
+        for label, profile, db_settings in PROFILES:
+            write(run_profile(label, profile, db_settings, options['requests'], workers, data))
+    finally:
+        _use_profile(original[0], original[1])
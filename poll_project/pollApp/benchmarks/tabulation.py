@@ -0,0 +1,52 @@
+import random
+import time
+
+from ..services import tabulation
+from .base import Measurement, scenario
+
+
+RUNS = 5
+
+
+def random_ballots(count, choices, rng):
+    """Rankings of 1..choices choices, skewed so some choices are clearly more popular"""
+    weights = [choices - index for index in range(choices)]
+    ballots = []
+    for _ in range(count):
+        length = rng.randint(1, choices)
+        ranking = []
+        while len(ranking) < length:
+            choice = rng.choices(range(choices), weights=weights)[0]
+            if choice not in ranking:
+                ranking.append(choice)
+        ballots.append(ranking)
+    return ballots
+
+
+@scenario('tabulate', 'Instant runoff, Borda and Condorcet over --ballots ranked ballots of --choices choices')
+def tabulate(options, write):
+    count, size = options['ballots'], options['choices']
+    write(f'Generating {count} ballots over {size} choices '
+          f'({"NumPy" if tabulation.numpy is not None else "array"} primitives)...')
+    ballots = random_ballots(count, size, random.Random(0))
+    choices = [(index, f'Choice {index}') for index in range(size)]
+
+    started = time.perf_counter()
+    packed = tabulation.pack(choices, ballots)
+    packing = Measurement('pack', [time.perf_counter() - started], time.perf_counter() - started)
+    write(packing.summary())
+    write(f'{packed.rows} distinct rankings')
+
+    measurements = [packing]
+    for method, tabulate_ballots in tabulation.METHODS.items():
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(RUNS):
+            began = time.perf_counter()
+            outcome = tabulate_ballots(packed)
+            latencies.append(time.perf_counter() - began)
+        measurement = Measurement(method, latencies, time.perf_counter() - started)
+        write(measurement.summary())
+        write(f'  winner: {outcome["winner"]["choice_text"] if outcome["winner"] else "none"}')
+        measurements.append(measurement)
+    return measurements
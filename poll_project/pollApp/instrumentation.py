@@ -0,0 +1,144 @@
+"""Per-request query count, SQL time, template time and wall time by view
+
+RequestMetricsMiddleware opens a RequestStats for each request and records it
+into services.metrics under the resolved view name (e.g. 'polls:index') once
+the response is ready. Queries are counted by record_query, an execute
+wrapper installed on every database connection as it is created, so queries
+run by async views in sync_to_async threads are counted too; templates are
+timed by the DjangoTemplates backend below. SQL run lazily while a template
+renders counts towards both.
+
+POLL_QUERY_BUDGETS caps the queries of a view; a request over its budget is
+counted and logged, or raises QueryBudgetExceeded when
+POLL_QUERY_BUDGET_ACTION is 'raise' (as it is under test).
+"""
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.template.backends import django as django_backend
+from django.utils.decorators import sync_and_async_middleware
+
+from .services.metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+# Stats of the request being handled in this context; None outside requests
+_current = ContextVar('poll_request_stats', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper that counts and times queries made during a request"""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.sql_time += time.perf_counter() - start
+
+
+def install(connection):
+    # connection_created fires again on reconnect; the wrapper list outlives it
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return super().render(context, request)
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - start
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The Django template backend, timing each top-level render"""
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
+
+
+def view_names(request):
+    """(label, budget key) for the request's view
+
+    The budget key uses the application namespace, so 'polls-async:detail'
+    shares the budget of 'polls:detail'.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved', None
+    return match.view_name, ':'.join([*match.app_names, match.url_name or match.view_name])
+
+
+def budget_for(view, budget_key):
+    budgets = getattr(settings, 'POLL_QUERY_BUDGETS', {})
+    return budgets.get(view, budgets.get(budget_key))
+
+
+def _record(request, stats):
+    view, budget_key = view_names(request)
+    registry.observe('poll_request_duration_seconds', view, time.perf_counter() - stats.started)
+    registry.observe('poll_request_queries', view, stats.queries)
+    registry.observe('poll_request_sql_seconds', view, stats.sql_time)
+    registry.observe('poll_request_template_seconds', view, stats.template_time)
+
+    budget = budget_for(view, budget_key)
+    if budget is None or stats.queries <= budget:
+        return
+    registry.increment('poll_query_budget_exceeded_total', view)
+    message = f'{view} made {stats.queries} queries, over its budget of {budget} ({request.method} {request.path})'
+    if getattr(settings, 'POLL_QUERY_BUDGET_ACTION', 'log') == 'raise':
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+@sync_and_async_middleware
+def RequestMetricsMiddleware(get_response):
+    """Record query, SQL, template and wall time of each request by view"""
+    if iscoroutinefunction(get_response):
+        async def async_middleware(request):
+            stats = RequestStats()
+            token = _current.set(stats)
+            try:
+                response = await get_response(request)
+            finally:
+                _current.reset(token)
+            _record(request, stats)
+            return response
+        return async_middleware
+
+    def middleware(request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        try:
+            response = get_response(request)
+        finally:
+            _current.reset(token)
+        _record(request, stats)
+        return response
+    return middleware
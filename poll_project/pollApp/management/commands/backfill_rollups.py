@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from pollApp.services.rollups import backfill_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the minute/hour/day vote timeline rollups from Vote.voted_at'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--question', type=int, action='append', dest='question_ids',
+            help='Only rebuild this question (can be repeated)',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        written = backfill_rollups(options['question_ids'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} rollup rows.'))
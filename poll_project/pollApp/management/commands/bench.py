@@ -0,0 +1,89 @@
+import json
+import platform
+from pathlib import Path
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from pollApp.benchmarks import SCENARIOS
+from pollApp.benchmarks.base import benchmark_database, compare
+
+
+class Command(BaseCommand):
+    help = 'Run performance benchmarks against a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='Scenarios to run (default: all)')
+        parser.add_argument('--list', action='store_true', help='List the available scenarios')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per measurement')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+        parser.add_argument('--polls', type=int, default=20, help='Polls to seed')
+        parser.add_argument('--choices', type=int, default=4, help='Choices per seeded poll')
+        parser.add_argument('--users', type=int, default=50, help='Users to seed')
+        parser.add_argument('--votes-per-poll', type=int, default=25, help='Votes to seed on each poll')
+        parser.add_argument('--workers', type=int, default=4, help='Worker processes for multi-process scenarios')
+        parser.add_argument(
+            '--search-polls', type=int, default=10000,
+            help='Polls to seed for the search scenario (1000000 takes several minutes)',
+        )
+        parser.add_argument('--ballots', type=int, default=10000, help='Ranked ballots for the tabulate scenario')
+        parser.add_argument('--json', metavar='FILE', help='Write the measurements to a JSON file')
+        parser.add_argument('--compare', metavar='FILE', help='Compare against a JSON file from an earlier run')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='With --compare, how much slower (as a fraction) p95 latency may get before it is a regression',
+        )
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name, (_, help_text) in sorted(SCENARIOS.items()):
+                self.stdout.write(f'{name:<12} {help_text}')
+            return
+
+        names = options['scenarios'] or sorted(SCENARIOS)
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f"Unknown scenario(s): {', '.join(unknown)}. Use --list to see them.")
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be positive.')
+        baseline = None
+        if options['compare']:
+            try:
+                baseline = json.loads(Path(options['compare']).read_text())
+            except (OSError, ValueError) as exc:
+                raise CommandError(f'Cannot read {options["compare"]}: {exc}')
+
+        report = {
+            'created': timezone.now().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+            },
+            'options': {
+                key: options[key] for key in
+                ('requests', 'concurrency', 'polls', 'choices', 'users', 'votes_per_poll', 'workers')
+            },
+            'scenarios': {},
+        }
+        for name in names:
+            func, _ = SCENARIOS[name]
+            self.stdout.write(self.style.MIGRATE_HEADING(f'== {name} =='))
+            # Every scenario seeds its own fresh database
+            with benchmark_database():
+                measurements = func(options, self.stdout.write)
+            if measurements:
+                report['scenarios'][name] = [measurement.as_dict() for measurement in measurements]
+
+        if options['json']:
+            Path(options['json']).write_text(json.dumps(report, indent=2) + '\n')
+            self.stdout.write(f'Wrote {options["json"]}')
+        if baseline is not None:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'== compared with {options["compare"]} =='))
+            lines, regressions = compare(baseline, report, options['tolerance'])
+            for line in lines:
+                self.stdout.write(line)
+            if regressions:
+                raise CommandError(f'{len(regressions)} regression(s) against {options["compare"]}')
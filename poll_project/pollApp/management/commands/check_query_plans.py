@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from pollApp.benchmarks import fixtures
+from pollApp.benchmarks.base import benchmark_database, reset_caches
+from pollApp.models import Category, Choice, Comment, Question
+from pollApp.services.query_plans import ALLOWED_SCANS, capture_queries, check_plans
+
+
+class Command(BaseCommand):
+    help = (
+        "Request every poll page against a seeded test database, EXPLAIN each query "
+        "and fail if any of them scans a whole table"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--polls', type=int, default=200, help='Polls to seed')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            anonymous, logged_in, user = self._pages(options['polls'])
+            reset_caches()
+            captured = capture_queries(anonymous) + capture_queries(logged_in, user)
+            explained, problems = check_plans(captured)
+
+        if options['verbosity'] > 1:
+            for page, sql in captured:
+                self.stdout.write(f'[{page}] {sql}')
+
+        for problem in problems:
+            self.stderr.write(self.style.ERROR(f'[{problem.page}] full scan of {problem.table}:'))
+            self.stderr.write(f'  {problem.sql}')
+            for line in problem.plan:
+                self.stderr.write(f'    {line}')
+
+        allowed = ', '.join(sorted(ALLOWED_SCANS))
+        if problems:
+            raise CommandError(f'{len(problems)} of {explained} queries scan a whole table (allowed: {allowed}).')
+        self.stdout.write(self.style.SUCCESS(f'{explained} queries checked, no full table scans (allowed: {allowed}).'))
+
+    def _pages(self, polls):
+        """Seed a realistic mix of polls and list the pages to request"""
+        data = fixtures.seed(polls=polls, users=20, votes_per_poll=10)
+        user = data['users'][1]
+        question = Question.objects.get(pk=data['question_ids'][0])
+        category = Category.objects.create(name='Checks', slug='checks')
+        Question.objects.filter(pk__in=data['question_ids'][::2]).update(category=category)
+        private = Question.objects.create(
+            question_text='Private check poll', pub_date=question.pub_date, visibility='private',
+            created_by=data['users'][0],
+        )
+        private.invited_users.add(user)
+        Comment.objects.create(question=question, user=user, text='Plan check comment')
+        choice = Choice.objects.filter(question=question).first()
+
+        qid = question.pk
+        anonymous = [
+            ('index', 'get', reverse('polls:index'), None),
+            ('index (all)', 'get', reverse('polls:index'), {'status': 'all'}),
+            ('index (search)', 'get', reverse('polls:index'), {'search': 'benchmark'}),
+            ('category', 'get', reverse('polls:category', args=(category.slug,)), None),
+            ('detail', 'get', reverse('polls:detail', args=(qid,)), None),
+            ('results', 'get', reverse('polls:results', args=(qid,)), None),
+            ('api list', 'get', reverse('api:poll_list'), None),
+            ('api detail', 'get', reverse('api:poll_detail', args=(qid,)), None),
+            ('api results', 'get', reverse('api:poll_results', args=(qid,)), None),
+            ('api comments', 'get', reverse('api:poll_comments', args=(qid,)), None),
+        ]
+        logged_in = [
+            ('index (user)', 'get', reverse('polls:index'), None),
+            ('index (user, category)', 'get', reverse('polls:index'), {'category': category.slug}),
+            ('detail (user)', 'get', reverse('polls:detail', args=(qid,)), None),
+            ('detail (private)', 'get', reverse('polls:detail', args=(private.pk,)), None),
+            ('vote', 'post', reverse('polls:vote', args=(qid,)), {'choice': choice.pk}),
+            ('results (user)', 'get', reverse('polls:results', args=(qid,)), None),
+            ('profile', 'get', reverse('accounts:profile'), None),
+            ('api list (user)', 'get', reverse('api:poll_list'), None),
+        ]
+        return anonymous, logged_in, user
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pollApp.services.export import (
+    DEFAULT_CHUNK_SIZE, EXPORT_FORMATS, export_lines, filter_votes, parse_bound,
+)
+
+
+class Command(BaseCommand):
+    help = 'Stream Vote rows as CSV or NDJSON in constant memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument(
+            '--question', type=int, action='append', dest='question_ids',
+            help='Only export votes on this question (can be repeated)',
+        )
+        parser.add_argument('--category', help='Only export votes on polls in this category (slug)')
+        parser.add_argument('--since', help='Only votes cast on or after this date/datetime')
+        parser.add_argument('--until', help='Only votes cast on or before this date/datetime')
+        parser.add_argument('--output', '-o', help='Write to this file instead of stdout')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_bound(options['since'])
+            until = parse_bound(options['until'], end_of_day=True)
+        except ValueError as e:
+            raise CommandError(e)
+
+        votes = filter_votes(options['question_ids'], options['category'], since, until)
+        lines = export_lines(votes, options['format'], options['chunk_size'])
+
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            output.writelines(lines)
+        self.stderr.write(self.style.SUCCESS(f"Exported votes to {options['output']}."))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pollApp.services.importer import CSV_LIST_SEPARATOR, IMPORT_FORMATS, PollImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk-load polls from a JSON Lines or CSV file. Columns: question_text, description, '
+        'category, pub_date, start_date, end_date, visibility, password, allow_multiple_choices, ranking_method, '
+        f'is_draft, created_by, choices and invited_users (lists, "{CSV_LIST_SEPARATOR}"-separated in CSV).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import')
+        parser.add_argument('--format', choices=IMPORT_FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Validate without writing anything')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        import_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+
+        importer = PollImporter(
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+            progress=self._progress if options['verbosity'] > 1 else None,
+        )
+        try:
+            with open(path, newline='', encoding='utf-8') as stream:
+                report = importer.run(read_rows(stream, import_format))
+        except OSError as e:
+            raise CommandError(e)
+
+        for line_no, message in report.errors:
+            self.stderr.write(f'line {line_no}: {message}')
+
+        verb = 'Validated' if options['dry_run'] else 'Imported'
+        summary = (
+            f'{verb} {report.created} polls in {report.elapsed:.1f}s '
+            f'({report.rate:.0f} polls/s), {len(report.errors)} rows rejected.'
+        )
+        self.stdout.write(self.style.SUCCESS(summary) if not report.errors else self.style.WARNING(summary))
+
+    def _progress(self, report):
+        self.stderr.write(f'{report.created} polls, {report.rate:.0f}/s')
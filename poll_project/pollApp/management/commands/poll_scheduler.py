@@ -0,0 +1,35 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pollApp.services import scheduler
+
+
+class Command(BaseCommand):
+    help = 'Open and close polls at their start and end dates, freezing the results of closed polls'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Apply the transitions that are due and exit (e.g. from cron)',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=getattr(settings, 'POLL_SCHEDULER_INTERVAL', 1.0),
+            help='Longest sleep between checks for new or edited polls, in seconds',
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            changed = scheduler.transition()
+            self.stdout.write(self.style.SUCCESS(f'Moved {len(changed)} polls to their new status.'))
+            return
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        self.stdout.write('Scheduling poll starts and ends.')
+        try:
+            scheduler.run(stop, options['interval'])
+        except KeyboardInterrupt:
+            pass
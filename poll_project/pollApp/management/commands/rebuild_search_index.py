@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from pollApp.services.search import get_backend, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the poll search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        progress = None
+        if options['verbosity'] > 1:
+            progress = lambda count: self.stderr.write(f'{count} polls indexed')
+        count = rebuild_index(options['batch_size'], progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count} polls with the {get_backend().name} backend.'
+        ))
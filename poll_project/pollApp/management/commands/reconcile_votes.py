@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from pollApp.services.voting import reconcile_vote_counts
+
+
+class Command(BaseCommand):
+    help = 'Rebuild Choice.votes, Question.total_votes and Question.unique_voters from the Vote table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--question', type=int, action='append', dest='question_ids',
+            help='Only reconcile this question (can be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        choices, questions = reconcile_vote_counts(options['question_ids'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Reconciled vote counts for {choices} choices and {questions} polls.'
+        ))
@@ -0,0 +1,72 @@
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from pollApp.services import jobs
+
+
+def _worker(stop, burst, poll_interval, results):
+    # Ctrl+C reaches the whole process group; let the parent tell us to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        results.put(jobs.work(stop=stop, burst=burst, poll_interval=poll_interval))
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (poll deletes, counter reconciliation, exports, rollup rebuilds)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=getattr(settings, 'POLL_JOB_WORKERS', 2),
+            help='Worker processes; 1 runs the jobs in this process',
+        )
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is due')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between checks for new jobs')
+
+    def handle(self, *args, **options):
+        processes, burst, poll_interval = options['processes'], options['burst'], options['poll_interval']
+        if processes < 1:
+            raise CommandError('--processes must be at least 1.')
+
+        if processes == 1:
+            try:
+                ran = jobs.work(burst=burst, poll_interval=poll_interval)
+            except KeyboardInterrupt:
+                return
+            self.stdout.write(self.style.SUCCESS(f'Ran {ran} jobs.'))
+            return
+
+        # Children must not share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        results = context.Queue()
+        workers = [
+            context.Process(target=_worker, args=(stop, burst, poll_interval, results))
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f'Started {processes} workers.')
+
+        def shut_down(signum, frame):
+            # Workers finish the job at hand, then exit
+            stop.set()
+
+        signal.signal(signal.SIGTERM, shut_down)
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+        ran = sum(results.get() for worker in workers if worker.exitcode == 0)
+        self.stdout.write(self.style.SUCCESS(f'Ran {ran} jobs.'))
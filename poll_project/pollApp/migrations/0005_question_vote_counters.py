@@ -0,0 +1,39 @@
+# Generated by Django 6.0.1 on 2026-10-17 00:15
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_vote_counters(apps, schema_editor):
+    Question = apps.get_model('pollApp', 'Question')
+    Vote = apps.get_model('pollApp', 'Vote')
+    totals = (
+        Vote.objects.order_by()
+        .values('question')
+        .annotate(total=Count('pk'), voters=Count('user', distinct=True))
+    )
+    for row in totals.iterator():
+        Question.objects.filter(pk=row['question']).update(
+            total_votes=row['total'], unique_voters=row['voters']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollApp', '0004_question_invited_users'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='total_votes',
+            field=models.IntegerField(default=0, help_text='Number of Vote rows for this poll'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='unique_voters',
+            field=models.IntegerField(default=0, help_text='Number of users who voted on this poll'),
+        ),
+        migrations.RunPython(populate_vote_counters, migrations.RunPython.noop),
+    ]
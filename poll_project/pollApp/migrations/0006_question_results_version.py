@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 00:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollApp', '0005_question_vote_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='results_version',
+            field=models.PositiveIntegerField(default=0, help_text='Bumped whenever the results change'),
+        ),
+    ]
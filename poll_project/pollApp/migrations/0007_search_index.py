@@ -0,0 +1,130 @@
+# Generated by Django 6.0.1 on 2026-10-17 00:31
+
+import re
+import unicodedata
+from collections import Counter
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# The search index as it was defined when this migration was written; later
+# changes to pollApp.services.search must not change what it does
+FTS_TABLE = 'pollapp_search'
+FIELD_WEIGHTS = {
+    'question_text': 10.0,
+    'description': 2.0,
+    'choices': 4.0,
+    'category': 3.0,
+}
+MAX_TERM_LENGTH = 64
+TOKEN_RE = re.compile(r'\w+')
+BATCH_SIZE = 5000
+
+
+def tokenize(text):
+    text = unicodedata.normalize('NFKD', text or '').lower()
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(text.replace('_', ' '))]
+
+
+def fts5_available(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any(option == 'ENABLE_FTS5' for option, in cursor.fetchall())
+
+
+def documents(Question, Choice, db_alias):
+    """Search documents of every existing poll, in batches"""
+    last = 0
+    while True:
+        rows = list(
+            Question.objects.using(db_alias).filter(pk__gt=last).order_by('pk')
+            .values('id', 'question_text', 'description', 'category__name')[:BATCH_SIZE]
+        )
+        if not rows:
+            return
+        last = rows[-1]['id']
+        choices = {row['id']: [] for row in rows}
+        for question_id, choice_text in (
+            Choice.objects.using(db_alias).filter(question_id__in=choices).order_by('pk')
+            .values_list('question_id', 'choice_text')
+        ):
+            choices[question_id].append(choice_text)
+        yield [
+            {
+                'id': row['id'],
+                'question_text': row['question_text'],
+                'description': row['description'],
+                'choices': ' '.join(choices[row['id']]),
+                'category': row['category__name'] or '',
+            }
+            for row in rows
+        ]
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    db_alias = connection.alias
+    backend = getattr(settings, 'POLL_SEARCH_BACKEND', 'auto')
+    use_fts5 = fts5_available(connection) and backend != 'terms'
+    if fts5_available(connection):
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+            f"{', '.join(FIELD_WEIGHTS)}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+
+    # Index the polls that already exist
+    Question = apps.get_model('pollApp', 'Question')
+    Choice = apps.get_model('pollApp', 'Choice')
+    SearchTerm = apps.get_model('pollApp', 'SearchTerm')
+    fields = list(FIELD_WEIGHTS)
+    for batch in documents(Question, Choice, db_alias):
+        if use_fts5:
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(fields)}) VALUES (%s{', %s' * len(fields)})",
+                    [[document['id']] + [document[field] for field in fields] for document in batch],
+                )
+            continue
+        rows = []
+        for document in batch:
+            weights = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                for term in tokenize(document[field]):
+                    weights[term] += weight
+            rows.extend(
+                SearchTerm(term=term, question_id=document['id'], weight=weight)
+                for term, weight in weights.items()
+            )
+        SearchTerm.objects.using(db_alias).bulk_create(rows, batch_size=1000)
+
+
+def drop_search_index(apps, schema_editor):
+    schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollApp', '0006_question_results_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.FloatField()),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pollApp.question')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'question'], name='pollapp_search_term_idx')],
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-17 00:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollApp', '0007_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['question', '-created_at'], name='pollapp_comment_q_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['is_draft', 'visibility', '-pub_date', '-id'], name='pollapp_q_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(condition=models.Q(('is_draft', False)), fields=['category', '-pub_date', '-id'], name='pollapp_q_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['user', 'question', 'choice'], name='pollapp_vote_user_q_idx'),
+        ),
+    ]
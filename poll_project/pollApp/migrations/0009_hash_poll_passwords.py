@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-17 00:48
+
+from django.contrib.auth import hashers
+from django.db import migrations, models
+
+
+def hash_plaintext_passwords(apps, schema_editor):
+    Question = apps.get_model('pollApp', 'Question')
+    for question in Question.objects.exclude(password='').only('pk', 'password').iterator():
+        try:
+            hashers.identify_hasher(question.password)
+        except ValueError:
+            # Not a hash yet: a plaintext password from before this migration
+            Question.objects.filter(pk=question.pk).update(password=hashers.make_password(question.password))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollApp', '0008_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='question',
+            name='password',
+            field=models.CharField(blank=True, help_text='Required if visibility is password protected; stored hashed (see set_password)', max_length=128),
+        ),
+        # Hashes can't be turned back into passwords, so there is nothing to undo
+        migrations.RunPython(hash_plaintext_passwords, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-17 01:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollApp', '0009_hash_poll_passwords'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='ranking_method',
+            field=models.CharField(blank=True, choices=[('irv', 'Instant runoff'), ('borda', 'Borda count'), ('condorcet', 'Condorcet')], help_text='Collect ranked ballots and pick the winner with this method', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='rank',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Preference on ranked polls, 1 being the first', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(condition=models.Q(('rank__isnull', False)), fields=['question', 'user', 'rank'], name='pollapp_vote_ballot_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-17 02:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollApp', '0010_ranked_ballots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour'), ('day', 'Day')], max_length=6)),
+                ('bucket', models.DateTimeField(help_text='Start of the minute, hour or day (UTC)')),
+                ('votes', models.IntegerField(default=0, help_text='Votes added minus votes withdrawn in the bucket')),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pollApp.choice')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pollApp.question')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('question', 'granularity', 'bucket', 'choice'), name='pollapp_rollup_bucket_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 6.0.1 on 2026-10-17 04:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def set_statuses(apps, schema_editor):
+    Question = apps.get_model('pollApp', 'Question')
+    now = timezone.now()
+    # Everything else keeps the default, 'active'
+    Question.objects.filter(start_date__gt=now).update(status='upcoming')
+    Question.objects.filter(end_date__lt=now).update(status='closed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollApp', '0012_background_jobs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultSnapshot',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='pollApp.question')),
+                ('results_version', models.PositiveIntegerField(help_text='The results_version the data belongs to')),
+                ('data', models.JSONField()),
+                ('frozen_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='question',
+            name='pollapp_q_category_idx',
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='status',
+            field=models.CharField(choices=[('upcoming', 'Upcoming'), ('active', 'Active'), ('closed', 'Closed')], default='active', editable=False, help_text='Set from the dates on save and moved on at start_date and end_date by `manage.py poll_scheduler`', max_length=10),
+        ),
+        migrations.RunPython(set_statuses, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(condition=models.Q(('is_draft', False)), fields=['status', 'visibility', '-pub_date', '-id'], name='pollapp_q_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(condition=models.Q(('is_draft', False)), fields=['category', 'status', '-pub_date', '-id'], name='pollapp_q_category_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0.1 on 2026-10-17 09:40
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def mark_single_choice_votes(apps, schema_editor):
+    Question = apps.get_model('pollApp', 'Question')
+    Vote = apps.get_model('pollApp', 'Vote')
+    db_alias = schema_editor.connection.alias
+    single = Question.objects.using(db_alias).filter(allow_multiple_choices=False, ranking_method='')
+    votes = Vote.objects.using(db_alias).filter(question__in=single)
+    votes.update(single_choice=True)
+    # Ballots that an earlier race left with two votes stay unmarked; the
+    # voter's next ballot replaces them
+    doubled = (
+        votes.values('user_id', 'question_id').annotate(count=Count('pk')).filter(count__gt=1)
+        .values_list('user_id', 'question_id')
+    )
+    for user_id, question_id in list(doubled):
+        votes.filter(user_id=user_id, question_id=question_id).update(single_choice=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pollApp', '0013_poll_status'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='single_choice',
+            field=models.BooleanField(default=False, editable=False, help_text='Cast on a poll that takes one choice per voter'),
+        ),
+        migrations.RunPython(mark_single_choice_votes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(condition=models.Q(('single_choice', True)), fields=('user', 'question'), name='pollapp_vote_single_choice_uniq'),
+        ),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef, Q, Value
+from django.contrib.auth import hashers
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.exceptions import ValidationError
@@ -19,6 +21,54 @@ class Category(models.Model):
         return self.name
 
 
+class QuestionQuerySet(models.QuerySet):
+    """Poll status and visibility filters evaluated by the database
+
+    The status filters compare Question.status, which the poll scheduler
+    keeps current, so they are plain equality lookups on an index.
+    """
+    
+    def active(self):
+        """Polls that are currently accepting votes (see Question.is_active)"""
+        return self.filter(status='active', is_draft=False)
+    
+    def upcoming(self):
+        """Polls that haven't started yet"""
+        return self.filter(status='upcoming')
+    
+    def expired(self):
+        """Polls that have ended"""
+        return self.filter(status='closed')
+    
+    def visible_to(self, user):
+        """Published polls a user may see in listings"""
+        polls = self.filter(is_draft=False)
+        if not user.is_authenticated:
+            # Non-authenticated users can only see public polls
+            return polls.filter(visibility='public')
+        
+        # Authenticated users can see public and password-protected polls,
+        # their own private polls and private polls they're invited to.
+        # Exists() instead of a join keeps rows unique without distinct().
+        invited = self.model.invited_users.through.objects.filter(
+            question_id=OuterRef('pk'), user_id=user.pk
+        )
+        return polls.filter(
+            Q(visibility__in=['public', 'password']) |
+            Q(visibility='private', created_by=user) |
+            Q(Exists(invited), visibility='private')
+        )
+    
+    def with_invitation_flag(self, user):
+        """Annotate is_invited for the given user instead of loading every invitee"""
+        if not user.is_authenticated:
+            return self.annotate(is_invited=Value(False))
+        invited = self.model.invited_users.through.objects.filter(
+            question_id=OuterRef('pk'), user_id=user.pk
+        )
+        return self.annotate(is_invited=Exists(invited))
+
+
 class Question(models.Model):
     """Enhanced Question/Poll model with multiple features"""
     
@@ -28,6 +78,18 @@ class Question(models.Model):
         ('password', 'Password Protected'),
     ]
     
+    STATUSES = [
+        ('upcoming', 'Upcoming'),
+        ('active', 'Active'),
+        ('closed', 'Closed'),
+    ]
+    
+    RANKING_METHODS = [
+        ('irv', 'Instant runoff'),
+        ('borda', 'Borda count'),
+        ('condorcet', 'Condorcet'),
+    ]
+    
     # Basic fields
     question_text = models.CharField(max_length=300)
     description = models.TextField(blank=True, help_text="Optional detailed description")
@@ -36,6 +98,10 @@ class Question(models.Model):
     # Enhanced fields
     start_date = models.DateTimeField(null=True, blank=True, help_text="When poll becomes active")
     end_date = models.DateTimeField(null=True, blank=True, help_text="When poll closes")
+    status = models.CharField(
+        max_length=10, choices=STATUSES, default='active', editable=False,
+        help_text="Set from the dates on save and moved on at start_date and end_date by `manage.py poll_scheduler`",
+    )
     
     # Features
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='questions')
@@ -44,66 +110,105 @@ class Question(models.Model):
     # Settings
     is_draft = models.BooleanField(default=False, help_text="Draft polls are not visible to users")
     allow_multiple_choices = models.BooleanField(default=False, help_text="Allow users to select multiple options")
+    ranking_method = models.CharField(max_length=10, choices=RANKING_METHODS, blank=True, help_text="Collect ranked ballots and pick the winner with this method")
     visibility = models.CharField(max_length=10, choices=VISIBILITY_CHOICES, default='public')
-    password = models.CharField(max_length=100, blank=True, help_text="Required if visibility is password protected")
+    password = models.CharField(max_length=128, blank=True, help_text="Required if visibility is password protected; stored hashed (see set_password)")
     invited_users = models.ManyToManyField(User, blank=True, related_name='invited_polls', help_text="Users who can access this private poll")
     
+    # Denormalized counters, maintained by pollApp.services.voting
+    total_votes = models.IntegerField(default=0, help_text="Number of Vote rows for this poll")
+    unique_voters = models.IntegerField(default=0, help_text="Number of users who voted on this poll")
+    results_version = models.PositiveIntegerField(default=0, help_text="Bumped whenever the results change")
+    
     # Metadata
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='created_polls')
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
     
+    objects = QuestionQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-pub_date']
+        indexes = [
+            # Listings: visibility filter plus the (pub_date, id) keyset order
+            models.Index(fields=['is_draft', 'visibility', '-pub_date', '-id'], name='pollapp_q_listing_idx'),
+            # The same for the status tabs (active by default), which only show published polls
+            models.Index(
+                fields=['status', 'visibility', '-pub_date', '-id'], condition=Q(is_draft=False),
+                name='pollapp_q_status_idx',
+            ),
+            # Category pages only ever show active published polls
+            models.Index(
+                fields=['category', 'status', '-pub_date', '-id'], condition=Q(is_draft=False),
+                name='pollapp_q_category_idx',
+            ),
+        ]
     
     def __str__(self):
         return self.question_text
     
-    def is_active(self):
-        """Check if poll is currently active"""
-        now = timezone.now()
-        if self.is_draft:
-            return False
+    def save(self, *args, **kwargs):
+        # New dates take effect at once; the scheduler handles the passing of time
+        closing = self._state.adding or self.status != 'closed'
+        self.status = self.scheduled_status()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'status'}
+        super().save(*args, **kwargs)
+        if closing and self.status == 'closed':
+            # Closed by an edit rather than by the scheduler, which freezes the ones it closes
+            from .services.results_cache import freeze_results
+            transaction.on_commit(lambda: freeze_results(self))
+    
+    def scheduled_status(self, now=None):
+        """What status should be at this moment, from start_date and end_date"""
+        now = now or timezone.now()
         if self.start_date and now < self.start_date:
-            return False
+            return 'upcoming'
         if self.end_date and now > self.end_date:
-            return False
-        return True
+            return 'closed'
+        return 'active'
+    
+    def next_transition(self):
+        """When the status changes next, or None if it never will"""
+        if self.status == 'upcoming':
+            return self.start_date
+        if self.status == 'active':
+            return self.end_date
+        return None
+    
+    def is_active(self):
+        """Check if poll is currently active"""
+        return not self.is_draft and self.status == 'active'
+    
+    def accepts_votes(self):
+        """Whether a vote can be cast right now, from the poll's own dates
+
+        Unlike is_active() this does not wait for the scheduler to move
+        status on, so the vote window is exactly start_date..end_date.
+        """
+        return not self.is_draft and self.scheduled_status() == 'active'
     
     def is_upcoming(self):
         """Check if poll hasn't started yet"""
-        if self.start_date and timezone.now() < self.start_date:
-            return True
-        return False
+        return self.status == 'upcoming'
     
     def is_expired(self):
         """Check if poll has ended"""
-        if self.end_date and timezone.now() > self.end_date:
-            return True
-        return False
+        return self.status == 'closed'
     
-    def total_votes(self):
-        """Get total votes for this poll"""
-        return self.vote_set.count()
+    def set_password(self, raw_password):
+        """Store a hash of the poll password; an empty one clears it"""
+        self.password = hashers.make_password(raw_password) if raw_password else ''
+    
+    def check_password(self, raw_password):
+        """Check an entered password against the stored hash"""
+        return bool(self.password) and hashers.check_password(raw_password, self.password)
     
     def can_user_access(self, user):
         """Check if a user can access this poll based on visibility settings"""
-        if not user.is_authenticated:
-            return self.visibility == 'public'
-        
-        # Draft polls only visible to creator
-        if self.is_draft and self.created_by != user:
-            return False
-        
-        # Public and password-protected polls are visible to all authenticated users
-        if self.visibility in ['public', 'password']:
-            return True
-        
-        # Private polls only visible to creator and invited users
-        if self.visibility == 'private':
-            return user == self.created_by or self.invited_users.filter(id=user.id).exists()
-        
-        return False
+        from .services.access import can_access
+        return can_access(user, self)
     
     def clean(self):
         """Validate model data"""
@@ -111,6 +216,8 @@ class Question(models.Model):
             raise ValidationError("End date must be after start date")
         if self.visibility == 'password' and not self.password:
             raise ValidationError("Password is required for password-protected polls")
+        if self.ranking_method and self.allow_multiple_choices:
+            raise ValidationError("Ranked polls already let users pick several choices; turn off multiple choices")
 
 
 class Choice(models.Model):
@@ -129,7 +236,7 @@ class Choice(models.Model):
     
     def vote_percentage(self):
         """Calculate percentage of votes"""
-        total = self.question.choice_set.aggregate(models.Sum('votes'))['votes__sum'] or 0
+        total = self.question.total_votes
         if total == 0:
             return 0
         return round((self.votes / total) * 100, 1)
@@ -140,18 +247,71 @@ class Vote(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Preference on ranked polls, 1 being the first")
     voted_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    single_choice = models.BooleanField(default=False, editable=False, help_text="Cast on a poll that takes one choice per voter")
     
     class Meta:
         # For single-choice polls, one vote per user per question
         # For multiple-choice, one vote per user per choice
         unique_together = ('user', 'choice')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'question'], condition=Q(single_choice=True), name='pollapp_vote_single_choice_uniq',
+            ),
+        ]
         ordering = ['-voted_at']
+        indexes = [
+            # "Has this user voted here, and for what?" answered from the index alone
+            models.Index(fields=['user', 'question', 'choice'], name='pollapp_vote_user_q_idx'),
+            # Tabulation reads a ranked poll's ballots voter by voter, in rank order
+            models.Index(
+                fields=['question', 'user', 'rank'], condition=Q(rank__isnull=False),
+                name='pollapp_vote_ballot_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.user.username} voted for {self.choice.choice_text}"
 
 
+class VoteRollup(models.Model):
+    """Net votes for a choice in one minute, hour or day, maintained by pollApp.services.rollups"""
+    GRANULARITIES = [
+        ('minute', 'Minute'),
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+    
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='+')
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='+')
+    granularity = models.CharField(max_length=6, choices=GRANULARITIES)
+    bucket = models.DateTimeField(help_text="Start of the minute, hour or day (UTC)")
+    votes = models.IntegerField(default=0, help_text="Votes added minus votes withdrawn in the bucket")
+    
+    class Meta:
+        constraints = [
+            # The upsert target, and the index a poll's timeline is read from
+            models.UniqueConstraint(
+                fields=['question', 'granularity', 'bucket', 'choice'], name='pollapp_rollup_bucket_uniq',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.choice_id} @ {self.bucket:%Y-%m-%d %H:%M} ({self.granularity}): {self.votes}"
+
+
+class ResultSnapshot(models.Model):
+    """Results of a closed poll, frozen by the poll scheduler when it closes"""
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    results_version = models.PositiveIntegerField(help_text="The results_version the data belongs to")
+    data = models.JSONField()
+    frozen_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"Results of {self.question_id} at version {self.results_version}"
+
+
 class Comment(models.Model):
     """User comments on polls"""
     question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='comments')
@@ -163,6 +323,79 @@ class Comment(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['question', '-created_at'], name='pollapp_comment_q_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} on {self.question.question_text[:50]}"
+
+
+class SearchTerm(models.Model):
+    """Inverted index entry for the portable search backend (see pollApp.services.search)"""
+    term = models.CharField(max_length=64)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='+')
+    weight = models.FloatField()
+    
+    class Meta:
+        indexes = [models.Index(fields=['term', 'question'], name='pollapp_search_term_idx')]
+    
+    def __str__(self):
+        return f"{self.term} -> {self.question_id}"
+
+
+class Job(models.Model):
+    """Heavy admin operation run off the request path by `manage.py run_workers` (see pollApp.services.jobs)"""
+    STATUSES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now, help_text="Not picked up before this time (retry backoff)")
+    
+    # Progress, written by the worker as it goes
+    progress_done = models.PositiveIntegerField(default=0)
+    progress_total = models.PositiveIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, help_text="Traceback of the last failed attempt")
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Workers look for the oldest due job
+            models.Index(fields=['status', 'run_after'], name='pollapp_job_due_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.user.username} on {self.question.question_text[:50]}"
\ No newline at end of file
+        return f"{self.kind} #{self.pk} ({self.status})"
+    
+    def progress_percent(self):
+        if self.status == 'done':
+            return 100
+        if not self.progress_total:
+            return 0
+        return min(100, round(self.progress_done * 100 / self.progress_total))
+    
+    def report_progress(self, done, total=None):
+        """Store progress and show the job is still alive"""
+        self.progress_done = done
+        if total is not None:
+            self.progress_total = total
+        self.heartbeat_at = timezone.now()
+        Job.objects.filter(pk=self.pk).update(
+            progress_done=self.progress_done, progress_total=self.progress_total, heartbeat_at=self.heartbeat_at,
+        )
@@ -0,0 +1,100 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class KeysetPage:
+    """One page of a keyset-paginated listing"""
+
+    def __init__(self, items, next_cursor, is_first):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.is_first = is_first
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def encode_cursor(question):
+    """Opaque cursor pointing just past the given question (instance or values() row)"""
+    if isinstance(question, dict):
+        pub_date, pk = question['pub_date'], question['id']
+    else:
+        pub_date, pk = question.pub_date, question.pk
+    raw = f'{pub_date.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (pub_date, pk) for a cursor, or None if it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        pub_date, pk = raw.split('|')
+        return datetime.fromisoformat(pub_date), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def paginate_newest_first(queryset, cursor, per_page):
+    """Page through polls newest first using a (pub_date, id) keyset
+
+    Every page is a single indexed range query, so page N costs the same as
+    page 1 no matter how many polls there are.
+    """
+    queryset = queryset.order_by('-pub_date', '-pk')
+    position = decode_cursor(cursor)
+    if position:
+        pub_date, pk = position
+        queryset = queryset.filter(Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk))
+
+    # Fetch one extra row to find out whether there is another page
+    items = list(queryset[:per_page + 1])
+    next_cursor = encode_cursor(items[per_page - 1]) if len(items) > per_page else None
+    return KeysetPage(items[:per_page], next_cursor, is_first=position is None)
+
+
+def paginate_ranked(queryset, ranked_ids, cursor, per_page):
+    """Page through search hits in rank order
+
+    ranked_ids is the (bounded) best-first id list from the search index;
+    the queryset's filters decide which of them may be shown. The cursor is
+    an offset into the filtered ranking.
+    """
+    try:
+        offset = max(int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()), 0) if cursor else 0
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        offset = 0
+
+    allowed = set(queryset.filter(pk__in=ranked_ids).values_list('pk', flat=True))
+    ordered = [pk for pk in ranked_ids if pk in allowed]
+    page_ids = ordered[offset:offset + per_page]
+    rows = {
+        (row['id'] if isinstance(row, dict) else row.pk): row
+        for row in queryset.filter(pk__in=page_ids)
+    }
+    items = [rows[pk] for pk in page_ids if pk in rows]
+
+    next_cursor = None
+    if len(ordered) > offset + per_page:
+        next_cursor = base64.urlsafe_b64encode(str(offset + per_page).encode()).decode().rstrip('=')
+    return KeysetPage(items, next_cursor, is_first=offset == 0)
+
+
+def page_url(request, cursor):
+    """Current URL with the cursor replaced, keeping the other filters"""
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    if cursor:
+        params['cursor'] = cursor
+    return f'?{params.urlencode()}' if params else request.path
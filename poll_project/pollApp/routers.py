@@ -0,0 +1,110 @@
+"""Primary/replica database routing
+
+Writes always go to the primary ('default'). Reads go to the primary too,
+except inside views wrapped in use_replica (listings, results, profile),
+which read from the REPLICA_DB alias when settings define one. A write made
+during such a view switches the rest of that request back to the primary so
+it reads what it wrote, and PrimaryPinMiddleware keeps a client on the
+primary for DATABASE_REPLICA_PIN_SECONDS after a successful POST so the page
+it is redirected to already shows its vote despite replication lag.
+"""
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, router
+from django.utils.decorators import sync_and_async_middleware
+
+
+REPLICA_DB = 'replica'
+PIN_SESSION_KEY = '_db_primary_until'
+
+# Alias reads go to in the current request; None means the primary
+_read_alias = ContextVar('poll_read_alias', default=None)
+
+
+def replica_configured():
+    """Whether a replica alias exists and this router is installed"""
+    return REPLICA_DB in settings.DATABASES and any(
+        isinstance(installed, PrimaryReplicaRouter) for installed in router.routers
+    )
+
+
+class PrimaryReplicaRouter:
+    """Send reads inside use_replica views to the replica, everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Follow relations on the database the instance came from
+            return instance._state.db
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Read your own writes for the rest of the request
+        if _read_alias.get() is not None:
+            _read_alias.set(None)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # The replica gets its schema from replication
+        return False if db == REPLICA_DB else None
+
+
+def _pinned(until):
+    return until is not None and until > time.time()
+
+
+def use_replica(view):
+    """Read from the replica during the view, unless the client was pinned to the primary"""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not replica_configured() or _pinned(await request.session.aget(PIN_SESSION_KEY)):
+                return await view(request, *args, **kwargs)
+            token = _read_alias.set(REPLICA_DB)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _read_alias.reset(token)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not replica_configured() or _pinned(request.session.get(PIN_SESSION_KEY)):
+            return view(request, *args, **kwargs)
+        token = _read_alias.set(REPLICA_DB)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _read_alias.reset(token)
+    return wrapper
+
+
+def _pins(request, response):
+    return request.method == 'POST' and response.status_code < 400 and hasattr(request, 'session')
+
+
+@sync_and_async_middleware
+def PrimaryPinMiddleware(get_response):
+    """Keep a client on the primary for a few seconds after each successful POST"""
+    if iscoroutinefunction(get_response):
+        async def async_middleware(request):
+            response = await get_response(request)
+            if _pins(request, response):
+                await request.session.aset(PIN_SESSION_KEY, time.time() + settings.DATABASE_REPLICA_PIN_SECONDS)
+            return response
+        return async_middleware
+
+    def middleware(request):
+        response = get_response(request)
+        if _pins(request, response):
+            request.session[PIN_SESSION_KEY] = time.time() + settings.DATABASE_REPLICA_PIN_SECONDS
+        return response
+    return middleware
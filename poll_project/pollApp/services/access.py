@@ -0,0 +1,105 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from ..models import Question
+
+
+def _invites_cache_key(user_id):
+    return f'poll-invites:{user_id}'
+
+
+def invited_poll_ids(user, request=None):
+    """Ids of the private polls a user is invited to
+
+    Loaded with one indexed query on the invitation table, cached in Django's
+    cache until the user's invitations change (see pollApp.signals), and
+    memoized on the request when one is given.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+    if request is not None and hasattr(request, '_invited_poll_ids'):
+        return request._invited_poll_ids
+
+    key = _invites_cache_key(user.pk)
+    poll_ids = cache.get(key)
+    if poll_ids is None:
+        poll_ids = frozenset(
+            Question.invited_users.through.objects.filter(user_id=user.pk)
+            .values_list('question_id', flat=True)
+        )
+        cache.set(key, poll_ids, getattr(settings, 'POLL_INVITES_CACHE_TIMEOUT', 3600))
+
+    if request is not None:
+        request._invited_poll_ids = poll_ids
+    return poll_ids
+
+
+async def ainvited_poll_ids(user, request=None):
+    """Async counterpart of invited_poll_ids"""
+    if not user.is_authenticated:
+        return frozenset()
+    if request is not None and hasattr(request, '_invited_poll_ids'):
+        return request._invited_poll_ids
+
+    key = _invites_cache_key(user.pk)
+    poll_ids = await cache.aget(key)
+    if poll_ids is None:
+        poll_ids = frozenset([
+            question_id async for question_id in
+            Question.invited_users.through.objects.filter(user_id=user.pk)
+            .values_list('question_id', flat=True)
+        ])
+        await cache.aset(key, poll_ids, getattr(settings, 'POLL_INVITES_CACHE_TIMEOUT', 3600))
+
+    if request is not None:
+        request._invited_poll_ids = poll_ids
+    return poll_ids
+
+
+def forget_invitations(user_ids):
+    """Invalidate the cached invitations of the given users"""
+    cache.delete_many([_invites_cache_key(user_id) for user_id in user_ids])
+
+
+def is_creator(user, question):
+    return user.is_authenticated and question.created_by_id == user.pk
+
+
+def is_invited(user, question, request=None):
+    """Whether the user is on a private poll's invite list"""
+    if question.visibility != 'private':
+        return False
+    return question.pk in invited_poll_ids(user, request)
+
+
+async def ais_invited(user, question, request=None):
+    """Async counterpart of is_invited"""
+    if question.visibility != 'private':
+        return False
+    return question.pk in await ainvited_poll_ids(user, request)
+
+
+def can_access(user, question, request=None):
+    """Check if a user can access a poll based on its draft and visibility settings
+
+    Password-protected polls count as accessible here; unlocking them is
+    checked separately by the views.
+    """
+    # Draft polls only visible to creator
+    if question.is_draft and not is_creator(user, question):
+        return False
+
+    # Private polls only visible to creator and invited users
+    if question.visibility == 'private':
+        return is_creator(user, question) or is_invited(user, question, request)
+
+    return True
+
+
+async def acan_access(user, question, request=None):
+    """Async counterpart of can_access"""
+    if question.is_draft and not is_creator(user, question):
+        return False
+    if question.visibility == 'private':
+        return is_creator(user, question) or await ais_invited(user, question, request)
+    return True
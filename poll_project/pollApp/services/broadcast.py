@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import weakref
+
+from django.conf import settings
+
+from ..models import Choice, Question
+
+
+logger = logging.getLogger(__name__)
+
+# Events a slow subscriber may fall behind by before it is resynced with a snapshot
+SUBSCRIBER_QUEUE_SIZE = 16
+
+
+class _Channel:
+    """Last known tallies of one poll and the queues of everyone watching it"""
+
+    def __init__(self, question_id):
+        self.question_id = question_id
+        self.version = None
+        self.total = 0
+        self.votes = {}
+        self.subscribers = set()
+
+    def snapshot(self):
+        return ('snapshot', {'v': self.version, 't': self.total, 'c': self.votes})
+
+    def update(self, version, total, votes):
+        """Store new tallies and return the event describing the change, if any"""
+        if version == self.version and votes == self.votes:
+            return None
+        if self.version is not None and set(votes) == set(self.votes):
+            # Only the choices whose count moved
+            changed = {choice_id: count for choice_id, count in votes.items() if self.votes[choice_id] != count}
+            event = ('tally', {'v': version, 't': total, 'c': changed})
+        else:
+            event = None
+        self.version, self.total, self.votes = version, total, votes
+        return event or self.snapshot()
+
+    def publish(self, event):
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Dropped deltas cannot be merged, so start the subscriber over
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self.snapshot() if event is not None else None)
+
+
+class ResultsBroadcaster:
+    """Fan live poll tallies out to any number of subscribers
+
+    A single task polls Question.results_version for every watched poll in
+    one query per tick and loads the choice counts only for polls that
+    changed, so the database cost depends on the number of polls being
+    watched and how often they change, not on the number of watchers.
+    Subscribers get a snapshot when they join and compact deltas after that.
+    A None event means the poll is gone and the stream should end.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._channels = {}
+        self._task = None
+
+    def watched(self):
+        return list(self._channels)
+
+    async def subscribe(self, question_id):
+        """Start watching a poll; returns the queue events will arrive on"""
+        channel = self._channels.get(question_id)
+        if channel is None:
+            channel = _Channel(question_id)
+            await self._refresh([channel])
+            # Another subscriber may have opened the channel meanwhile
+            channel = self._channels.setdefault(question_id, channel)
+
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        queue.put_nowait(channel.snapshot())
+        channel.subscribers.add(queue)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, question_id, queue):
+        channel = self._channels.get(question_id)
+        if channel is None:
+            return
+        channel.subscribers.discard(queue)
+        if not channel.subscribers:
+            del self._channels[question_id]
+        if not self._channels and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while self._channels:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception('Polling live results failed')
+
+    async def poll(self):
+        """Check every watched poll once and publish what changed"""
+        channels = dict(self._channels)
+        if not channels:
+            return
+        rows = {
+            pk: (version, total) async for pk, version, total in
+            Question.objects.filter(pk__in=channels).values_list('pk', 'results_version', 'total_votes')
+        }
+        for question_id in set(channels) - set(rows):
+            # Deleted poll: end its streams
+            channels.pop(question_id).publish(None)
+            self._channels.pop(question_id, None)
+
+        changed = [channel for pk, channel in channels.items() if rows[pk][0] != channel.version]
+        await self._refresh(changed, rows)
+
+    async def _refresh(self, channels, rows=None):
+        """Load tallies for the given channels and publish the differences
+
+        rows maps question id -> (results_version, total_votes) when the
+        caller has already read them.
+        """
+        if not channels:
+            return
+        by_id = {channel.question_id: channel for channel in channels}
+        if rows is None:
+            rows = {
+                pk: (version, total) async for pk, version, total in
+                Question.objects.filter(pk__in=by_id).values_list('pk', 'results_version', 'total_votes')
+            }
+        votes = {pk: {} for pk in by_id}
+        async for question_id, choice_id, count in (
+            Choice.objects.filter(question_id__in=by_id).order_by('pk')
+            .values_list('question_id', 'pk', 'votes')
+        ):
+            votes[question_id][choice_id] = count
+
+        for pk, channel in by_id.items():
+            if pk not in rows:
+                continue
+            version, total = rows[pk]
+            event = channel.update(version, total, votes[pk])
+            if event is not None:
+                channel.publish(event)
+
+
+# One broadcaster per event loop, since its queues and task belong to the loop
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def get_broadcaster():
+    """The broadcaster for the running event loop"""
+    loop = asyncio.get_running_loop()
+    broadcaster = _broadcasters.get(loop)
+    if broadcaster is None:
+        broadcaster = ResultsBroadcaster(getattr(settings, 'POLL_LIVE_RESULTS_INTERVAL', 1.0))
+        _broadcasters[loop] = broadcaster
+    return broadcaster
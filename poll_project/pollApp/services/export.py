@@ -0,0 +1,108 @@
+import csv
+import json
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from ..models import Vote
+
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+# (column name, values_list lookup)
+EXPORT_COLUMNS = [
+    ('vote_id', 'id'),
+    ('voted_at', 'voted_at'),
+    ('user_id', 'user_id'),
+    ('username', 'user__username'),
+    ('question_id', 'question_id'),
+    ('choice_id', 'choice_id'),
+]
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+class Echo:
+    """File-like object whose write() just returns the value, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def parse_bound(value, end_of_day=False):
+    """Parse a date or datetime filter value into an aware datetime
+
+    A bare date means the start of that day, or its end for upper bounds.
+    Raises ValueError for anything else.
+    """
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Invalid date: {value!r}')
+        moment = datetime.combine(day, time.max if end_of_day else time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filter_votes(question_ids=None, category=None, since=None, until=None):
+    """Votes matching the export filters, in primary key order"""
+    votes = Vote.objects.order_by('pk')
+    if question_ids:
+        votes = votes.filter(question_id__in=question_ids)
+    if category:
+        votes = votes.filter(question__category__slug=category)
+    if since:
+        votes = votes.filter(voted_at__gte=since)
+    if until:
+        votes = votes.filter(voted_at__lte=until)
+    return votes
+
+
+def iter_vote_rows(votes, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream plain tuples from the database without building model instances"""
+    lookups = [lookup for _, lookup in EXPORT_COLUMNS]
+    return votes.values_list(*lookups).iterator(chunk_size=chunk_size)
+
+
+def csv_lines(rows):
+    """Yield a CSV header and one encoded line per row"""
+    writer = csv.writer(Echo())
+    yield writer.writerow([column for column, _ in EXPORT_COLUMNS])
+    for row in rows:
+        vote_id, voted_at, *rest = row
+        yield writer.writerow([vote_id, voted_at.isoformat() if voted_at else '', *rest])
+
+
+def ndjson_lines(rows):
+    """Yield one JSON object per line"""
+    columns = [column for column, _ in EXPORT_COLUMNS]
+    for row in rows:
+        record = dict(zip(columns, row))
+        if record['voted_at']:
+            record['voted_at'] = record['voted_at'].isoformat()
+        yield json.dumps(record) + '\n'
+
+
+def counted(rows, progress, every=DEFAULT_CHUNK_SIZE):
+    """Pass rows through, calling progress(rows so far) every so many rows and at the end"""
+    count = 0
+    for count, row in enumerate(rows, 1):
+        if count % every == 0:
+            progress(count)
+        yield row
+    progress(count)
+
+
+def export_lines(votes, export_format='csv', chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Lines of the export in the requested format, in constant memory"""
+    rows = iter_vote_rows(votes, chunk_size)
+    if progress:
+        rows = counted(rows, progress, chunk_size)
+    if export_format == 'ndjson':
+        return ndjson_lines(rows)
+    return csv_lines(rows)
@@ -0,0 +1,256 @@
+import csv
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from ..models import Category, Choice, Question
+from .access import forget_invitations
+from .export import parse_bound
+from .search import index_questions
+
+
+IMPORT_FORMATS = ('jsonl', 'csv')
+
+# Separator for list-valued columns (choices, invited_users) in CSV files
+CSV_LIST_SEPARATOR = '|'
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
+
+
+class ImportReport:
+    """Counts, per-row errors and throughput of an import run"""
+
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        return self.created / self.elapsed if self.elapsed else 0
+
+    def add_error(self, line_no, message):
+        self.errors.append((line_no, message))
+
+
+def read_rows(stream, import_format):
+    """Yield (line number, row dict) from a JSON Lines or CSV stream
+
+    Lines that are not valid JSON are yielded as (line number, ValueError)
+    so they can be reported like any other bad row.
+    """
+    if import_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, ValueError(f'Invalid JSON: {e}')
+            continue
+        if not isinstance(row, dict):
+            yield line_no, ValueError('Each line must be a JSON object')
+            continue
+        yield line_no, row
+
+
+def _as_text(row, field):
+    """A text field of a row, '' when missing; JSON rows can hold other types"""
+    value = row.get(field)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise ValidationError(f'{field} must be a string')
+    return value
+
+
+def _as_list(row, field):
+    value = row.get(field)
+    if value in (None, ''):
+        return []
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(CSV_LIST_SEPARATOR) if item.strip()]
+    if not isinstance(value, list):
+        raise ValidationError(f'{field} must be a list')
+    return [str(item).strip() for item in value if str(item).strip()]
+
+
+def _as_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in TRUE_VALUES
+
+
+class _PendingPoll:
+    """A parsed row waiting for its batch to be written"""
+
+    def __init__(self, line_no, question, choice_texts, category_name, invitees):
+        self.line_no = line_no
+        self.question = question
+        self.choice_texts = choice_texts
+        self.category_name = category_name
+        self.invitees = invitees
+
+
+def _parse_row(row, users):
+    """Build an unsaved Question from a row, validated like the admin form would"""
+    created_by = _as_text(row, 'created_by')
+    invited_users = _as_list(row, 'invited_users')
+    for username in [created_by] + invited_users:
+        if username and username not in users:
+            raise ValidationError(f'Unknown user: {username}')
+
+    question = Question(
+        question_text=_as_text(row, 'question_text').strip(),
+        description=_as_text(row, 'description'),
+        pub_date=parse_bound(_as_text(row, 'pub_date')) or timezone.now(),
+        start_date=parse_bound(_as_text(row, 'start_date')),
+        end_date=parse_bound(_as_text(row, 'end_date')),
+        visibility=_as_text(row, 'visibility') or 'public',
+        allow_multiple_choices=_as_bool(row.get('allow_multiple_choices')),
+        ranking_method=_as_text(row, 'ranking_method').strip(),
+        is_draft=_as_bool(row.get('is_draft')),
+        created_by=users.get(created_by),
+    )
+    # Poll passwords are stored hashed, never as given
+    question.set_password(_as_text(row, 'password'))
+    # bulk_create skips save(), which sets this
+    question.status = question.scheduled_status()
+    question.clean_fields(exclude=['category', 'created_by', 'image'])
+    question.clean()
+
+    choice_texts = _as_list(row, 'choices')
+    if not choice_texts:
+        raise ValidationError('At least one choice is required')
+    for text in choice_texts:
+        Choice(question=question, choice_text=text).clean_fields(exclude=['question', 'image'])
+
+    category_name = _as_text(row, 'category').strip()
+    invitees = [users[username] for username in invited_users]
+    return question, choice_texts, category_name, invitees
+
+
+class PollImporter:
+    """Load polls in batches with bulk_create
+
+    Each batch is validated row by row first; bad rows are reported and
+    skipped, and the good ones are written in a single transaction with one
+    bulk insert each for questions, choices and invitations.
+    """
+
+    def __init__(self, batch_size=1000, dry_run=False, progress=None):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.progress = progress
+        self.report = ImportReport()
+        self._categories = {}
+
+    def run(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._import_batch(batch)
+                batch = []
+        if batch:
+            self._import_batch(batch)
+        return self.report
+
+    def _import_batch(self, batch):
+        usernames = set()
+        for _, row in batch:
+            if isinstance(row, dict):
+                # A badly typed field is reported with its row below
+                try:
+                    usernames.add(_as_text(row, 'created_by'))
+                    usernames.update(_as_list(row, 'invited_users'))
+                except ValidationError:
+                    continue
+        usernames.discard('')
+        users = {user.username: user for user in User.objects.filter(username__in=usernames)}
+
+        pending = []
+        for line_no, row in batch:
+            if isinstance(row, Exception):
+                self.report.add_error(line_no, str(row))
+                continue
+            try:
+                pending.append(_PendingPoll(line_no, *_parse_row(row, users)))
+            except (ValidationError, ValueError) as e:
+                messages = e.messages if isinstance(e, ValidationError) else [str(e)]
+                self.report.add_error(line_no, '; '.join(messages))
+
+        if pending and not self.dry_run:
+            self._write(pending)
+        self.report.created += len(pending)
+        if self.progress:
+            self.progress(self.report)
+
+    def _resolve_categories(self, names):
+        """Map category names to Category rows, creating the missing ones"""
+        categories = {name: self._categories[name] for name in names if name in self._categories}
+        missing = {name for name in names if name and name not in categories}
+        if not missing:
+            return categories
+
+        for category in Category.objects.filter(name__in=missing):
+            categories[category.name] = category
+        missing -= set(categories)
+        if missing:
+            slugs = {name: slugify(name)[:90] or 'category' for name in missing}
+            taken = set(Category.objects.filter(slug__in=slugs.values()).values_list('slug', flat=True))
+            new = []
+            for name in sorted(missing):
+                slug, suffix = slugs[name], 2
+                while slug in taken:
+                    slug, suffix = f'{slugs[name]}-{suffix}', suffix + 1
+                taken.add(slug)
+                new.append(Category(name=name, slug=slug))
+            Category.objects.bulk_create(new)
+            for category in Category.objects.filter(name__in=missing):
+                categories[category.name] = category
+        return categories
+
+    @transaction.atomic
+    def _write(self, pending):
+        categories = self._resolve_categories({poll.category_name for poll in pending})
+        # Only rows that were committed are worth remembering for later batches
+        transaction.on_commit(lambda: self._categories.update(categories))
+        for poll in pending:
+            poll.question.category = categories.get(poll.category_name)
+
+        Question.objects.bulk_create([poll.question for poll in pending])
+
+        Choice.objects.bulk_create([
+            Choice(question=poll.question, choice_text=text)
+            for poll in pending for text in poll.choice_texts
+        ])
+
+        # bulk_create skips the signals that keep the search index in sync
+        index_questions([poll.question.pk for poll in pending])
+
+        Invitation = Question.invited_users.through
+        invitations = [
+            Invitation(question_id=poll.question.pk, user_id=user.pk)
+            for poll in pending for user in poll.invitees
+        ]
+        if invitations:
+            Invitation.objects.bulk_create(invitations, ignore_conflicts=True)
+            # bulk_create skips m2m_changed, so drop cached invitations by hand
+            invited = {invitation.user_id for invitation in invitations}
+            transaction.on_commit(lambda: forget_invitations(invited))
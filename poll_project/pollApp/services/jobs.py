@@ -0,0 +1,250 @@
+"""A small job queue in the database, for admin operations too heavy for a request
+
+enqueue() stores a Job row; `manage.py run_workers` runs due jobs in a pool
+of processes. A worker claims a job with a conditional UPDATE (only one
+worker can move a row out of 'queued'), runs the handler registered for its
+kind and stores the result. A handler that raises is retried after
+POLL_JOB_RETRY_DELAY seconds, doubled after every failed attempt, until the
+job has had max_attempts tries. Handlers report progress through
+Job.report_progress(), which doubles as a heartbeat: a running job that has
+not reported for POLL_JOB_STALE_AFTER seconds (its worker was killed) is
+queued again.
+
+Handlers work in chunks of POLL_JOB_CHUNK_SIZE rows and are safe to run
+again after a failure part way.
+"""
+import datetime
+import logging
+import os
+import socket
+import tempfile
+import time
+import traceback
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from ..models import Choice, Comment, Job, Question, Vote, VoteRollup
+from .export import EXPORT_FORMATS, export_lines, filter_votes, parse_bound
+from .rollups import backfill_rollups
+from .voting import reconcile_vote_counts
+
+
+logger = logging.getLogger(__name__)
+
+# kind -> handler(job), which returns the job's JSON result
+TASKS = {}
+
+
+def task(kind):
+    """Register a handler for jobs of this kind"""
+    def register(handler):
+        TASKS[kind] = handler
+        return handler
+    return register
+
+
+def enqueue(kind, payload=None, user=None):
+    """Queue a job to run as soon as a worker is free"""
+    if kind not in TASKS:
+        raise ValueError(f'Unknown job kind: {kind!r}')
+    return Job.objects.create(
+        kind=kind, payload=payload or {},
+        created_by=user if user is not None and user.is_authenticated else None,
+        max_attempts=getattr(settings, 'POLL_JOB_MAX_ATTEMPTS', 5),
+    )
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next try after this many failed attempts"""
+    delay = getattr(settings, 'POLL_JOB_RETRY_DELAY', 30) * 2 ** (attempts - 1)
+    return datetime.timedelta(seconds=min(delay, getattr(settings, 'POLL_JOB_RETRY_MAX_DELAY', 3600)))
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim(worker):
+    """Take the oldest due job, or None; safe with any number of workers"""
+    now = timezone.now()
+    due = Job.objects.filter(status='queued', run_after__lte=now).order_by('run_after', 'pk')
+    for pk in due.values_list('pk', flat=True)[:5]:
+        # Whoever updates the row first gets it; the others try the next one
+        claimed = Job.objects.filter(pk=pk, status='queued').update(
+            status='running', attempts=F('attempts') + 1, worker=worker,
+            started_at=now, heartbeat_at=now,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run_job(job):
+    """Run a claimed job and record its outcome; returns whether it succeeded"""
+    handler = TASKS.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f'No handler for job kind {job.kind!r}')
+        result = handler(job)
+    except Exception:
+        logger.warning('Job %s (%s) failed on attempt %s of %s', job.pk, job.kind, job.attempts, job.max_attempts, exc_info=True)
+        now = timezone.now()
+        if handler is not None and job.attempts < job.max_attempts:
+            Job.objects.filter(pk=job.pk).update(
+                status='queued', run_after=now + retry_delay(job.attempts), worker='', error=traceback.format_exc(),
+            )
+        else:
+            Job.objects.filter(pk=job.pk).update(status='failed', finished_at=now, error=traceback.format_exc())
+        return False
+
+    Job.objects.filter(pk=job.pk).update(status='done', result=result, finished_at=timezone.now())
+    return True
+
+
+def requeue_stale(timeout=None):
+    """Queue again running jobs whose worker stopped reporting, or fail them when out of attempts"""
+    timeout = timeout or getattr(settings, 'POLL_JOB_STALE_AFTER', 600)
+    now = timezone.now()
+    stale = Job.objects.filter(status='running', heartbeat_at__lt=now - datetime.timedelta(seconds=timeout))
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', finished_at=now, error='The worker stopped responding',
+    )
+    return stale.update(status='queued', run_after=now, worker='')
+
+
+def work(worker=None, stop=None, burst=False, poll_interval=1.0):
+    """Run due jobs until stop is set, or in burst mode until none are due; returns how many ran"""
+    worker = worker or worker_name()
+    ran = 0
+    requeue_stale()
+    while not (stop and stop.is_set()):
+        # Honours CONN_MAX_AGE and drops broken connections between jobs
+        close_old_connections()
+        job = claim(worker)
+        if job is None:
+            if burst:
+                break
+            requeue_stale()
+            if stop:
+                stop.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+        run_job(job)
+        ran += 1
+    return ran
+
+
+def chunk_size():
+    return getattr(settings, 'POLL_JOB_CHUNK_SIZE', 1000)
+
+
+# Handlers
+
+def schedule_delete(question_ids, user=None):
+    """Hide the polls now and delete them, with everything hanging off them, in the background"""
+    Question.objects.filter(pk__in=question_ids).update(is_draft=True, updated_at=timezone.now())
+    return [enqueue('delete_question', {'question_id': pk}, user) for pk in question_ids]
+
+
+@task('delete_question')
+def delete_question(job):
+    """Delete a poll's votes, rollups and comments in chunks, then the poll with its choices
+
+    A poll whose job runs out of attempts stays a draft, with whatever was
+    not deleted yet; retrying the job carries on where it stopped.
+    """
+    question_id = job.payload['question_id']
+    # Largest first. The few choices go with the poll: deleted as part of it,
+    # their signal receivers skip the results bump and reindex
+    querysets = [
+        Vote.objects.filter(question_id=question_id),
+        VoteRollup.objects.filter(question_id=question_id),
+        Comment.objects.filter(question_id=question_id),
+    ]
+    choices = Choice.objects.filter(question_id=question_id).count()
+    total = sum(queryset.count() for queryset in querysets) + choices + 1
+    done = 0
+    job.report_progress(done, total)
+    deleted = {}
+    for queryset in querysets:
+        label = queryset.model._meta.model_name
+        deleted[label] = 0
+        while pks := list(queryset.values_list('pk', flat=True)[:chunk_size()]):
+            queryset.model.objects.filter(pk__in=pks).delete()
+            deleted[label] += len(pks)
+            done += len(pks)
+            job.report_progress(done)
+
+    question = Question.objects.filter(pk=question_id).first()
+    if question is not None:
+        question.delete()
+    job.report_progress(total)
+    deleted['choice'] = choices if question is not None else 0
+    deleted['question'] = int(question is not None)
+    return deleted
+
+
+@task('reconcile_votes')
+def reconcile_votes(job):
+    """Rebuild the vote counters of the given polls (default: all)"""
+    job.report_progress(0, 1)
+    choices, questions = reconcile_vote_counts(job.payload.get('question_ids'))
+    return {'choices': choices, 'questions': questions}
+
+
+@task('backfill_rollups')
+def rebuild_rollups(job):
+    """Rebuild the timeline rollups of the given polls one at a time (default: all at once)"""
+    question_ids = job.payload.get('question_ids')
+    if not question_ids:
+        job.report_progress(0, 1)
+        return {'rows': backfill_rollups(batch_size=chunk_size())}
+
+    rows = 0
+    job.report_progress(0, len(question_ids))
+    for done, question_id in enumerate(question_ids, 1):
+        rows += backfill_rollups([question_id], batch_size=chunk_size())
+        job.report_progress(done)
+    return {'rows': rows}
+
+
+def export_storage():
+    """Where export jobs leave their files; not under MEDIA_ROOT, as exports name voters"""
+    return FileSystemStorage(location=getattr(settings, 'POLL_JOB_EXPORT_ROOT', settings.BASE_DIR / 'exports'))
+
+
+@task('export_votes')
+def export_votes(job):
+    """Write the votes matching the export filters to a file in export_storage()"""
+    payload = job.payload
+    export_format = payload.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format: {export_format!r}')
+    votes = filter_votes(
+        payload.get('question_ids'), payload.get('category'),
+        parse_bound(payload.get('since')), parse_bound(payload.get('until'), end_of_day=True),
+    )
+    job.report_progress(0, votes.count())
+
+    rows = 0
+
+    def progress(count):
+        nonlocal rows
+        rows = count
+        job.report_progress(count)
+
+    storage = export_storage()
+    name = f'votes-{job.pk}.{export_format}'
+    with tempfile.TemporaryFile('w+', newline='', encoding='utf-8') as output:
+        output.writelines(export_lines(votes, export_format, chunk_size(), progress=progress))
+        output.seek(0)
+        # A retry replaces the file of the failed attempt
+        storage.delete(name)
+        name = storage.save(name, File(output))
+    return {'file': name, 'rows': rows}
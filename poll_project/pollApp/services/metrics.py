@@ -0,0 +1,92 @@
+"""In-process request histograms, exposed in the Prometheus text format
+
+Each worker process keeps its own histograms (like prometheus_client without
+its multiprocess mode), so with several workers every scrape sees the worker
+that answered it; sum them with PromQL, e.g. sum by (view, le) (...).
+"""
+import threading
+
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+# name -> (help, buckets)
+HISTOGRAMS = {
+    'poll_request_duration_seconds': ('Wall time of requests by view', SECONDS_BUCKETS),
+    'poll_request_queries': ('SQL queries per request by view', QUERY_BUCKETS),
+    'poll_request_sql_seconds': ('Time spent in SQL per request by view', SECONDS_BUCKETS),
+    'poll_request_template_seconds': ('Time spent rendering templates per request by view', SECONDS_BUCKETS),
+}
+# name -> help
+COUNTERS = {
+    'poll_query_budget_exceeded_total': 'Requests that made more queries than their view is budgeted',
+}
+
+
+class Histogram:
+    """Cumulative-bucket histogram, as Prometheus expects it"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            # (name, view) -> Histogram, (name, view) -> int
+            self.histograms = {}
+            self.counters = {}
+
+    def observe(self, name, view, value):
+        with self._lock:
+            histogram = self.histograms.get((name, view))
+            if histogram is None:
+                histogram = self.histograms[name, view] = Histogram(HISTOGRAMS[name][1])
+            histogram.observe(value)
+
+    def increment(self, name, view, amount=1):
+        with self._lock:
+            self.counters[name, view] = self.counters.get((name, view), 0) + amount
+
+    def render(self):
+        """Everything recorded so far in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, (help_text, _) in HISTOGRAMS.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for (metric, view), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    label = f'view="{_escape(view)}"'
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{label},le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{label}}} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{{{label}}} {histogram.count}')
+            for name, help_text in COUNTERS.items():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+                for (metric, view), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{{view="{_escape(view)}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
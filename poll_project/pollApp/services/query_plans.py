@@ -0,0 +1,82 @@
+import re
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+
+# Tables that may be scanned: small lookup tables, read whole on purpose
+ALLOWED_SCANS = {
+    'pollApp_category': 'category filter lists every category',
+}
+
+EXPLAINED_STATEMENTS = ('SELECT', 'UPDATE', 'DELETE')
+
+SQLITE_SCAN_RE = re.compile(r'\bSCAN (\S+)(.*)')
+POSTGRES_SCAN_RE = re.compile(r'Seq Scan on (\S+)')
+
+
+class PlanProblem:
+    """A query whose plan reads a whole table"""
+
+    def __init__(self, page, sql, table, plan):
+        self.page = page
+        self.sql = sql
+        self.table = table
+        self.plan = plan
+
+
+def explain(sql):
+    """Plan lines for one statement on the current database"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+        cursor.execute(f'EXPLAIN {sql}')
+        return [row[0] for row in cursor.fetchall()]
+
+
+def full_scans(plan):
+    """Tables a plan scans without an index"""
+    tables = []
+    for line in plan:
+        if connection.vendor == 'sqlite':
+            match = SQLITE_SCAN_RE.search(line)
+            # "SCAN t USING [COVERING] INDEX" walks an index; virtual tables (FTS) use their own
+            if match and not re.search(r'USING (COVERING )?INDEX|USING INTEGER PRIMARY KEY|VIRTUAL TABLE', match.group(2)):
+                tables.append(match.group(1))
+        else:
+            match = POSTGRES_SCAN_RE.search(line)
+            if match:
+                tables.append(match.group(1))
+    return tables
+
+
+def capture_queries(pages, user=None):
+    """Request each (label, method, path, data) page and return (label, sql) pairs"""
+    client = Client()
+    if user is not None:
+        client.force_login(user)
+    captured = []
+    for label, method, path, data in pages:
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(path, data or {})
+        if response.status_code >= 400:
+            raise RuntimeError(f'{label}: {method.upper()} {path} returned {response.status_code}')
+        captured.extend((label, query['sql']) for query in queries.captured_queries)
+    return captured
+
+
+def check_plans(captured):
+    """Explain every captured statement; returns (number explained, problems)"""
+    problems = []
+    seen = set()
+    for page, sql in captured:
+        if not sql.lstrip().upper().startswith(EXPLAINED_STATEMENTS) or sql in seen:
+            continue
+        seen.add(sql)
+        plan = explain(sql)
+        for table in full_scans(plan):
+            if table.strip('"') not in ALLOWED_SCANS:
+                problems.append(PlanProblem(page, sql, table, plan))
+    return len(seen), problems
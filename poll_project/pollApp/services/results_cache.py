@@ -0,0 +1,171 @@
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from ..models import ResultSnapshot
+from .tabulation import tabulate
+
+
+class LRUCache:
+    """Small thread-safe in-process LRU used in front of Django's cache"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local = LRUCache(getattr(settings, 'POLL_RESULTS_LRU_SIZE', 256))
+
+
+def _cache_key(question):
+    # created_at guards against a recycled primary key picking up the
+    # cached results of a deleted poll
+    stamp = int(question.created_at.timestamp() * 1000000) if question.created_at else 0
+    return f'poll-results:{question.pk}:{stamp}'
+
+
+def _is_fresh(entry, question):
+    """An entry is usable if it is at least as new as the question row, or young enough"""
+    if entry is None:
+        return False
+    if entry['version'] >= question.results_version:
+        return True
+    staleness = getattr(settings, 'POLL_RESULTS_MAX_STALENESS', 0)
+    return time.time() - entry['built_at'] <= staleness
+
+
+RESULT_FIELDS = ('id', 'choice_text', 'description', 'votes')
+
+
+def _tally(question, choices):
+    total_votes = question.total_votes
+    for choice in choices:
+        choice['percentage'] = round(choice['votes'] / total_votes * 100, 1) if total_votes else 0
+    return {
+        'total_votes': total_votes,
+        'choices': choices,
+        'chart': {
+            'labels': [choice['choice_text'] for choice in choices],
+            'data': [choice['votes'] for choice in choices],
+        },
+    }
+
+
+def build_results(question):
+    """Choice tallies, percentages and Chart.js data for a poll, and the tabulation of a ranked one"""
+    data = _tally(question, list(question.choice_set.values(*RESULT_FIELDS)))
+    if question.ranking_method:
+        data['tabulation'] = tabulate(question)
+    return data
+
+
+async def abuild_results(question):
+    """Async counterpart of build_results"""
+    data = _tally(question, [choice async for choice in question.choice_set.values(*RESULT_FIELDS)])
+    if question.ranking_method:
+        data['tabulation'] = await sync_to_async(tabulate)(question)
+    return data
+
+
+def _snapshot(question):
+    """Filter for the frozen results of a closed poll, if they are still its current results"""
+    return ResultSnapshot.objects.filter(question_id=question.pk, results_version=question.results_version)
+
+
+def load_results(question):
+    """A closed poll's snapshot, or results built from the database"""
+    if question.status == 'closed':
+        data = _snapshot(question).values_list('data', flat=True).first()
+        if data is not None:
+            return data
+    return build_results(question)
+
+
+async def aload_results(question):
+    """Async counterpart of load_results"""
+    if question.status == 'closed':
+        data = await _snapshot(question).values_list('data', flat=True).afirst()
+        if data is not None:
+            return data
+    return await abuild_results(question)
+
+
+def freeze_results(question):
+    """Store the results of a closed poll as its snapshot and put them in the cache
+
+    Closed polls take no votes, so the snapshot holds for as long as
+    results_version does; an admin edit afterwards makes readers fall back
+    to building the results.
+    """
+    data = build_results(question)
+    ResultSnapshot.objects.update_or_create(
+        question_id=question.pk, defaults={'results_version': question.results_version, 'data': data},
+    )
+    cache.set(_cache_key(question), _new_entry(question, data), getattr(settings, 'POLL_RESULTS_CACHE_TIMEOUT', 300))
+    return data
+
+
+def _new_entry(question, data):
+    return {'version': question.results_version, 'built_at': time.time(), 'data': data}
+
+
+def get_results(question):
+    """Cached results for a poll, keyed by (question, results_version)
+
+    Looks in the process-local LRU first, then Django's cache, and only
+    rebuilds on a miss (from the snapshot of a closed poll). Every vote bumps
+    Question.results_version, so a reader holding a fresh question row never
+    gets older numbers than POLL_RESULTS_MAX_STALENESS seconds allow
+    (0 by default: always the current version). The returned dict is shared
+    between requests and must not be modified.
+    """
+    key = _cache_key(question)
+    entry = _local.get(key)
+    if not _is_fresh(entry, question):
+        entry = cache.get(key)
+        if not _is_fresh(entry, question):
+            entry = _new_entry(question, load_results(question))
+            cache.set(key, entry, getattr(settings, 'POLL_RESULTS_CACHE_TIMEOUT', 300))
+        _local.set(key, entry)
+    return entry['data']
+
+
+async def aget_results(question):
+    """Async counterpart of get_results, for the ASGI views"""
+    key = _cache_key(question)
+    entry = _local.get(key)
+    if not _is_fresh(entry, question):
+        entry = await cache.aget(key)
+        if not _is_fresh(entry, question):
+            entry = _new_entry(question, await aload_results(question))
+            await cache.aset(key, entry, getattr(settings, 'POLL_RESULTS_CACHE_TIMEOUT', 300))
+        _local.set(key, entry)
+    return entry['data']
+
+
+def clear_local_results_cache():
+    """Drop this process's LRU tier (Django's cache is left alone)"""
+    _local.clear()
@@ -0,0 +1,159 @@
+"""Votes over time, kept as per-choice counts in minute, hour and day buckets
+
+Every ballot change adds its net effect to the VoteRollup rows of the
+current minute, hour and day (a changed vote is -1 for the old choice and
++1 for the new one), so summing a choice's buckets gives its current tally
+and a timeline reads at most buckets x choices rows however many votes the
+poll has. The rows are written with one INSERT ... ON CONFLICT DO UPDATE,
+which SQLite and PostgreSQL both support, in the same transaction as the
+votes (or with the buffered counters, when POLL_VOTE_BUFFERING is on).
+
+backfill_rollups rebuilds them from Vote.voted_at, e.g. for votes cast
+before rollups existed. Only surviving votes are in the Vote table, so
+there each vote counts in the bucket it was cast in.
+"""
+import datetime
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from ..models import Vote, VoteRollup
+
+
+GRANULARITIES = {
+    'minute': datetime.timedelta(minutes=1),
+    'hour': datetime.timedelta(hours=1),
+    'day': datetime.timedelta(days=1),
+}
+# Fields zeroed to find the start of a bucket
+_TRUNCATE = {
+    'minute': {'second': 0, 'microsecond': 0},
+    'hour': {'minute': 0, 'second': 0, 'microsecond': 0},
+    'day': {'hour': 0, 'minute': 0, 'second': 0, 'microsecond': 0},
+}
+# Rows per upsert statement, well under SQLite's bound parameter limit
+UPSERT_BATCH = 100
+
+
+def bucket_start(moment, granularity):
+    """Start of the UTC minute, hour or day containing moment"""
+    return moment.astimezone(datetime.timezone.utc).replace(**_TRUNCATE[granularity])
+
+
+def rollup_deltas(question_id, added, removed, moment=None):
+    """{(question_id, choice_id, granularity, bucket): delta} for a ballot change"""
+    moment = moment or timezone.now()
+    deltas = Counter()
+    for granularity in GRANULARITIES:
+        bucket = bucket_start(moment, granularity)
+        for choice_id in added:
+            deltas[question_id, choice_id, granularity, bucket] += 1
+        for choice_id in removed:
+            deltas[question_id, choice_id, granularity, bucket] -= 1
+    return deltas
+
+
+def apply_rollups(deltas):
+    """Add the deltas to their buckets, creating missing rows; returns how many were written"""
+    deltas = [(key, delta) for key, delta in deltas.items() if delta]
+    if not deltas:
+        return 0
+
+    connection = connections[router.db_for_write(VoteRollup)]
+    quote = connection.ops.quote_name
+    table = quote(VoteRollup._meta.db_table)
+    bucket_field = VoteRollup._meta.get_field('bucket')
+    key_columns = ', '.join(quote(column) for column in ('question_id', 'granularity', 'bucket', 'choice_id'))
+    votes = quote('votes')
+    with connection.cursor() as cursor:
+        for start in range(0, len(deltas), UPSERT_BATCH):
+            batch = deltas[start:start + UPSERT_BATCH]
+            params = []
+            for (question_id, choice_id, granularity, bucket), delta in batch:
+                params += [question_id, granularity, bucket_field.get_db_prep_value(bucket, connection), choice_id, delta]
+            cursor.execute(
+                f'INSERT INTO {table} ({key_columns}, {votes}) '
+                f'VALUES {", ".join(["(%s, %s, %s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT ({key_columns}) DO UPDATE SET {votes} = {table}.{votes} + excluded.{votes}',
+                params,
+            )
+    return len(deltas)
+
+
+def backfill_rollups(question_ids=None, batch_size=1000):
+    """Rebuild the rollups of the given polls (default: all) from the Vote table
+
+    Run it while the polls are not taking votes: a vote recorded during the
+    rebuild can be counted twice or not at all. Returns the rows written.
+    """
+    votes = Vote.objects.filter(voted_at__isnull=False)
+    rollups = VoteRollup.objects.all()
+    if question_ids:
+        votes = votes.filter(question_id__in=question_ids)
+        rollups = rollups.filter(question_id__in=question_ids)
+
+    written = 0
+    with transaction.atomic():
+        rollups.delete()
+        for granularity in GRANULARITIES:
+            # Grouped by the database: one row per (choice, bucket), not per vote
+            rows = (
+                votes.annotate(slot=Trunc('voted_at', granularity, tzinfo=datetime.timezone.utc))
+                .values('question_id', 'choice_id', 'slot')
+                .annotate(total=Count('pk'))
+                .order_by()
+            )
+            batch = []
+            for row in rows.iterator(chunk_size=batch_size):
+                batch.append(VoteRollup(
+                    question_id=row['question_id'], choice_id=row['choice_id'],
+                    granularity=granularity, bucket=row['slot'], votes=row['total'],
+                ))
+                if len(batch) >= batch_size:
+                    written += len(VoteRollup.objects.bulk_create(batch))
+                    batch = []
+            written += len(VoteRollup.objects.bulk_create(batch))
+    return written
+
+
+def pick_granularity(start, end, wanted=None):
+    """The finest granularity, no finer than wanted, that covers start..end in POLL_TIMELINE_MAX_BUCKETS"""
+    names = list(GRANULARITIES)
+    max_buckets = getattr(settings, 'POLL_TIMELINE_MAX_BUCKETS', 500)
+    for granularity in names[names.index(wanted) if wanted else 0:]:
+        if (end - start) / GRANULARITIES[granularity] < max_buckets:
+            return granularity
+    return names[-1]
+
+
+def timeline(question, wanted=None, now=None):
+    """Votes per choice per bucket from the poll's start to its end (or now), gaps filled with zeros"""
+    now = now or timezone.now()
+    start = question.start_date or question.pub_date
+    end = min(now, question.end_date) if question.end_date else now
+    end = max(start, end)
+    granularity = pick_granularity(start, end, wanted)
+
+    # The only rows read: at most buckets x choices of them
+    rows = list(
+        VoteRollup.objects.filter(question=question, granularity=granularity)
+        .values_list('choice_id', 'bucket', 'votes')
+    )
+    step = GRANULARITIES[granularity]
+    first = min([bucket_start(start, granularity)] + [bucket for _, bucket, _ in rows])
+    last = max([bucket_start(end, granularity)] + [bucket for _, bucket, _ in rows])
+    buckets = [first + step * index for index in range(int((last - first) / step) + 1)]
+
+    position = {bucket: index for index, bucket in enumerate(buckets)}
+    choices = [
+        {'id': choice_id, 'choice_text': choice_text, 'votes': [0] * len(buckets)}
+        for choice_id, choice_text in question.choice_set.values_list('pk', 'choice_text')
+    ]
+    by_id = {choice['id']: choice for choice in choices}
+    for choice_id, bucket, votes in rows:
+        by_id[choice_id]['votes'][position[bucket]] += votes
+    return {'granularity': granularity, 'buckets': buckets, 'choices': choices}
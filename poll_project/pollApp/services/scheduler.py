@@ -0,0 +1,125 @@
+"""Moves Question.status along at the exact start and end of each poll
+
+Saving a poll sets its status from its dates; after that only the passing
+of time can change it, and that is this module's job. `manage.py
+poll_scheduler` keeps a heap of (next start or end, poll id), sleeps until
+the earliest one passes and then flips the polls that are due with a
+conditional UPDATE. Polls created or edited meanwhile are picked up from
+Question.updated_at on every wake-up.
+
+A transition bumps updated_at, which is part of the poll card cache key and
+the API ETags, so cached pages show the new status at once. When a poll
+closes its results are frozen into a ResultSnapshot (see
+results_cache.freeze_results); Question.save() does the same for a poll
+closed by an edit.
+
+Votes do not wait for the scheduler: Question.accepts_votes() checks the
+dates themselves.
+"""
+import datetime
+import heapq
+import logging
+import threading
+
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import Question
+from .results_cache import freeze_results
+
+
+logger = logging.getLogger(__name__)
+
+SYNC_OVERLAP = datetime.timedelta(seconds=5)
+
+
+def transition(question_ids=None, now=None):
+    """Move polls whose start or end has passed to their new status; returns {poll id: status}"""
+    now = now or timezone.now()
+    due = Question.objects.filter(
+        Q(status='upcoming', start_date__lte=now) | Q(status__in=['upcoming', 'active'], end_date__lt=now)
+    )
+    if question_ids is not None:
+        due = due.filter(pk__in=question_ids)
+
+    changed = {}
+    for question in due.only('pk', 'status', 'start_date', 'end_date'):
+        status = question.scheduled_status(now)
+        # Unless an edit got there first
+        if Question.objects.filter(pk=question.pk, status=question.status).update(status=status, updated_at=now):
+            changed[question.pk] = status
+
+    for question in Question.objects.filter(pk__in=[pk for pk, status in changed.items() if status == 'closed']):
+        freeze_results(question)
+    for pk, status in changed.items():
+        logger.info('Poll %s is now %s', pk, status)
+    return changed
+
+
+class Scheduler:
+    """Heap of the upcoming poll starts and ends"""
+
+    def __init__(self):
+        self.heap = []
+        # pk -> boundary in the heap, so a poll seen again is only pushed when its boundary moved
+        self.queued = {}
+        self.synced_at = None
+
+    def sync(self, now=None):
+        """Add the boundaries of polls saved since the last sync (all of them the first time)"""
+        now = now or timezone.now()
+        polls = Question.objects.filter(Q(status='upcoming') | Q(status='active', end_date__isnull=False))
+        if self.synced_at is not None:
+            # A little overlap for saves that committed just after the last sync read
+            polls = polls.filter(updated_at__gte=self.synced_at - SYNC_OVERLAP)
+        self.synced_at = now
+        for question in polls.only('pk', 'status', 'start_date', 'end_date'):
+            boundary = question.next_transition()
+            if self.queued.get(question.pk) != boundary:
+                # An edited poll leaves its outdated entry behind; transition() ignores it
+                self.queued[question.pk] = boundary
+                heapq.heappush(self.heap, (boundary, question.pk))
+
+    def next_boundary(self):
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now):
+        """Ids of the polls whose boundary has passed"""
+        due = set()
+        while self.heap and self.heap[0][0] < now:
+            boundary, pk = heapq.heappop(self.heap)
+            if self.queued.get(pk) == boundary:
+                del self.queued[pk]
+            due.add(pk)
+        return due
+
+    def tick(self, now=None):
+        """Apply the transitions that are due, then pick up saved polls (and the end of any poll that opened)"""
+        now = now or timezone.now()
+        due = self.pop_due(now)
+        changed = transition(due, now) if due else {}
+        self.sync(now)
+        return changed
+
+
+def run(stop=None, interval=1.0):
+    """Apply transitions as their time comes until stop is set
+
+    Sleeps until the next boundary, but never longer than interval seconds,
+    which bounds how late a poll saved in the meantime can be.
+    """
+    stop = stop or threading.Event()
+    scheduler = Scheduler()
+    # Catch up with whatever passed while the scheduler was not running
+    transition()
+    while not stop.is_set():
+        close_old_connections()
+        now = timezone.now()
+        scheduler.tick(now)
+        wait = interval
+        boundary = scheduler.next_boundary()
+        if boundary is not None:
+            wait = min(wait, max((boundary - timezone.now()).total_seconds(), 0) + 0.001)
+        stop.wait(wait)
+
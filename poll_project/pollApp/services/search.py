@@ -0,0 +1,241 @@
+import re
+import unicodedata
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Sum
+
+from ..models import Choice, Question, SearchTerm
+
+
+# Table name of the SQLite FTS5 index (created by migration 0007 when FTS5 is available)
+FTS_TABLE = 'pollapp_search'
+
+# Relative weight of each indexed field in the ranking
+FIELD_WEIGHTS = {
+    'question_text': 10.0,
+    'description': 2.0,
+    'choices': 4.0,
+    'category': 3.0,
+}
+
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 8
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Lowercase words without diacritics, the same way FTS5's unicode61 tokenizer splits them"""
+    text = unicodedata.normalize('NFKD', text or '').lower()
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(text.replace('_', ' '))]
+
+
+def build_documents(questions, choices):
+    """Search documents for a Question queryset, with choice texts from a Choice queryset
+
+    Takes querysets so that migrations can pass their historical models.
+    """
+    documents = {
+        row['id']: {
+            'id': row['id'],
+            'question_text': row['question_text'],
+            'description': row['description'],
+            'choices': [],
+            'category': row['category__name'] or '',
+        }
+        for row in questions.values('id', 'question_text', 'description', 'category__name')
+    }
+    if documents:
+        choice_rows = choices.filter(question_id__in=documents).order_by('pk').values_list('question_id', 'choice_text')
+        for question_id, choice_text in choice_rows:
+            documents[question_id]['choices'].append(choice_text)
+    for document in documents.values():
+        document['choices'] = ' '.join(document['choices'])
+    return list(documents.values())
+
+
+def fts5_available(conn=None):
+    """Whether the database is SQLite with the FTS5 extension compiled in"""
+    conn = conn or connection
+    if conn.vendor != 'sqlite':
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any(option == 'ENABLE_FTS5' for option, in cursor.fetchall())
+
+
+class FTS5Backend:
+    """Ranked search in an SQLite FTS5 virtual table, one row per poll (rowid = question id)"""
+
+    name = 'fts5'
+
+    @staticmethod
+    def create(schema_editor):
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+            f"{', '.join(FIELD_WEIGHTS)}, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+
+    @staticmethod
+    def drop(schema_editor):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+    def index(self, documents):
+        if not documents:
+            return
+        fields = list(FIELD_WEIGHTS)
+        with connection.cursor() as cursor:
+            self._delete(cursor, [document['id'] for document in documents])
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(fields)}) VALUES (%s{', %s' * len(fields)})",
+                [[document['id']] + [document[field] for field in fields] for document in documents],
+            )
+
+    def remove(self, question_ids):
+        if question_ids:
+            with connection.cursor() as cursor:
+                self._delete(cursor, list(question_ids))
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+    def _delete(self, cursor, question_ids):
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [[pk] for pk in question_ids])
+
+    def search(self, terms, limit):
+        # Every term must match, each as a prefix; bm25() is lower for better matches
+        match = ' '.join(f'"{term}"*' for term in terms)
+        weights = ', '.join(str(weight) for weight in FIELD_WEIGHTS.values())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, {weights}), rowid DESC LIMIT %s',
+                [match, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class TermsBackend:
+    """Portable inverted index in the SearchTerm table, tokenized in Python
+
+    Used on databases without FTS5. Each (term, poll) row carries the summed
+    field weights of the term's occurrences; a query adds up the weights of
+    the terms each query word is a prefix of, and keeps polls matching every
+    word.
+    """
+
+    name = 'terms'
+
+    def __init__(self, term_model=None):
+        self.term_model = term_model or SearchTerm
+
+    def index(self, documents):
+        if not documents:
+            return
+        self.remove([document['id'] for document in documents])
+        rows = []
+        for document in documents:
+            weights = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                for term in tokenize(document[field]):
+                    weights[term] += weight
+            rows.extend(
+                self.term_model(term=term, question_id=document['id'], weight=weight)
+                for term, weight in weights.items()
+            )
+        self.term_model.objects.bulk_create(rows, batch_size=1000)
+
+    def remove(self, question_ids):
+        if question_ids:
+            self.term_model.objects.filter(question_id__in=list(question_ids)).delete()
+
+    def clear(self):
+        self.term_model.objects.all().delete()
+
+    def _prefix(self, term):
+        terms = self.term_model.objects.all()
+        if connection.vendor == 'sqlite':
+            # SQLite only uses the index for LIKE with a NOCASE column, so use a range
+            return terms.filter(term__gte=term, term__lt=term[:-1] + chr(ord(term[-1]) + 1))
+        return terms.filter(term__startswith=term)
+
+    def search(self, terms, limit):
+        scores = None
+        for term in terms:
+            hits = dict(
+                self._prefix(term).order_by().values('question_id')
+                .annotate(score=Sum('weight')).values_list('question_id', 'score')
+            )
+            if scores is None:
+                scores = hits
+            else:
+                scores = {pk: scores[pk] + score for pk, score in hits.items() if pk in scores}
+            if not scores:
+                return []
+        return sorted(scores, key=lambda pk: (-scores[pk], -pk))[:limit]
+
+
+def make_backend(conn=None, term_model=None):
+    """Backend for POLL_SEARCH_BACKEND; 'auto' picks FTS5 where the database has it"""
+    choice = getattr(settings, 'POLL_SEARCH_BACKEND', 'auto')
+    if choice == 'auto':
+        choice = 'fts5' if fts5_available(conn) else 'terms'
+    return FTS5Backend() if choice == 'fts5' else TermsBackend(term_model)
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = make_backend()
+    return _backend
+
+
+def index_questions(question_ids):
+    """(Re)index the given polls"""
+    question_ids = list(question_ids)
+    if question_ids:
+        questions = Question.objects.filter(pk__in=question_ids)
+        get_backend().index(build_documents(questions, Choice.objects.all()))
+
+
+def remove_questions(question_ids):
+    get_backend().remove(question_ids)
+
+
+def batched_ids(questions, batch_size):
+    """Primary keys of a Question queryset in ascending batches, safe to write between"""
+    last = 0
+    while True:
+        batch = list(questions.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+
+def rebuild_index(batch_size=5000, progress=None):
+    """Reindex every poll in batches; returns the number of polls indexed"""
+    get_backend().clear()
+    indexed = 0
+    for batch in batched_ids(Question.objects.all(), batch_size):
+        index_questions(batch)
+        indexed += len(batch)
+        if progress:
+            progress(indexed)
+    return indexed
+
+
+def search_polls(query, limit=None):
+    """Ids of the polls matching every word of the query (as prefixes), best first"""
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return []
+    limit = limit or getattr(settings, 'POLL_SEARCH_MAX_RESULTS', 500)
+    return get_backend().search(terms, limit)
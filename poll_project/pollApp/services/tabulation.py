@@ -0,0 +1,319 @@
+"""Instant-runoff, Borda and Condorcet tabulation of ranked ballots
+
+A poll's ballots are read once per results version (results_cache keeps the
+outcome until the next vote) and packed into a Ballots table: identical
+rankings are merged into one row with a weight, and the distinct rankings
+are stored as a flat integer array of choice indexes, width slots per row,
+padded with -1. The methods only need a few primitives over that table,
+which run as vectorised NumPy operations when NumPy is installed and as
+loops over the standard library arrays otherwise. The loops only visit
+distinct rankings (and instant runoff only moves the ballots of the choice
+it eliminates), so they stay fast while voters far outnumber the orderings
+they actually use.
+
+Ties are broken by first-preference votes, then by choice order (the choice
+added later loses).
+"""
+from array import array
+from collections import Counter
+
+from ..models import Question, Vote
+
+try:
+    import numpy
+except ImportError:
+    # Optional: the array-based primitives below are used instead
+    numpy = None
+
+
+class Ballots:
+    """Distinct rankings packed into integer arrays, with how many voters cast each"""
+
+    def __init__(self, choices, rankings):
+        # choices: (id, choice_text) pairs; rankings count tuples of indexes into them, best first
+        self.choices = list(choices)
+        self.width = max(map(len, rankings), default=0)
+        self.rows = len(rankings)
+        self.flat = array('i')
+        self.weights = array('q')
+        for ranking, weight in rankings.items():
+            self.flat.extend(ranking)
+            self.flat.extend([-1] * (self.width - len(ranking)))
+            self.weights.append(weight)
+        self._matrix = None
+
+    @property
+    def size(self):
+        return len(self.choices)
+
+    @property
+    def total(self):
+        return sum(self.weights)
+
+    def rankings(self):
+        """(ranking, weight) pairs, without the padding"""
+        width = self.width
+        for row, weight in enumerate(self.weights):
+            ranking = self.flat[row * width:(row + 1) * width]
+            yield [choice for choice in ranking if choice >= 0], weight
+
+    def matrix(self):
+        """(rows x width matrix, weights) as NumPy arrays sharing the packed buffers"""
+        if self._matrix is None:
+            self._matrix = (
+                numpy.frombuffer(self.flat, dtype=numpy.intc).reshape(self.rows, self.width),
+                numpy.frombuffer(self.weights, dtype=numpy.int64),
+            )
+        return self._matrix
+
+
+def pack(choices, ballots):
+    """Ballots from (id, choice_text) pairs and an iterable of rankings (lists of choice ids)"""
+    index = {choice_id: position for position, (choice_id, _) in enumerate(choices)}
+    return Ballots(choices, Counter(tuple(index[choice_id] for choice_id in ranking) for ranking in ballots))
+
+
+def _voter_rankings(rows):
+    """Group (user_id, choice_id) rows, ordered by user then rank, into rankings"""
+    current_user, ranking = None, []
+    for user_id, choice_id in rows:
+        if user_id != current_user:
+            if ranking:
+                yield ranking
+            current_user, ranking = user_id, []
+        ranking.append(choice_id)
+    if ranking:
+        yield ranking
+
+
+def load_ballots(question):
+    """Pack a poll's ranked ballots (votes cast before it was ranked have no rank and are left out)"""
+    choices = list(question.choice_set.values_list('pk', 'choice_text'))
+    rows = (
+        Vote.objects.filter(question=question, rank__isnull=False)
+        .order_by('user_id', 'rank')
+        .values_list('user_id', 'choice_id')
+    )
+    return pack(choices, _voter_rankings(rows.iterator(chunk_size=10000)))
+
+
+# Primitives, each with a NumPy and an array implementation
+
+def first_preferences(ballots):
+    """Weight of the ballots ranking each choice first"""
+    if numpy is not None and ballots.rows:
+        matrix, weights = ballots.matrix()
+        return [int(count) for count in numpy.bincount(matrix[:, 0], weights=weights, minlength=ballots.size)]
+    counts = [0] * ballots.size
+    for ranking, weight in ballots.rankings():
+        counts[ranking[0]] += weight
+    return counts
+
+
+def positional_scores(ballots):
+    """Borda points: size - 1 for a first preference down to 0, unranked choices get nothing"""
+    size = ballots.size
+    if numpy is not None and ballots.rows:
+        matrix, weights = ballots.matrix()
+        points = (size - 1 - numpy.arange(ballots.width)) * weights[:, None]
+        ranked = matrix >= 0
+        return [int(score) for score in numpy.bincount(matrix[ranked], weights=points[ranked], minlength=size)]
+    scores = [0] * size
+    for ranking, weight in ballots.rankings():
+        for position, choice in enumerate(ranking):
+            scores[choice] += (size - 1 - position) * weight
+    return scores
+
+
+def pairwise_preferences(ballots):
+    """wins[a][b]: weight of the ballots preferring a to b (ranked choices beat unranked ones)"""
+    size = ballots.size
+    if numpy is not None and ballots.rows:
+        matrix, weights = ballots.matrix()
+        # Each choice's position on each ballot; unranked choices share the last place
+        positions = numpy.full((ballots.rows, size), ballots.width, dtype=numpy.intc)
+        rows, columns = numpy.nonzero(matrix >= 0)
+        positions[rows, matrix[rows, columns]] = columns
+        return [
+            [int(count) for count in weights @ (positions[:, [choice]] < positions)]
+            for choice in range(size)
+        ]
+    wins = [[0] * size for _ in range(size)]
+    for ranking, weight in ballots.rankings():
+        unranked = set(range(size)).difference(ranking)
+        for position, choice in enumerate(ranking):
+            row = wins[choice]
+            for other in ranking[position + 1:]:
+                row[other] += weight
+            for other in unranked:
+                row[other] += weight
+    return wins
+
+
+class _PileCounter:
+    """Instant-runoff counts kept in piles, moving only the eliminated choice's ballots"""
+
+    def __init__(self, ballots):
+        self.rankings = list(ballots.rankings())
+        self.remaining = [True] * ballots.size
+        self.counts = [0] * ballots.size
+        # choice -> [(row, position of the choice on that ballot)]
+        self.piles = [[] for _ in range(ballots.size)]
+        for row, (ranking, weight) in enumerate(self.rankings):
+            self.piles[ranking[0]].append((row, 0))
+            self.counts[ranking[0]] += weight
+
+    def eliminate(self, choice):
+        self.remaining[choice] = False
+        pile, self.piles[choice] = self.piles[choice], []
+        self.counts[choice] = 0
+        for row, position in pile:
+            ranking, weight = self.rankings[row]
+            for later in range(position + 1, len(ranking)):
+                if self.remaining[ranking[later]]:
+                    self.piles[ranking[later]].append((row, later))
+                    self.counts[ranking[later]] += weight
+                    break
+
+
+class _VectorCounter:
+    """Instant-runoff counts recomputed with NumPy after each elimination"""
+
+    def __init__(self, ballots):
+        self.matrix, self.weights = ballots.matrix()
+        self.size = ballots.size
+        # One extra slot that is never remaining, read by the -1 padding
+        self.remaining_mask = numpy.ones(ballots.size + 1, dtype=bool)
+        self.remaining_mask[-1] = False
+        self._count()
+
+    @property
+    def remaining(self):
+        return self.remaining_mask[:-1].tolist()
+
+    def eliminate(self, choice):
+        self.remaining_mask[choice] = False
+        self._count()
+
+    def _count(self):
+        live = self.remaining_mask[self.matrix]
+        first = live.argmax(axis=1)
+        rows = numpy.arange(len(self.matrix))
+        counted = live[rows, first]
+        counts = numpy.bincount(self.matrix[rows, first][counted], weights=self.weights[counted], minlength=self.size)
+        self.counts = [int(count) for count in counts]
+
+
+# Methods
+
+def _entry(ballots, choice, **values):
+    choice_id, choice_text = ballots.choices[choice]
+    return {'id': choice_id, 'choice_text': choice_text, **values}
+
+
+def _tie_order(first, choice):
+    """Sort key that puts the choice losing a tie first"""
+    return first[choice], -choice
+
+
+def _outcome(method, ballots, winner, standings, **extra):
+    return {
+        'method': method,
+        'method_name': dict(Question.RANKING_METHODS)[method],
+        'ballots': ballots.total,
+        'winner': _entry(ballots, winner) if winner is not None else None,
+        'standings': standings,
+        **extra,
+    }
+
+
+def instant_runoff(ballots):
+    """Eliminate the choice with the fewest votes until one has a majority of the continuing ballots
+
+    standings lists the winner first, then the others by the round they
+    reached; each score is the choice's votes in its last round. rounds holds
+    every choice's votes per round (None once eliminated) and exhausted the
+    ballots with no remaining choice left, per round.
+    """
+    total = ballots.total
+    first = first_preferences(ballots)
+    counter = _VectorCounter(ballots) if numpy is not None and ballots.rows else _PileCounter(ballots)
+    history = []
+    eliminated = []
+    winner = None
+    while total:
+        remaining = [choice for choice, left in enumerate(counter.remaining) if left]
+        counts = list(counter.counts)
+        history.append(counts)
+        continuing = sum(counts[choice] for choice in remaining)
+        leader = max(remaining, key=lambda choice: (counts[choice], *_tie_order(first, choice)))
+        if counts[leader] * 2 > continuing or len(remaining) == 1:
+            winner = leader
+            break
+        loser = min(remaining, key=lambda choice: (counts[choice], *_tie_order(first, choice)))
+        eliminated.append(loser)
+        counter.eliminate(loser)
+
+    last_round = {}
+    for round_number, counts in enumerate(history):
+        for choice in range(ballots.size):
+            if choice not in eliminated[:round_number]:
+                last_round[choice] = counts[choice]
+    order = sorted(
+        range(ballots.size),
+        key=lambda choice: (
+            choice == winner,
+            eliminated.index(choice) if choice in eliminated else len(eliminated),
+            last_round.get(choice, 0),
+            *_tie_order(first, choice),
+        ),
+        reverse=True,
+    )
+    standings = [_entry(ballots, choice, score=last_round.get(choice, 0)) for choice in order]
+    rounds = [
+        _entry(ballots, choice, votes=[
+            None if choice in eliminated[:round_number] else counts[choice]
+            for round_number, counts in enumerate(history)
+        ])
+        for choice in range(ballots.size)
+    ]
+    exhausted = [total - sum(counts) for counts in history]
+    return _outcome('irv', ballots, winner, standings, rounds=rounds, exhausted=exhausted)
+
+
+def borda(ballots):
+    """Sum positional points; the highest score wins"""
+    first = first_preferences(ballots)
+    scores = positional_scores(ballots)
+    order = sorted(range(ballots.size), key=lambda choice: (scores[choice], *_tie_order(first, choice)), reverse=True)
+    winner = order[0] if ballots.total else None
+    return _outcome('borda', ballots, winner, [_entry(ballots, choice, score=scores[choice]) for choice in order])
+
+
+def condorcet(ballots):
+    """The choice preferred to every other by a majority, if there is one
+
+    standings are ordered by Copeland score (head-to-head wins minus
+    losses); pairwise holds wins[a][b] in choice order.
+    """
+    first = first_preferences(ballots)
+    wins = pairwise_preferences(ballots)
+    size = ballots.size
+    beats = [sum(wins[a][b] > wins[b][a] for b in range(size)) for a in range(size)]
+    loses = [sum(wins[a][b] < wins[b][a] for b in range(size)) for a in range(size)]
+    winner = next((choice for choice in range(size) if beats[choice] == size - 1), None)
+    if not ballots.total:
+        winner = None
+    order = sorted(
+        range(size), key=lambda choice: (beats[choice] - loses[choice], *_tie_order(first, choice)), reverse=True,
+    )
+    standings = [_entry(ballots, choice, score=beats[choice] - loses[choice]) for choice in order]
+    return _outcome('condorcet', ballots, winner, standings, pairwise=wins)
+
+
+METHODS = {'irv': instant_runoff, 'borda': borda, 'condorcet': condorcet}
+
+
+def tabulate(question):
+    """Load a ranked poll's ballots and tabulate them with its ranking_method"""
+    return METHODS[question.ranking_method](load_ballots(question))
@@ -0,0 +1,154 @@
+"""Sliding-window rate limits for votes, comments and unlock attempts
+
+Each scope in POLL_THROTTLE_RATES limits requests per user and per client
+IP, e.g. {'vote': {'user': '20/m', 'ip': '60/m'}}. Counts live in the
+POLL_THROTTLE_CACHE cache in two fixed windows, and the previous window is
+weighted by how much of it still overlaps the sliding window, which is
+close to an exact sliding log at the cost of two counters per limit. The
+check reads the user id from the session and the counts from the cache.
+With the default database sessions that is one session query before a
+request is rejected (none with cached_db hits or signed cookies). The view
+itself and the user lookup never run for excess requests, and rejected
+requests are not counted.
+"""
+import math
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import caches
+from django.http import HttpResponse
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'20/m' -> (20, 60)"""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+def _cache():
+    return caches[getattr(settings, 'POLL_THROTTLE_CACHE', 'default')]
+
+
+def _limits(scope, user_id, ip):
+    """(key prefix, limit, window) for each limit of the scope that applies to this client"""
+    identities = {'user': user_id, 'ip': ip}
+    limits = []
+    for kind, rate in (getattr(settings, 'POLL_THROTTLE_RATES', {}).get(scope) or {}).items():
+        if rate and identities.get(kind):
+            limit, window = parse_rate(rate)
+            limits.append((f'throttle:{scope}:{kind}:{identities[kind]}', limit, window))
+    return limits
+
+
+def _window_keys(prefix, window, now):
+    current = int(now // window)
+    return f'{prefix}:{current}', f'{prefix}:{current - 1}'
+
+
+def _retry_after(counts, limits, now):
+    """Seconds until every limit has room again, or 0 if the request may go ahead"""
+    wait = 0
+    for prefix, limit, window in limits:
+        current_key, previous_key = _window_keys(prefix, window, now)
+        current, previous = counts.get(current_key, 0), counts.get(previous_key, 0)
+        elapsed = (now % window) / window
+        if current + previous * (1 - elapsed) < limit:
+            continue
+        if current >= limit or not previous:
+            # Full on its own: wait for the next window
+            seconds = window * (1 - elapsed)
+        else:
+            # Wait for enough of the previous window to slide out
+            seconds = window * ((1 - (limit - current) / previous) - elapsed)
+        wait = max(wait, math.ceil(max(round(seconds, 6), 1)))
+    return wait
+
+
+def check(scope, user_id, ip, now=None):
+    """Count a request against the scope's limits; returns seconds to wait if it is over one, else 0"""
+    limits = _limits(scope, user_id, ip)
+    if not limits:
+        return 0
+    now = time.time() if now is None else now
+    cache = _cache()
+    keys = [key for prefix, _, window in limits for key in _window_keys(prefix, window, now)]
+    wait = _retry_after(cache.get_many(keys), limits, now)
+    if not wait:
+        for prefix, _, window in limits:
+            key = _window_keys(prefix, window, now)[0]
+            # Kept for two windows: one as the current window, one as the previous
+            cache.add(key, 0, 2 * window)
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Expired between add() and incr()
+                cache.set(key, 1, 2 * window)
+    return wait
+
+
+async def acheck(scope, user_id, ip, now=None):
+    """Async counterpart of check"""
+    limits = _limits(scope, user_id, ip)
+    if not limits:
+        return 0
+    now = time.time() if now is None else now
+    cache = _cache()
+    keys = [key for prefix, _, window in limits for key in _window_keys(prefix, window, now)]
+    wait = _retry_after(await cache.aget_many(keys), limits, now)
+    if not wait:
+        for prefix, _, window in limits:
+            key = _window_keys(prefix, window, now)[0]
+            await cache.aadd(key, 0, 2 * window)
+            try:
+                await cache.aincr(key)
+            except ValueError:
+                await cache.aset(key, 1, 2 * window)
+    return wait
+
+
+def client_ip(request):
+    # Behind a proxy, have it (or the ASGI server's --proxy-headers) set the real address
+    return request.META.get('REMOTE_ADDR')
+
+
+def too_many_requests(request, retry_after):
+    response = HttpResponse(
+        f'Too many requests. Try again in {retry_after} seconds.', status=429, content_type='text/plain',
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def throttle(scope, methods=('POST',), on_limit=too_many_requests):
+    """Apply the scope's POLL_THROTTLE_RATES to a view's requests with the given methods
+
+    on_limit(request, retry_after) builds the response for a rejected request.
+    Works on sync and async views.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method in methods:
+                    user_id = await request.session.aget(SESSION_KEY)
+                    retry_after = await acheck(scope, user_id, client_ip(request))
+                    if retry_after:
+                        return on_limit(request, retry_after)
+                return await view(request, *args, **kwargs)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method in methods:
+                retry_after = check(scope, request.session.get(SESSION_KEY), client_ip(request))
+                if retry_after:
+                    return on_limit(request, retry_after)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,45 @@
+"""Signed, expiring cookies that unlock password-protected polls
+
+Entering a poll's password sets a poll_unlock_<id> cookie instead of a
+session flag, so viewing and voting on an unlocked poll never touches the
+session. The cookie is signed with SECRET_KEY and a timestamp
+(request.get_signed_cookie) and expires after POLL_UNLOCK_MAX_AGE seconds.
+Its value is derived from the stored password hash, so changing the
+password locks the poll again for everyone.
+"""
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+
+COOKIE_PREFIX = 'poll_unlock_'
+SALT = 'pollApp.unlock'
+
+
+def _cookie_name(question):
+    return f'{COOKIE_PREFIX}{question.pk}'
+
+
+def _fingerprint(question):
+    return salted_hmac(SALT, question.password).hexdigest()[:20]
+
+
+def is_unlocked(request, question):
+    """Whether the request carries a valid unlock cookie for a password-protected poll"""
+    if question.visibility != 'password':
+        return True
+    token = request.get_signed_cookie(
+        _cookie_name(question), default=None, salt=SALT, max_age=settings.POLL_UNLOCK_MAX_AGE,
+    )
+    return token is not None and constant_time_compare(token, _fingerprint(question))
+
+
+def grant(response, question):
+    """Set the unlock cookie for the poll on the response"""
+    response.set_signed_cookie(
+        _cookie_name(question), _fingerprint(question), salt=SALT,
+        max_age=settings.POLL_UNLOCK_MAX_AGE,
+        secure=settings.SESSION_COOKIE_SECURE or None,
+        httponly=True,
+        samesite='Lax',
+    )
+    return response
@@ -0,0 +1,131 @@
+import atexit
+import logging
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+
+from ..models import Choice, Question
+from .rollups import apply_rollups
+
+
+logger = logging.getLogger(__name__)
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+# Counter columns the buffer may touch, keyed by the label used in delta keys
+BUFFERED_MODELS = {
+    'choice': Choice,
+    'question': Question,
+}
+
+
+def buffering_enabled():
+    """Whether votes should be counted through the write-behind buffer"""
+    return getattr(settings, 'POLL_VOTE_BUFFERING', False)
+
+
+def get_vote_buffer():
+    """Return the process-wide vote buffer, creating it on first use"""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = VoteBuffer(getattr(settings, 'POLL_VOTE_FLUSH_INTERVAL_MS', 500))
+                atexit.register(_buffer.stop)
+    return _buffer
+
+
+class VoteBuffer:
+    """In-process write-behind buffer for vote counters
+
+    Vote rows are written synchronously, but the counter deltas are summed
+    here and a background thread turns them into one
+    ``UPDATE ... SET votes = votes + n`` per row every interval. Deltas are
+    keyed by ``(model label, pk, field)``, e.g. ``('choice', 7, 'votes')``;
+    timeline buckets use ``('rollup', rollup key, 'votes')`` and are written
+    with services.rollups.apply_rollups in the same transaction. Each
+    worker process keeps its own buffer; since the flushes are additive this
+    is safe with any number of workers. Deltas held in memory are lost if the
+    process dies, which is what ``manage.py reconcile_votes`` repairs.
+    """
+
+    def __init__(self, interval_ms=500, autostart=True):
+        self.interval = interval_ms / 1000
+        self.autostart = autostart
+        self._lock = threading.Lock()
+        self._deltas = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add(self, deltas):
+        """Add {(label, pk, field): delta} to the pending totals"""
+        with self._lock:
+            self._deltas.update(deltas)
+        if self.autostart:
+            self.start()
+
+    def pending(self):
+        """Snapshot of the deltas that have not been flushed yet"""
+        with self._lock:
+            return {key: delta for key, delta in self._deltas.items() if delta}
+
+    def flush(self):
+        """Write all pending deltas to the database, returning how many rows were updated"""
+        with self._lock:
+            deltas, self._deltas = self._deltas, Counter()
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return 0
+
+        # One UPDATE per row, covering every buffered field of that row
+        rows = defaultdict(dict)
+        rollups = {}
+        for (label, pk, field), delta in deltas.items():
+            if label == 'rollup':
+                rollups[pk] = delta
+            else:
+                rows[label, pk][field] = F(field) + delta
+
+        try:
+            with transaction.atomic():
+                for (label, pk), changes in rows.items():
+                    BUFFERED_MODELS[label].objects.filter(pk=pk).update(**changes)
+                written = apply_rollups(rollups)
+        except Exception:
+            # Put the deltas back so the next flush retries them
+            with self._lock:
+                self._deltas.update(deltas)
+            raise
+        return len(rows) + written
+
+    def start(self):
+        """Start the background flusher if it is not running yet"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='vote-buffer-flusher', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Stop the flusher and write out whatever is still pending"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval * 2)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Could not flush buffered votes on shutdown')
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Could not flush buffered votes')
+            finally:
+                close_old_connections()
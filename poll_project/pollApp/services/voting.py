@@ -0,0 +1,218 @@
+from dataclasses import dataclass
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from ..models import Choice, Question, Vote
+from .rollups import apply_rollups, rollup_deltas
+from .vote_buffer import buffering_enabled, get_vote_buffer
+
+
+# How many times a ballot is re-applied when a concurrent request from the
+# same user changed their votes between our read and our write
+MAX_CONFLICT_RETRIES = 3
+
+
+class BallotConflict(Exception):
+    """Raised when a concurrent ballot from the same user wins the race"""
+
+
+@dataclass
+class VoteResult:
+    """Outcome of recording a ballot"""
+    choice_ids: set
+    added: set
+    removed: set
+    is_update: bool
+    # Choice ids best first, on ranked polls
+    ranking: list = None
+
+
+def _clean_choice_ids(choice_ids):
+    """Coerce submitted choice ids to ints, dropping junk and duplicates"""
+    cleaned = []
+    for choice_id in choice_ids:
+        try:
+            cleaned.append(int(choice_id))
+        except (TypeError, ValueError):
+            continue
+    return list(dict.fromkeys(cleaned))
+
+
+def ranking_from_form(data):
+    """Choice ids ordered by the rank_<choice id> fields of a ranked ballot form"""
+    ranked = []
+    for key, value in data.items():
+        if key.startswith('rank_') and value:
+            try:
+                ranked.append((int(value), int(key[len('rank_'):])))
+            except ValueError:
+                continue
+    return [choice_id for _, choice_id in sorted(ranked)]
+
+
+def record_vote(user, question, choice_ids):
+    """Replace the user's ballot on a question with the given choices
+
+    Runs a fixed number of queries however many choices are selected, and
+    never reads a counter back into Python, so concurrent voters cannot
+    overwrite each other's increments. With POLL_VOTE_BUFFERING on, the
+    Choice.votes deltas are handed to the write-behind buffer after commit
+    instead. On ranked polls choice_ids is the ranking, best first, and the
+    ranks are stored on the votes. Raises Choice.DoesNotExist if none of the
+    submitted ids belong to the question.
+    """
+    wanted = _clean_choice_ids(choice_ids)
+    if not (question.allow_multiple_choices or question.ranking_method):
+        wanted = wanted[:1]
+
+    valid = set()
+    if wanted:
+        valid = set(
+            Choice.objects.filter(question=question, pk__in=wanted).values_list('pk', flat=True)
+        )
+    if not valid:
+        raise Choice.DoesNotExist('No valid choice selected.')
+
+    ranks = None
+    if question.ranking_method:
+        # Ranks run 1..n over the valid choices, in the submitted order
+        ranks = {choice_id: rank for rank, choice_id in enumerate((c for c in wanted if c in valid), 1)}
+
+    for attempt in range(MAX_CONFLICT_RETRIES):
+        try:
+            return _apply_ballot(user, question, valid, ranks)
+        except (IntegrityError, BallotConflict):
+            # Someone else (a double-submit from the same user) changed the
+            # ballot under us; the transaction was rolled back, so re-read
+            # and re-apply the diff
+            if attempt == MAX_CONFLICT_RETRIES - 1:
+                raise
+
+
+def _apply_ballot(user, question, choice_ids, ranks=None):
+    """Diff the stored ballot against choice_ids (and ranks) and apply it in one transaction"""
+    with transaction.atomic():
+        votes = Vote.objects.filter(user=user, question=question)
+        if ranks:
+            existing = dict(votes.values_list('choice_id', 'rank'))
+        else:
+            # choice_id alone is answered from the (user, question, choice) index
+            existing = dict.fromkeys(votes.values_list('choice_id', flat=True))
+        removed = existing.keys() - choice_ids
+        added = choice_ids - existing.keys()
+        # Kept choices whose rank changed are rewritten, but count as neither
+        reranked = {
+            choice_id for choice_id in choice_ids & existing.keys()
+            if ranks and existing[choice_id] != ranks[choice_id]
+        }
+
+        if removed or reranked:
+            deleted, _ = Vote.objects.filter(
+                user=user, question=question, choice_id__in=removed | reranked
+            ).delete()
+            if deleted != len(removed | reranked):
+                raise BallotConflict()
+
+        if added or reranked:
+            # A concurrent insert of the same (user, choice) pair, or of any
+            # second vote by the user on a single-choice poll, raises
+            # IntegrityError here and rolls the whole ballot back
+            single_choice = not (question.allow_multiple_choices or question.ranking_method)
+            Vote.objects.bulk_create([
+                Vote(
+                    user=user, choice_id=choice_id, question=question,
+                    rank=ranks[choice_id] if ranks else None, single_choice=single_choice,
+                )
+                for choice_id in added | reranked
+            ])
+
+        if buffering_enabled():
+            deltas = _counter_deltas(question, added, removed, is_new_voter=not existing, reranked=bool(reranked))
+            if deltas:
+                transaction.on_commit(lambda: get_vote_buffer().add(deltas))
+        else:
+            _update_counters(question, added, removed, is_new_voter=not existing, reranked=bool(reranked))
+
+    return VoteResult(
+        choice_ids=choice_ids,
+        added=added,
+        removed=removed,
+        is_update=bool(existing),
+        ranking=sorted(ranks, key=ranks.get) if ranks else None,
+    )
+
+
+def _update_counters(question, added, removed, is_new_voter, reranked=False):
+    """Apply a ballot change to the denormalized counters with F() expressions"""
+    if removed:
+        Choice.objects.filter(pk__in=removed).update(votes=F('votes') - 1)
+    if added:
+        Choice.objects.filter(pk__in=added).update(votes=F('votes') + 1)
+    # The same change in this minute's, hour's and day's timeline buckets
+    apply_rollups(rollup_deltas(question.pk, added, removed))
+
+    if not (added or removed or reranked):
+        return
+
+    # Bumping results_version in the same UPDATE invalidates cached results
+    question_changes = {'results_version': F('results_version') + 1}
+    if len(added) != len(removed):
+        question_changes['total_votes'] = F('total_votes') + (len(added) - len(removed))
+    if is_new_voter:
+        question_changes['unique_voters'] = F('unique_voters') + 1
+    Question.objects.filter(pk=question.pk).update(**question_changes)
+
+
+def _counter_deltas(question, added, removed, is_new_voter, reranked=False):
+    """The same change as _update_counters, as deltas for the vote buffer"""
+    if not (added or removed or reranked):
+        return {}
+
+    deltas = {('choice', choice_id, 'votes'): 1 for choice_id in added}
+    deltas.update({('choice', choice_id, 'votes'): -1 for choice_id in removed})
+    # Timeline buckets are stamped now, not when the flush lands
+    for key, delta in rollup_deltas(question.pk, added, removed).items():
+        deltas['rollup', key, 'votes'] = delta
+    # Cached results are invalidated when the flush lands, not before
+    deltas['question', question.pk, 'results_version'] = 1
+    if len(added) != len(removed):
+        deltas['question', question.pk, 'total_votes'] = len(added) - len(removed)
+    if is_new_voter:
+        deltas['question', question.pk, 'unique_voters'] = 1
+    return deltas
+
+
+def reconcile_vote_counts(question_ids=None):
+    """Rebuild every vote counter from the Vote table
+
+    Recomputes Choice.votes, Question.total_votes and Question.unique_voters
+    and returns the number of (choices, questions) updated. This is the
+    source of truth after a crash lost buffered deltas or users were deleted.
+    Run it while no web workers are buffering, otherwise their pending
+    deltas are applied on top of the rebuilt totals.
+    """
+    def count(field, expression):
+        return Coalesce(Subquery(
+            Vote.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=expression)
+            .values('total')
+        ), Value(0))
+
+    choices = Choice.objects.all()
+    questions = Question.objects.all()
+    if question_ids:
+        choices = choices.filter(question_id__in=question_ids)
+        questions = questions.filter(pk__in=question_ids)
+
+    with transaction.atomic():
+        choice_count = choices.update(votes=count('choice', Count('pk')))
+        question_count = questions.update(
+            total_votes=count('question', Count('pk')),
+            unique_voters=count('question', Count('user', distinct=True)),
+            results_version=F('results_version') + 1,
+        )
+    return choice_count, question_count
@@ -0,0 +1,123 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import instrumentation
+from .models import Category, Choice, Question
+from .services import search
+from .services.access import forget_invitations
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    """Apply SQLITE_PRAGMAS to each new SQLite connection under the 'performance' profile"""
+    if connection.vendor != 'sqlite' or getattr(settings, 'SQLITE_PROFILE', 'default') != 'performance':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    """Count and time each connection's queries for RequestMetricsMiddleware"""
+    instrumentation.install(connection)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def bump_results_version(sender, instance, origin=None, **kwargs):
+    """Editing or removing a choice (e.g. in the admin) changes the poll and its results"""
+    if isinstance(origin, Question) or getattr(origin, 'model', None) is Question:
+        # The poll itself is being deleted
+        return
+    Question.objects.filter(pk=instance.question_id).update(
+        results_version=F('results_version') + 1, updated_at=timezone.now(),
+    )
+
+
+@receiver(m2m_changed, sender=Question.invited_users.through)
+def invalidate_invitations(sender, instance, action, reverse, pk_set, **kwargs):
+    """Drop cached invited-poll ids of every user whose invitations changed"""
+    if reverse:
+        # user.invited_polls.add(...) and friends: only that user changed
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            forget_invitations([instance.pk])
+        return
+
+    if action == 'pre_clear':
+        # pk_set is None for clear(), so remember who is about to lose access
+        instance._cleared_invitees = list(instance.invited_users.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        forget_invitations(getattr(instance, '_cleared_invitees', []))
+    elif action in ('post_add', 'post_remove'):
+        forget_invitations(pk_set)
+
+
+@receiver(pre_delete, sender=Question)
+def forget_invitations_of_deleted_poll(sender, instance, **kwargs):
+    """The invitation rows cascade without m2m_changed, and the id may be reused"""
+    forget_invitations(instance.invited_users.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=User)
+def forget_invitations_of_deleted_user(sender, instance, **kwargs):
+    forget_invitations([instance.pk])
+
+
+# Search index
+
+@receiver(post_save, sender=Question)
+def index_question(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_questions([instance.pk])
+
+
+@receiver(post_delete, sender=Question)
+def unindex_question(sender, instance, **kwargs):
+    search.remove_questions([instance.pk])
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def reindex_choice_question(sender, instance, raw=False, origin=None, **kwargs):
+    """Choice texts are part of their poll's search document"""
+    if raw or isinstance(origin, Question) or getattr(origin, 'model', None) is Question:
+        # The poll itself is being deleted
+        return
+    search.index_questions([instance.question_id])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_questions(sender, instance, created, raw=False, **kwargs):
+    """The category name is indexed with every poll in it"""
+    if not (created or raw):
+        search.index_questions(instance.questions.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_questions(sender, instance, **kwargs):
+    instance._question_ids = list(instance.questions.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def reindex_uncategorized_questions(sender, instance, **kwargs):
+    search.index_questions(getattr(instance, '_question_ids', []))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def touch_category_questions(sender, instance, created=False, raw=False, **kwargs):
+    """Poll cards and API responses show the category, so a rename or removal changes the poll"""
+    if created or raw:
+        return
+    if hasattr(instance, '_question_ids'):
+        # Deleted: its polls are uncategorized by now
+        polls = Question.objects.filter(pk__in=instance._question_ids)
+    else:
+        polls = instance.questions.all()
+    polls.update(updated_at=timezone.now())
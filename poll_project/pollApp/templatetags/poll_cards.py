@@ -0,0 +1,74 @@
+"""Poll cards for the listing pages, cached as rendered HTML
+
+A card only changes when its poll does (Question.updated_at), when its
+totals do (Question.results_version) or when it opens or closes, and
+otherwise differs only by what kind of viewer is looking. Those make up the
+cache key, so a page of cards is one get_many() plus rendering the few that
+changed.
+"""
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.safestring import mark_safe
+
+
+register = template.Library()
+
+CARD_TEMPLATE = 'partials/poll_card.html'
+
+
+def viewer_class(user, question):
+    """What the card shows depends only on this, not on the user themselves"""
+    if not user.is_authenticated:
+        return 'anonymous'
+    if question.visibility == 'private' and getattr(question, 'is_invited', False):
+        return 'invited'
+    return 'member'
+
+
+def card_status(question):
+    if question.is_upcoming():
+        return 'upcoming'
+    if question.is_expired():
+        return 'expired'
+    return 'active' if question.is_active() else 'closed'
+
+
+def card_key(question, viewer, voted, show_category, namespace):
+    updated = int(question.updated_at.timestamp() * 1000000) if question.updated_at else 0
+    return (
+        f'poll-card:{namespace}:{question.pk}:{updated}:{question.results_version}:'
+        f'{viewer}:{card_status(question)}:{int(voted)}:{int(show_category)}'
+    )
+
+
+@register.simple_tag(takes_context=True)
+def poll_cards(context, polls, show_category=True):
+    """Render a card for each poll, reusing cached cards; expects user and user_votes in the context"""
+    user = context['user']
+    user_votes = context.get('user_votes') or {}
+    request = context.get('request')
+    # Links in a card point into the namespace (sync or async views) being browsed
+    namespace = getattr(getattr(request, 'resolver_match', None), 'namespace', '') or ''
+    timeout = getattr(settings, 'POLL_CARD_CACHE_TIMEOUT', 600)
+
+    cards = []
+    for question in polls:
+        voted = question.pk in user_votes
+        key = card_key(question, viewer_class(user, question), voted, show_category, namespace)
+        cards.append((key, question, voted))
+    cached = cache.get_many([key for key, _, _ in cards]) if timeout else {}
+
+    card_template = context.template.engine.get_template(CARD_TEMPLATE)
+    rendered, missing = [], {}
+    for key, question, voted in cards:
+        html = cached.get(key)
+        if html is None:
+            values = {'question': question, 'user': user, 'voted': voted, 'show_category': show_category}
+            # A fresh context, so nothing outside the key can leak into a cached card
+            html = card_template.render(context.new(values))
+            missing[key] = html
+        rendered.append(html)
+    if missing and timeout:
+        cache.set_many(missing, timeout)
+    return mark_safe('\n'.join(rendered))
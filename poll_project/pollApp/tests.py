@@ -1,3 +1,1482 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipIf
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models.signals import post_delete
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import signals
+from .benchmarks import fixtures, hotpath
+from .benchmarks.base import compare, replay
+from .instrumentation import QueryBudgetExceeded
+from .models import Category, Question, Choice, Comment, Job, ResultSnapshot, Vote, VoteRollup
+from .routers import PrimaryReplicaRouter, use_replica
+from .services import access, jobs, query_plans, rollups, scheduler, search, tabulation, throttle
+from .services.broadcast import ResultsBroadcaster
+from .services.importer import PollImporter
+from .services.metrics import registry
+from .services.results_cache import clear_local_results_cache, get_results
+from .services.vote_buffer import VoteBuffer
+from .services.voting import record_vote
+
+
+def create_question(text='Favourite colour?', choices=('Red', 'Green', 'Blue'), **kwargs):
+    """Create a published poll with the given choices (password in the clear)"""
+    kwargs.setdefault('pub_date', timezone.now() - timedelta(days=1))
+    password = kwargs.pop('password', '')
+    question = Question(question_text=text, **kwargs)
+    question.set_password(password)
+    question.save()
+    for choice_text in choices:
+        Choice.objects.create(question=question, choice_text=choice_text)
+    return question
+
+
+class RecordVoteTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('voter', password='secret-pass-123')
+        self.question = create_question()
+        self.red, self.green, self.blue = self.question.choice_set.all()
+
+    def votes(self):
+        return dict(Choice.objects.filter(question=self.question).values_list('choice_text', 'votes'))
+
+    def test_first_vote(self):
+        result = record_vote(self.user, self.question, [self.red.id])
+        self.assertFalse(result.is_update)
+        self.assertEqual(self.votes(), {'Red': 1, 'Green': 0, 'Blue': 0})
+        self.assertEqual(Vote.objects.filter(user=self.user).count(), 1)
+
+    def test_changing_vote_moves_the_count(self):
+        record_vote(self.user, self.question, [self.red.id])
+        result = record_vote(self.user, self.question, [self.green.id])
+        self.assertTrue(result.is_update)
+        self.assertEqual(result.removed, {self.red.id})
+        self.assertEqual(self.votes(), {'Red': 0, 'Green': 1, 'Blue': 0})
+
+    def test_question_counters_are_maintained(self):
+        self.question.allow_multiple_choices = True
+        self.question.save()
+        other = User.objects.create_user('other', password='secret-pass-123')
+        record_vote(self.user, self.question, [self.red.id, self.green.id])
+        record_vote(other, self.question, [self.red.id])
+        record_vote(self.user, self.question, [self.blue.id])
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.total_votes, 2)
+        self.assertEqual(self.question.unique_voters, 2)
+
+    def test_single_choice_poll_keeps_only_first_choice(self):
+        record_vote(self.user, self.question, [self.red.id, self.green.id])
+        self.assertEqual(self.votes(), {'Red': 1, 'Green': 0, 'Blue': 0})
+
+    def test_multiple_choice_ballot_is_diffed(self):
+        self.question.allow_multiple_choices = True
+        self.question.save()
+        record_vote(self.user, self.question, [self.red.id, self.green.id])
+        result = record_vote(self.user, self.question, [self.green.id, self.blue.id])
+        self.assertEqual(result.added, {self.blue.id})
+        self.assertEqual(result.removed, {self.red.id})
+        self.assertEqual(self.votes(), {'Red': 0, 'Green': 1, 'Blue': 1})
+
+    def test_a_racing_first_ballot_cannot_add_a_second_vote(self):
+        record_vote(self.user, self.question, [self.red.id])
+        # What a concurrent first ballot that read no votes yet would insert
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Vote.objects.create(user=self.user, question=self.question, choice=self.green, single_choice=True)
+        # Its retry reads the first ballot and replaces it
+        record_vote(self.user, self.question, [self.green.id])
+        self.assertEqual(self.votes(), {'Red': 0, 'Green': 1, 'Blue': 0})
+
+    def test_invalid_choices_are_rejected(self):
+        other = create_question('Other poll?')
+        with self.assertRaises(Choice.DoesNotExist):
+            record_vote(self.user, self.question, ['abc', other.choice_set.first().id])
+        self.assertFalse(Vote.objects.exists())
+
+    def test_query_count_does_not_grow_with_choices(self):
+        question = create_question('Big poll?', choices=[f'Option {i}' for i in range(20)],
+                                   allow_multiple_choices=True)
+        ids = list(question.choice_set.values_list('id', flat=True))
+        record_vote(self.user, question, ids[:10])
+        # choice lookup, savepoint, ballot read, delete, insert, decrement,
+        # increment, timeline rollups, question counters, release
+        with self.assertNumQueries(10):
+            record_vote(self.user, question, ids[10:])
+
+
+class VoteBufferTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('voter', password='secret-pass-123')
+        self.question = create_question()
+        self.red, self.green, self.blue = self.question.choice_set.all()
+        self.buffer = VoteBuffer(autostart=False)
+
+    def test_deltas_are_coalesced_into_one_update_per_row(self):
+        red, green = ('choice', self.red.id, 'votes'), ('choice', self.green.id, 'votes')
+        self.buffer.add({red: 1})
+        self.buffer.add({red: 1, green: 1, ('question', self.question.id, 'total_votes'): 2})
+        self.buffer.add({green: -1, ('question', self.question.id, 'unique_voters'): 1})
+        self.assertEqual(len(self.buffer.pending()), 3)
+        with self.assertNumQueries(4):  # savepoint, choice, question, release
+            self.assertEqual(self.buffer.flush(), 2)
+        self.red.refresh_from_db()
+        self.question.refresh_from_db()
+        self.assertEqual(self.red.votes, 2)
+        self.assertEqual((self.question.total_votes, self.question.unique_voters), (2, 1))
+        self.assertEqual(self.buffer.pending(), {})
+
+    @override_settings(POLL_VOTE_BUFFERING=True)
+    def test_buffered_vote_defers_the_counter_until_flush(self):
+        with mock.patch('pollApp.services.voting.get_vote_buffer', return_value=self.buffer):
+            with self.captureOnCommitCallbacks(execute=True):
+                record_vote(self.user, self.question, [self.red.id])
+        self.red.refresh_from_db()
+        self.assertEqual(self.red.votes, 0)
+        self.assertTrue(Vote.objects.filter(user=self.user, choice=self.red).exists())
+
+        self.buffer.flush()
+        self.red.refresh_from_db()
+        self.question.refresh_from_db()
+        self.assertEqual(self.red.votes, 1)
+        self.assertEqual((self.question.total_votes, self.question.unique_voters), (1, 1))
+
+    def test_reconcile_rebuilds_counts_from_votes(self):
+        record_vote(self.user, self.question, [self.red.id])
+        Choice.objects.filter(pk=self.red.pk).update(votes=40)
+        Choice.objects.filter(pk=self.blue.pk).update(votes=7)
+        Question.objects.filter(pk=self.question.pk).update(total_votes=0, unique_voters=9)
+        call_command('reconcile_votes', stdout=mock.MagicMock())
+        self.assertEqual(
+            dict(self.question.choice_set.values_list('pk', 'votes')),
+            {self.red.pk: 1, self.green.pk: 0, self.blue.pk: 0},
+        )
+        self.question.refresh_from_db()
+        self.assertEqual((self.question.total_votes, self.question.unique_voters), (1, 1))
+
+
+class QuestionQuerySetTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.owner = User.objects.create_user('owner', password='secret-pass-123')
+        self.guest = User.objects.create_user('guest', password='secret-pass-123')
+        self.active = create_question('Active?')
+        self.upcoming = create_question('Upcoming?', start_date=now + timedelta(days=1))
+        self.expired = create_question('Expired?', end_date=now - timedelta(hours=1))
+        self.draft = create_question('Draft?', is_draft=True)
+        self.private = create_question('Private?', visibility='private', created_by=self.owner)
+        self.protected = create_question('Protected?', visibility='password', password='pw')
+
+    def test_status_filters_match_model_methods(self):
+        for method in ('active', 'upcoming', 'expired'):
+            expected = {q.pk for q in Question.objects.all() if getattr(q, f'is_{method}')()}
+            actual = set(getattr(Question.objects, method)().values_list('pk', flat=True))
+            self.assertEqual(actual, expected, method)
+
+    def test_visible_to(self):
+        public = {self.active.pk, self.upcoming.pk, self.expired.pk}
+
+        self.assertEqual(set(Question.objects.visible_to(AnonymousUser()).values_list('pk', flat=True)), public)
+        self.assertEqual(
+            set(Question.objects.visible_to(self.guest).values_list('pk', flat=True)),
+            public | {self.protected.pk},
+        )
+        self.assertEqual(
+            set(Question.objects.visible_to(self.owner).values_list('pk', flat=True)),
+            public | {self.protected.pk, self.private.pk},
+        )
+
+        self.private.invited_users.add(self.guest)
+        self.assertIn(self.private, Question.objects.visible_to(self.guest))
+        self.assertEqual(Question.objects.visible_to(self.guest).count(), 5)
+
+
+class PollSchedulerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_results_cache()
+        self.now = timezone.now()
+        self.user = User.objects.create_user('voter', password='secret-pass-123')
+        self.question = create_question(
+            'Soon?', start_date=self.now + timedelta(minutes=10), end_date=self.now + timedelta(minutes=20),
+        )
+
+    def test_save_sets_the_status_from_the_dates(self):
+        self.assertEqual(self.question.status, 'upcoming')
+        self.question.start_date = None
+        self.question.save(update_fields=['start_date'])
+        self.assertEqual(Question.objects.get(pk=self.question.pk).status, 'active')
+        self.question.end_date = self.now - timedelta(minutes=1)
+        self.question.save()
+        self.assertTrue(self.question.is_expired())
+
+    def test_polls_open_and_close_at_their_boundaries(self):
+        start, end = self.question.start_date, self.question.end_date
+        tick = scheduler.Scheduler()
+        self.assertEqual(tick.tick(self.now), {})
+        self.assertEqual(tick.next_boundary(), start)
+        self.assertEqual(tick.tick(start - timedelta(microseconds=1)), {})
+
+        self.assertEqual(tick.tick(start + timedelta(microseconds=1)), {self.question.pk: 'active'})
+        self.assertContains(self.client.get(reverse('polls:index')), 'Soon?')
+        # The new end date was picked up from updated_at
+        self.assertEqual(tick.next_boundary(), end)
+        self.assertEqual(tick.tick(end), {})
+        self.assertEqual(tick.tick(end + timedelta(microseconds=1)), {self.question.pk: 'closed'})
+        self.assertNotContains(self.client.get(reverse('polls:index')), 'Soon?')
+        self.assertEqual(Question.objects.expired().get().pk, self.question.pk)
+
+    def test_votes_follow_the_dates_when_the_scheduler_lags(self):
+        self.client.force_login(self.user)
+        choice = self.question.choice_set.first()
+        url = reverse('polls:vote', args=[self.question.id])
+        # Started a second ago, but still 'upcoming' until the scheduler runs
+        Question.objects.filter(pk=self.question.pk).update(start_date=self.now - timedelta(seconds=1))
+        self.client.post(url, {'choice': choice.id})
+        self.assertTrue(Vote.objects.filter(user=self.user, question=self.question).exists())
+
+        Question.objects.filter(pk=self.question.pk).update(status='active', end_date=self.now - timedelta(seconds=1))
+        response = self.client.post(
+            reverse('api:poll_vote', args=[self.question.id]), {'choice': choice.id}, 'application/json',
+        )
+        self.assertEqual(response.status_code, 409)
+
+    def test_sync_queues_each_boundary_once(self):
+        tick = scheduler.Scheduler()
+        tick.sync(self.now)
+        tick.sync(self.now)
+        self.assertEqual(len(tick.heap), 1)
+        self.question.start_date = self.now + timedelta(minutes=5)
+        self.question.save()
+        tick.sync(self.now)
+        self.assertEqual(len(tick.heap), 2)
+        self.assertEqual(tick.next_boundary(), self.question.start_date)
+
+    def test_closing_a_poll_by_an_edit_freezes_its_results(self):
+        self.question.start_date = self.now - timedelta(minutes=2)
+        self.question.end_date = self.now - timedelta(minutes=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.question.save()
+        self.assertEqual(self.question.status, 'closed')
+        self.assertTrue(ResultSnapshot.objects.filter(question=self.question).exists())
+
+    def test_closed_polls_read_their_frozen_results(self):
+        question = create_question('Over?')
+        record_vote(self.user, question, [question.choice_set.first().id])
+        Question.objects.filter(pk=question.pk).update(end_date=self.now - timedelta(seconds=1))
+
+        out = io.StringIO()
+        call_command('poll_scheduler', '--once', stdout=out)
+        self.assertIn('Moved 1 polls', out.getvalue())
+        question.refresh_from_db()
+        snapshot = ResultSnapshot.objects.get(question=question)
+        self.assertEqual((question.status, snapshot.results_version), ('closed', question.results_version))
+        self.assertEqual(snapshot.data['total_votes'], 1)
+
+        # Read from the snapshot, not rebuilt from the choices
+        Choice.objects.filter(question=question).update(votes=0)
+        cache.clear()
+        clear_local_results_cache()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_results(question)['choices'][0]['votes'], 1)
+        self.assertFalse(question.is_active())
+
+        # Unless the results changed after closing
+        question.results_version += 1
+        self.assertEqual(get_results(question)['choices'][0]['votes'], 0)
+
+
+@override_settings(POLLS_PER_PAGE=2)
+class IndexPaginationTests(TestCase):
+    def test_pages_follow_the_cursor(self):
+        pub_date = timezone.now() - timedelta(days=1)
+        # Same pub_date on purpose: the id breaks the tie
+        polls = [create_question(f'Poll {i}?', pub_date=pub_date) for i in range(5)]
+
+        seen = []
+        url = reverse('polls:index')
+        while url:
+            response = self.client.get(url)
+            seen.extend(q.pk for q in response.context['polls'])
+            next_url = response.context['next_page_url']
+            url = reverse('polls:index') + next_url if next_url else None
+
+        self.assertEqual(seen, [q.pk for q in reversed(polls)])
+
+    def test_bad_cursor_starts_from_the_first_page(self):
+        create_question()
+        response = self.client.get(reverse('polls:index'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(len(response.context['polls']), 1)
+
+
+class PollCardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Food', slug='food')
+        self.question = create_question('Best pizza?', category=self.category)
+        self.user = User.objects.create_user('card-viewer', password='secret-pass-123')
+
+    def front_page(self):
+        return self.client.get(reverse('polls:index')).content.decode()
+
+    def test_cards_come_from_the_cache_until_the_poll_changes(self):
+        self.assertIn('Best pizza?', self.front_page())
+        # Not a save(): updated_at stays, so the cached card is served
+        Question.objects.filter(pk=self.question.pk).update(question_text='Best pasta?')
+        self.assertIn('Best pizza?', self.front_page())
+
+        self.question.refresh_from_db()
+        self.question.save()
+        self.assertIn('Best pasta?', self.front_page())
+
+    def test_votes_and_category_renames_refresh_the_card(self):
+        self.assertIn('<strong>Total Votes:</strong> 0', self.front_page())
+        record_vote(self.user, self.question, [self.question.choice_set.first().pk])
+        self.assertIn('<strong>Total Votes:</strong> 1', self.front_page())
+
+        self.category.name = 'Cuisine'
+        self.category.save()
+        self.assertIn('>Cuisine</a>', self.front_page())
+
+    def test_viewers_get_their_own_cards(self):
+        self.assertIn('Login to Vote', self.front_page())
+        self.client.force_login(self.user)
+        page = self.front_page()
+        self.assertIn('Vote Now!', page)
+        self.assertNotIn('You Voted', page)
+
+        record_vote(self.user, self.question, [self.question.choice_set.first().pk])
+        self.assertIn('You Voted', self.front_page())
+        self.client.logout()
+        page = self.front_page()
+        self.assertIn('Login to Vote', page)
+        self.assertNotIn('You Voted', page)
+
+
+class AccessTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner', password='secret-pass-123')
+        self.guest = User.objects.create_user('guest', password='secret-pass-123')
+        self.question = create_question(visibility='private', created_by=self.owner)
+        self.client.force_login(self.guest)
+
+    def test_private_poll_requires_invitation(self):
+        url = reverse('polls:detail', args=(self.question.id,))
+        self.assertRedirects(self.client.get(url), reverse('polls:index'))
+        self.assertFalse(self.question.can_user_access(self.guest))
+
+        self.question.invited_users.add(self.guest)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertTrue(self.question.can_user_access(self.guest))
+
+    def test_invitations_are_cached_and_invalidated(self):
+        self.assertFalse(access.can_access(self.guest, self.question))
+        with self.assertNumQueries(0):
+            access.can_access(self.guest, self.question)
+
+        self.guest.invited_polls.add(self.question)
+        self.assertTrue(access.can_access(self.guest, self.question))
+
+        self.question.invited_users.clear()
+        self.assertFalse(access.can_access(self.guest, self.question))
+
+    def test_deleting_a_poll_forgets_its_invitations(self):
+        self.question.invited_users.add(self.guest)
+        self.assertIn(self.question.pk, access.invited_poll_ids(self.guest))
+        self.question.delete()
+        self.assertEqual(access.invited_poll_ids(self.guest), frozenset())
+
+    def test_drafts_are_hidden_from_everyone_but_the_creator(self):
+        draft = create_question(is_draft=True, created_by=self.owner)
+        self.assertFalse(access.can_access(self.guest, draft))
+        self.assertTrue(access.can_access(self.owner, draft))
+        response = self.client.post(reverse('polls:add_comment', args=(draft.id,)), {'comment_text': 'Hi'})
+        self.assertRedirects(response, reverse('polls:index'))
+        self.assertFalse(draft.comments.exists())
+
+
+class ResultsCacheTests(TestCase):
+    def setUp(self):
+        clear_local_results_cache()
+        self.user = User.objects.create_user('voter', password='secret-pass-123')
+        self.question = create_question()
+        self.red = self.question.choice_set.first()
+
+    def fresh_question(self):
+        return Question.objects.get(pk=self.question.pk)
+
+    def test_results_are_served_from_cache_until_a_vote(self):
+        results = get_results(self.fresh_question())
+        self.assertEqual(results['total_votes'], 0)
+        with self.assertNumQueries(1):  # only the question row
+            self.assertIs(get_results(self.fresh_question()), results)
+
+        record_vote(self.user, self.question, [self.red.id])
+        results = get_results(self.fresh_question())
+        self.assertEqual(results['total_votes'], 1)
+        self.assertEqual(results['choices'][0]['percentage'], 100)
+        self.assertEqual(results['chart']['data'], [1, 0, 0])
+
+    def test_django_cache_tier_is_used_when_the_lru_misses(self):
+        get_results(self.fresh_question())
+        clear_local_results_cache()
+        with self.assertNumQueries(1):
+            get_results(self.fresh_question())
+
+    @override_settings(POLL_RESULTS_MAX_STALENESS=60)
+    def test_staleness_window(self):
+        get_results(self.fresh_question())
+        record_vote(self.user, self.question, [self.red.id])
+        self.assertEqual(get_results(self.fresh_question())['total_votes'], 0)
+
+    def test_editing_a_choice_invalidates_results(self):
+        get_results(self.fresh_question())
+        self.red.choice_text = 'Crimson'
+        self.red.save()
+        self.assertEqual(get_results(self.fresh_question())['chart']['labels'][0], 'Crimson')
+
+
+class QueryCountTests(TestCase):
+    """Pages must render in a fixed number of queries however much data there is"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('voter', password='secret-pass-123')
+        self.other = User.objects.create_user('other', password='secret-pass-123')
+        self.client.force_login(self.user)
+        self.clear_caches()
+
+    def clear_caches(self):
+        cache.clear()
+        clear_local_results_cache()
+
+    def add_polls(self, count):
+        for i in range(count):
+            question = create_question(f'Poll {i}?', choices=[f'Option {j}' for j in range(4)],
+                                       visibility='private', created_by=self.other)
+            question.invited_users.add(self.user, self.other)
+            record_vote(self.user, question, [question.choice_set.first().id])
+            record_vote(self.other, question, [question.choice_set.last().id])
+
+    def add_choices(self, question, count):
+        for i in range(count):
+            choice = Choice.objects.create(question=question, choice_text=f'Extra {i}')
+            record_vote(User.objects.create_user(f'extra{question.pk}-{i}'), question, [choice.id])
+
+    def test_index(self):
+        # session, user, polls, user votes, categories
+        self.add_polls(2)
+        with self.assertNumQueries(5):
+            self.client.get(reverse('polls:index'))
+        self.add_polls(8)
+        with self.assertNumQueries(5):
+            self.client.get(reverse('polls:index'))
+
+    def test_results(self):
+        # session, user, question, invited poll ids, user votes, choices,
+        # comments, comment count (with cold caches)
+        question = create_question(visibility='private', created_by=self.other)
+        question.invited_users.add(self.user)
+        record_vote(self.user, question, [question.choice_set.first().id])
+        url = reverse('polls:results', args=(question.id,))
+        with self.assertNumQueries(8):
+            self.client.get(url)
+        self.add_choices(question, 10)
+        self.clear_caches()
+        with self.assertNumQueries(8):
+            self.client.get(url)
+
+    def test_detail(self):
+        # session, user, question, user votes, choices, comments, comment count
+        question = create_question()
+        url = reverse('polls:detail', args=(question.id,))
+        with self.assertNumQueries(7):
+            self.client.get(url)
+        self.add_choices(question, 10)
+        with self.assertNumQueries(7):
+            self.client.get(url)
+
+    def test_profile(self):
+        # session, user, voted polls, prefetched votes, invited polls, vote count
+        self.add_polls(2)
+        with self.assertNumQueries(6):
+            self.client.get(reverse('accounts:profile'))
+        self.add_polls(8)
+        with self.assertNumQueries(6):
+            self.client.get(reverse('accounts:profile'))
+
+
+class ExportVotesTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', password='secret-pass-123', is_staff=True)
+        self.voter = User.objects.create_user('voter', password='secret-pass-123')
+        self.question = create_question()
+        self.other = create_question('Other poll?')
+        record_vote(self.voter, self.question, [self.question.choice_set.first().id])
+        record_vote(self.voter, self.other, [self.other.choice_set.last().id])
+
+    def test_command_exports_csv(self):
+        out = io.StringIO()
+        call_command('export_votes', '--question', str(self.question.id), stdout=out)
+        rows = list(csv.reader(io.StringIO(out.getvalue())))
+        self.assertEqual(rows[0], ['vote_id', 'voted_at', 'user_id', 'username', 'question_id', 'choice_id'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][3:], ['voter', str(self.question.id), str(self.question.choice_set.first().id)])
+
+    def test_command_date_filters(self):
+        out = io.StringIO()
+        tomorrow = (timezone.now() + timedelta(days=1)).date().isoformat()
+        call_command('export_votes', '--format', 'ndjson', '--since', tomorrow, stdout=out)
+        self.assertEqual(out.getvalue(), '')
+
+    def test_endpoint_streams_ndjson_for_staff_only(self):
+        url = reverse('polls:export_votes')
+        self.client.force_login(self.voter)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(url, {'format': 'ndjson'})
+        self.assertTrue(response.streaming)
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual({r['question_id'] for r in records}, {self.question.id, self.other.id})
+        self.assertEqual(self.client.get(url, {'since': 'yesterday'}).status_code, 400)
+
+
+class ImportPollsTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='secret-pass-123')
+        self.bob = User.objects.create_user('bob', password='secret-pass-123')
+
+    def run_import(self, content, suffix, *args):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False, encoding='utf-8') as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_polls', f.name, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_jsonl_import(self):
+        rows = [
+            {'question_text': 'Best pet?', 'category': 'Animals', 'choices': ['Cat', 'Dog'],
+             'visibility': 'private', 'created_by': 'alice', 'invited_users': ['bob']},
+            {'question_text': 'Best fish?', 'category': 'Animals', 'choices': ['Carp']},
+            {'question_text': 'Bad dates?', 'choices': ['A'],
+             'start_date': '2026-02-01', 'end_date': '2026-01-01'},
+            {'question_text': 'Ghost?', 'choices': ['A'], 'created_by': 'nobody'},
+            {'question_text': 'No choices?'},
+        ]
+        content = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+        out, err = self.run_import(content, '.jsonl', '--batch-size', '2')
+
+        self.assertIn('Imported 2 polls', out)
+        self.assertIn('line 3: End date must be after start date', err)
+        self.assertIn('line 4: Unknown user: nobody', err)
+        self.assertIn('line 5: At least one choice is required', err)
+        self.assertIn('line 6: Invalid JSON', err)
+
+        pet = Question.objects.get(question_text='Best pet?')
+        self.assertEqual(list(pet.choice_set.values_list('choice_text', flat=True)), ['Cat', 'Dog'])
+        self.assertEqual(pet.category, Question.objects.get(question_text='Best fish?').category)
+        self.assertEqual(pet.category.slug, 'animals')
+        self.assertEqual(pet.created_by, self.alice)
+        self.assertTrue(pet.can_user_access(self.bob))
+
+    def test_csv_import_and_dry_run(self):
+        content = (
+            'question_text,choices,allow_multiple_choices,category\n'
+            'Toppings?,Cheese|Ham|Olives,yes,Food\n'
+        )
+        out, _ = self.run_import(content, '.csv', '--dry-run')
+        self.assertIn('Validated 1 polls', out)
+        self.assertFalse(Question.objects.exists())
+
+        self.run_import(content, '.csv')
+        question = Question.objects.get()
+        self.assertTrue(question.allow_multiple_choices)
+        self.assertEqual(question.choice_set.count(), 3)
+
+    def test_wrongly_typed_fields_are_row_errors(self):
+        rows = [
+            {'question_text': 'Count?', 'choices': 5},
+            {'question_text': 12, 'choices': ['A']},
+            {'question_text': 'Guests?', 'choices': ['A'], 'invited_users': 7},
+            {'question_text': 'Fine?', 'choices': ['A']},
+        ]
+        out, err = self.run_import('\n'.join(json.dumps(row) for row in rows), '.jsonl')
+        self.assertIn('Imported 1 polls', out)
+        self.assertIn('line 1: choices must be a list', err)
+        self.assertIn('line 2: question_text must be a string', err)
+        self.assertIn('line 3: invited_users must be a list', err)
+
+    def test_categories_of_a_rolled_back_batch_are_not_reused(self):
+        importer = PollImporter()
+        row = {'question_text': 'Best pet?', 'category': 'Animals', 'choices': ['Cat']}
+        with mock.patch('pollApp.services.importer.index_questions', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                importer.run([(1, row)])
+        self.assertFalse(Category.objects.exists())
+        importer.run([(1, row)])
+        self.assertEqual(Question.objects.get().category.name, 'Animals')
+
+    def test_passwords_are_hashed(self):
+        self.run_import(json.dumps({'question_text': 'Locked?', 'choices': ['A'], 'visibility': 'password', 'password': 'pw'}), '.jsonl')
+        question = Question.objects.get()
+        self.assertNotEqual(question.password, 'pw')
+        self.assertTrue(question.check_password('pw'))
+
+
+
+class TabulationTests(TestCase):
+    CHOICES = [(1, 'A'), (2, 'B'), (3, 'C')]
+
+    def pack(self, *groups):
+        """Ballots from (count, ranking) pairs"""
+        return tabulation.pack(self.CHOICES, [ranking for count, ranking in groups for _ in range(count)])
+
+    def winner(self, outcome):
+        return outcome['winner'] and outcome['winner']['choice_text']
+
+    def test_methods(self):
+        ballots = self.pack((4, [1, 2, 3]), (3, [2, 3, 1]), (2, [3, 2, 1]))
+        self.assertEqual((ballots.rows, ballots.total), (3, 9))
+        self.assertEqual(self.winner(tabulation.instant_runoff(ballots)), 'B')
+        borda = tabulation.borda(ballots)
+        self.assertEqual([(row['choice_text'], row['score']) for row in borda['standings']], [('B', 12), ('A', 8), ('C', 7)])
+        condorcet = tabulation.condorcet(ballots)
+        self.assertEqual(self.winner(condorcet), 'B')
+        self.assertEqual(condorcet['pairwise'][0][1], 4)
+
+    def test_instant_runoff_rounds_and_exhausted_ballots(self):
+        outcome = tabulation.instant_runoff(self.pack((4, [1]), (3, [2, 3]), (2, [3])))
+        self.assertEqual(self.winner(outcome), 'A')
+        self.assertEqual([row['votes'] for row in outcome['rounds']], [[4, 4], [3, 3], [2, None]])
+        self.assertEqual(outcome['exhausted'], [0, 2])
+        self.assertEqual([row['choice_text'] for row in outcome['standings']], ['A', 'B', 'C'])
+
+    def test_condorcet_cycle_has_no_winner(self):
+        outcome = tabulation.condorcet(self.pack((1, [1, 2, 3]), (1, [2, 3, 1]), (1, [3, 1, 2])))
+        self.assertIsNone(outcome['winner'])
+        self.assertIsNone(tabulation.borda(self.pack())['winner'])
+
+    @skipIf(tabulation.numpy is None, 'NumPy is not installed')
+    def test_numpy_and_array_primitives_agree(self):
+        rng = random.Random(0)
+        ballots = self.pack(*[(rng.randint(1, 5), rng.sample([1, 2, 3], rng.randint(1, 3))) for _ in range(50)])
+        vectorised = [method(ballots) for method in tabulation.METHODS.values()]
+        with mock.patch.object(tabulation, 'numpy', None):
+            self.assertEqual([method(ballots) for method in tabulation.METHODS.values()], vectorised)
+
+
+class RankedVotingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_results_cache()
+        self.user = User.objects.create_user('voter', password='secret-pass-123')
+        self.question = create_question(ranking_method='irv')
+        self.red, self.green, self.blue = self.question.choice_set.all()
+
+    def ranks(self):
+        return dict(Vote.objects.filter(user=self.user).values_list('choice__choice_text', 'rank'))
+
+    def test_record_vote_stores_ranks(self):
+        result = record_vote(self.user, self.question, [self.blue.id, self.red.id])
+        self.assertEqual(result.ranking, [self.blue.id, self.red.id])
+        self.assertEqual(self.ranks(), {'Blue': 1, 'Red': 2})
+
+        # Reordering the same choices changes no counter but the results version
+        self.question.refresh_from_db()
+        version = self.question.results_version
+        record_vote(self.user, self.question, [self.red.id, self.blue.id])
+        self.assertEqual(self.ranks(), {'Red': 1, 'Blue': 2})
+        self.question.refresh_from_db()
+        self.assertEqual((self.question.total_votes, self.question.results_version), (2, version + 1))
+
+    def test_vote_view_and_results(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('polls:vote', args=[self.question.id]), {
+            f'rank_{self.red.id}': '2', f'rank_{self.green.id}': '1', f'rank_{self.blue.id}': '',
+        })
+        self.assertRedirects(response, reverse('polls:results', args=[self.question.id]))
+        self.assertEqual(self.ranks(), {'Green': 1, 'Red': 2})
+
+        response = self.client.get(reverse('polls:results', args=[self.question.id]))
+        self.assertContains(response, 'Winner: <strong>Green</strong>')
+        response = self.client.get(reverse('polls:detail', args=[self.question.id]))
+        self.assertContains(response, 'Your #2')
+
+    def test_tabulation_is_cached_until_the_next_vote(self):
+        other = User.objects.create_user('other', password='secret-pass-123')
+        record_vote(self.user, self.question, [self.red.id])
+        with mock.patch.object(tabulation, 'load_ballots', wraps=tabulation.load_ballots) as load:
+            self.question.refresh_from_db()
+            get_results(self.question)
+            get_results(self.question)
+            self.assertEqual(load.call_count, 1)
+
+            record_vote(other, self.question, [self.blue.id, self.green.id])
+            self.question.refresh_from_db()
+            self.assertEqual(get_results(self.question)['tabulation']['ballots'], 2)
+            self.assertEqual(load.call_count, 2)
+
+    def test_api_vote_keeps_the_order(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse('api:poll_vote', args=[self.question.id]),
+            {'choices': [self.blue.id, self.green.id]}, content_type='application/json',
+        )
+        self.assertEqual(response.json()['choices'], [self.blue.id, self.green.id])
+        tally = self.client.get(reverse('api:poll_results', args=[self.question.id])).json()['tabulation']
+        self.assertEqual((tally['method'], tally['winner']['id']), ('irv', self.blue.id))
+
+
+
+class VoteRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('voter', password='secret-pass-123')
+        self.question = create_question(pub_date=timezone.now() - timedelta(hours=3))
+        self.red, self.green, self.blue = self.question.choice_set.all()
+
+    def rollup(self, granularity):
+        rows = VoteRollup.objects.filter(question=self.question, granularity=granularity)
+        return dict(rows.values_list('choice__choice_text', 'votes'))
+
+    def test_votes_are_counted_in_every_granularity(self):
+        other = User.objects.create_user('other', password='secret-pass-123')
+        record_vote(self.user, self.question, [self.red.id])
+        record_vote(other, self.question, [self.red.id])
+        # A changed vote moves one vote from red to green in the current buckets
+        record_vote(self.user, self.question, [self.green.id])
+        for granularity in rollups.GRANULARITIES:
+            self.assertEqual(self.rollup(granularity), {'Red': 1, 'Green': 1})
+
+    @override_settings(POLL_VOTE_BUFFERING=True)
+    def test_buffered_votes_reach_the_rollups_on_flush(self):
+        buffer = VoteBuffer(autostart=False)
+        with mock.patch('pollApp.services.voting.get_vote_buffer', return_value=buffer):
+            with self.captureOnCommitCallbacks(execute=True):
+                record_vote(self.user, self.question, [self.blue.id])
+        self.assertEqual(self.rollup('hour'), {})
+        buffer.flush()
+        self.assertEqual(self.rollup('hour'), {'Blue': 1})
+
+    def test_backfill_matches_the_votes(self):
+        other = User.objects.create_user('other', password='secret-pass-123')
+        record_vote(self.user, self.question, [self.red.id])
+        record_vote(other, self.question, [self.blue.id])
+        morning = datetime(2026, 3, 2, 9, 30, tzinfo=dt_timezone.utc)
+        Vote.objects.filter(user=self.user).update(voted_at=morning)
+        Vote.objects.filter(user=other).update(voted_at=morning + timedelta(hours=2))
+        VoteRollup.objects.all().delete()
+
+        out = io.StringIO()
+        call_command('backfill_rollups', '--question', str(self.question.id), stdout=out)
+        self.assertIn('Wrote 6 rollup rows', out.getvalue())
+        self.assertEqual(self.rollup('day'), {'Red': 1, 'Blue': 1})
+        self.assertEqual(VoteRollup.objects.filter(granularity='hour').count(), 2)
+
+    def test_timeline_endpoint_reads_zero_filled_buckets(self):
+        record_vote(self.user, self.question, [self.red.id])
+        url = reverse('api:poll_timeline', args=[self.question.id])
+        with self.assertNumQueries(2):  # the rollups and the choice names, after the poll itself
+            timeline = rollups.timeline(self.question)
+        self.assertEqual(timeline['granularity'], 'minute')
+        self.assertEqual(len(timeline['buckets']), 181)
+        self.assertEqual(sum(timeline['choices'][0]['votes']), 1)
+        self.assertEqual(sum(timeline['choices'][1]['votes']), 0)
+
+        data = self.client.get(url, {'granularity': 'hour'}).json()
+        self.assertEqual((data['granularity'], len(data['buckets'])), ('hour', 4))
+        self.assertEqual(sum(data['choices'][0]['votes']), 1)
+        with override_settings(POLL_TIMELINE_MAX_BUCKETS=3):
+            self.assertEqual(self.client.get(url).json()['granularity'], 'day')
+        self.assertEqual(self.client.get(url, {'granularity': 'week'}).status_code, 400)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', password='secret-pass-123')
+        self.question = create_question()
+        for index in range(3):
+            voter = User.objects.create_user(f'voter{index}', password='secret-pass-123')
+            record_vote(voter, self.question, [self.question.choice_set.first().id])
+            Comment.objects.create(question=self.question, user=voter, text='Nice poll')
+
+    @override_settings(POLL_JOB_CHUNK_SIZE=2)
+    def test_admin_delete_hides_the_poll_and_workers_delete_it_in_chunks(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:pollApp_question_delete', args=[self.question.id])
+        with self.assertNumQueries(6):  # session, user, poll and three counts, not every vote
+            self.assertContains(self.client.get(url), 'Votes: 3')
+        self.client.post(url, {'post': 'yes'})
+        self.assertTrue(Question.objects.get(pk=self.question.id).is_draft)
+        job = Job.objects.get(kind='delete_question')
+        self.assertEqual((job.status, job.created_by), ('queued', self.admin))
+
+        out = io.StringIO()
+        receiver = mock.Mock()
+        post_delete.connect(receiver, sender=Choice)
+        self.addCleanup(post_delete.disconnect, receiver, sender=Choice)
+        call_command('run_workers', '--processes', '1', '--burst', stdout=out)
+        self.assertIn('Ran 1 jobs', out.getvalue())
+        # The choices go with the poll, so their receivers skip the results bump and reindex
+        self.assertEqual(receiver.call_count, 3)
+        self.assertTrue(all(isinstance(call.kwargs['origin'], Question) for call in receiver.call_args_list))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual((job.progress_done, job.progress_total, job.progress_percent()), (13, 13, 100))
+        self.assertEqual(job.result, {'vote': 3, 'voterollup': 3, 'comment': 3, 'choice': 3, 'question': 1})
+        self.assertFalse(Question.objects.filter(pk=self.question.id).exists())
+        self.assertFalse(Vote.objects.exists())
+
+    @override_settings(POLL_JOB_CHUNK_SIZE=2, POLL_JOB_MAX_ATTEMPTS=1)
+    def test_a_delete_out_of_attempts_leaves_a_hidden_draft_that_a_retry_finishes(self):
+        job, = jobs.schedule_delete([self.question.id])
+        with mock.patch.object(Question, 'delete', side_effect=RuntimeError('boom')):
+            with self.assertLogs('pollApp.services.jobs', 'WARNING'):
+                jobs.work('test', burst=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        question = Question.objects.get(pk=self.question.id)
+        self.assertTrue(question.is_draft)
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(question.choice_set.count(), 3)
+
+        self.client.force_login(self.admin)
+        self.client.post(reverse('admin:pollApp_job_changelist'), {'action': 'retry', '_selected_action': [job.pk]})
+        jobs.work('test', burst=True)
+        job.refresh_from_db()
+        self.assertEqual(job.result, {'vote': 0, 'voterollup': 0, 'comment': 0, 'choice': 3, 'question': 1})
+        self.assertFalse(Question.objects.filter(pk=self.question.id).exists())
+
+    def test_failed_jobs_are_retried_with_backoff_then_fail(self):
+        job = jobs.enqueue('reconcile_votes', {'question_ids': [self.question.id]})
+        with mock.patch.dict(jobs.TASKS, {'reconcile_votes': mock.Mock(side_effect=RuntimeError('boom'))}):
+            with self.assertLogs('pollApp.services.jobs', 'WARNING'):
+                self.assertEqual(jobs.work('test', burst=True), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), ('queued', 1))
+            self.assertIn('RuntimeError: boom', job.error)
+            # Not due again before the backoff: 30s, then 60s, ...
+            self.assertAlmostEqual((job.run_after - timezone.now()).total_seconds(), 30, delta=5)
+            self.assertIsNone(jobs.claim('test'))
+            self.assertEqual(jobs.retry_delay(3), timedelta(seconds=120))
+
+            Job.objects.filter(pk=job.pk).update(attempts=job.max_attempts - 1, run_after=timezone.now())
+            with self.assertLogs('pollApp.services.jobs', 'WARNING'):
+                jobs.work('test', burst=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+        self.client.force_login(self.admin)
+        self.client.post(reverse('admin:pollApp_job_changelist'), {'action': 'retry', '_selected_action': [job.pk]})
+        self.assertEqual(jobs.work('test', burst=True), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.result), ('done', 1, {'choices': 3, 'questions': 1}))
+
+    def test_a_job_is_claimed_once_and_requeued_when_its_worker_dies(self):
+        job = jobs.enqueue('backfill_rollups')
+        self.assertEqual(jobs.claim('first').pk, job.pk)
+        self.assertIsNone(jobs.claim('second'))
+
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(jobs.claim('second').worker, 'second')
+
+    def test_export_job_writes_a_file_for_the_admin(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(POLL_JOB_EXPORT_ROOT=root):
+            self.client.force_login(self.admin)
+            self.client.post(reverse('admin:pollApp_question_changelist'), {
+                'action': 'export_votes', '_selected_action': [self.question.id],
+            })
+            job = Job.objects.get(kind='export_votes')
+            jobs.work('test', burst=True)
+            job.refresh_from_db()
+            self.assertEqual(job.result, {'file': f'votes-{job.pk}.csv', 'rows': 3})
+            self.assertEqual(job.progress_percent(), 100)
+
+            response = self.client.get(reverse('admin:pollApp_job_download', args=[job.pk]))
+            rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+            response.close()
+            self.assertEqual(len(rows), 4)
+            self.assertEqual({row[3] for row in rows[1:]}, {'voter0', 'voter1', 'voter2'})
+
+
+class VoteViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('voter', password='secret-pass-123')
+        self.client.force_login(self.user)
+        self.question = create_question()
+
+    def test_vote_is_recorded(self):
+        choice = self.question.choice_set.first()
+        response = self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': choice.id})
+        self.assertRedirects(response, reverse('polls:results', args=(self.question.id,)))
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 1)
+
+    def test_missing_choice_redirects_to_detail(self):
+        response = self.client.post(reverse('polls:vote', args=(self.question.id,)), {})
+        self.assertRedirects(response, reverse('polls:detail', args=(self.question.id,)))
+        self.assertFalse(Vote.objects.exists())
+
+
+class UnlockTests(TestCase):
+    def setUp(self):
+        self.question = create_question('Locked?', visibility='password', password='sesame')
+        self.detail_url = reverse('polls:detail', args=(self.question.id,))
+        self.results_url = reverse('polls:results', args=(self.question.id,))
+
+    def unlock(self, password='sesame'):
+        return self.client.post(self.detail_url, {'poll_password': password})
+
+    def test_password_is_stored_hashed(self):
+        self.assertNotEqual(self.question.password, 'sesame')
+        self.assertTrue(self.question.check_password('sesame'))
+        self.assertFalse(self.question.check_password('Sesame'))
+        self.assertFalse(Question(password='').check_password(''))
+
+    def test_unlock_sets_a_signed_cookie_not_a_session_flag(self):
+        self.assertTemplateUsed(self.client.get(self.detail_url), 'polls/password.html')
+        self.assertTemplateUsed(self.unlock('wrong'), 'polls/password.html')
+        self.assertNotIn(f'poll_unlock_{self.question.id}', self.client.cookies)
+
+        self.assertTemplateUsed(self.unlock(), 'polls/detail.html')
+        self.assertTemplateUsed(self.client.get(self.results_url), 'polls/results.html')
+        self.assertFalse(Session.objects.exists())
+
+    def test_tampered_and_expired_cookies_lock_the_poll(self):
+        self.unlock()
+        name = f'poll_unlock_{self.question.id}'
+        token = self.client.cookies[name].value
+
+        self.client.cookies[name] = token[:-1] + ('A' if token[-1] != 'A' else 'B')
+        self.assertRedirects(self.client.get(self.results_url), self.detail_url)
+
+        self.client.cookies[name] = token
+        later = time.time() + settings.POLL_UNLOCK_MAX_AGE + 60
+        with mock.patch('django.core.signing.time.time', return_value=later):
+            self.assertRedirects(self.client.get(self.results_url), self.detail_url)
+
+    def test_changing_the_password_locks_the_poll_again(self):
+        self.unlock()
+        self.question.set_password('open sesame')
+        self.question.save()
+        self.assertRedirects(self.client.get(self.results_url), self.detail_url)
+
+
+@override_settings(POLL_THROTTLE_RATES={
+    'vote': {'user': '2/m', 'ip': '3/m'},
+    'unlock': {'ip': '1/h'},
+})
+class ThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question()
+        self.choice = self.question.choice_set.first()
+        self.vote_url = reverse('polls:vote', args=(self.question.id,))
+        self.alice = User.objects.create_user('alice', password='secret-pass-123')
+        self.bob = User.objects.create_user('bob', password='secret-pass-123')
+
+    def test_sliding_window(self):
+        self.assertEqual(throttle.check('vote', 7, None, now=0), 0)
+        self.assertEqual(throttle.check('vote', 7, None, now=1), 0)
+        self.assertEqual(throttle.check('vote', 7, None, now=2), 58)
+        # A third into the next minute, two thirds of the previous one still count
+        self.assertEqual(throttle.check('vote', 7, None, now=80), 0)
+        self.assertEqual(throttle.check('vote', 7, None, now=81), 9)
+        self.assertEqual(throttle.check('vote', 7, None, now=91), 0)
+        # Other users and scopes without rates are not affected
+        self.assertEqual(throttle.check('vote', 8, None, now=91), 0)
+        self.assertEqual(throttle.check('comment', 7, '10.0.0.1', now=91), 0)
+
+    def test_votes_over_the_limit_are_rejected_before_any_query(self):
+        self.client.force_login(self.alice)
+        for _ in range(2):
+            self.assertEqual(self.client.post(self.vote_url, {'choice': self.choice.id}).status_code, 302)
+        # Only the session is loaded
+        with self.assertNumQueries(1):
+            response = self.client.post(self.vote_url, {'choice': self.choice.id})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        # Viewing is not throttled
+        self.assertEqual(self.client.get(self.vote_url).status_code, 302)
+
+    def test_limits_are_per_ip_too(self):
+        self.client.force_login(self.alice)
+        self.client.post(self.vote_url, {'choice': self.choice.id})
+        self.client.post(self.vote_url, {'choice': self.choice.id})
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.post(self.vote_url, {'choice': self.choice.id}).status_code, 302)
+        self.assertEqual(self.client.post(self.vote_url, {'choice': self.choice.id}).status_code, 429)
+        other_ip = self.client.post(self.vote_url, {'choice': self.choice.id}, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(other_ip.status_code, 302)
+
+    def test_password_guesses_are_throttled(self):
+        locked = create_question('Locked?', visibility='password', password='sesame')
+        self.client.post(reverse('polls:detail', args=(locked.id,)), {'poll_password': 'guess'})
+        response = self.client.post(reverse('polls:detail', args=(locked.id,)), {'poll_password': 'sesame'})
+        self.assertEqual(response.status_code, 429)
+
+        response = self.client.post(reverse('api:poll_unlock', args=(locked.id,)), {'password': 'sesame'}, 'application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Too many requests', response.json()['error'])
+
+    async def test_async_vote_is_throttled(self):
+        await self.async_client.aforce_login(self.alice)
+        url = reverse('polls:vote', args=(self.question.id,), current_app='polls-async')
+        statuses = [(await self.async_client.post(url, {'choice': self.choice.id})).status_code for _ in range(3)]
+        self.assertEqual(statuses, [302, 302, 429])
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_results_cache()
+        self.user = User.objects.create_user('async-voter', password='secret-pass-123')
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+        self.question = create_question()
+
+    def url(self, name, *args):
+        return reverse(f'polls:{name}', args=args, current_app='polls-async')
+
+    async def test_detail_and_results_render(self):
+        response = await self.async_client.get(self.url('detail', self.question.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['choices']), 3)
+        # Links on the page stay on the async views
+        self.assertContains(response, self.url('vote', self.question.id))
+
+        response = await self.async_client.get(self.url('results', self.question.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['results']['total_votes'], 0)
+
+    async def test_vote_is_recorded(self):
+        choice = await self.question.choice_set.afirst()
+        response = await self.async_client.post(self.url('vote', self.question.id), {'choice': choice.id})
+        self.assertRedirects(response, self.url('results', self.question.id), fetch_redirect_response=False)
+        await choice.arefresh_from_db()
+        self.assertEqual(choice.votes, 1)
+
+        response = await self.async_client.post(self.url('vote', self.question.id), {})
+        self.assertRedirects(response, self.url('detail', self.question.id), fetch_redirect_response=False)
+
+    async def test_private_poll_is_denied(self):
+        private = await Question.objects.acreate(
+            question_text='Secret?', visibility='private', pub_date=timezone.now() - timedelta(days=1),
+        )
+        response = await self.async_client.get(self.url('detail', private.id))
+        self.assertRedirects(response, self.url('index'), fetch_redirect_response=False)
+
+    def test_sync_urls_are_the_default(self):
+        self.assertEqual(reverse('polls:detail', args=(1,)), '/polls/1/')
+        self.assertEqual(self.url('detail', 1), '/polls/async/1/')
+
+
+class LiveResultsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('watcher', password='secret-pass-123')
+        self.question = create_question()
+        self.red, self.green, self.blue = self.question.choice_set.order_by('pk')
+        self.question.refresh_from_db()
+
+    async def test_broadcaster_sends_snapshot_then_deltas(self):
+        broadcaster = ResultsBroadcaster(interval=3600)
+        first = await broadcaster.subscribe(self.question.pk)
+        second = await broadcaster.subscribe(self.question.pk)
+        event, snapshot = first.get_nowait()
+        self.assertEqual(event, 'snapshot')
+        self.assertEqual(snapshot['c'], {self.red.pk: 0, self.green.pk: 0, self.blue.pk: 0})
+        self.assertEqual(second.get_nowait()[0], 'snapshot')
+
+        await sync_to_async(record_vote)(self.user, self.question, [self.green.pk])
+        # Both watchers are served by the same two queries
+        await broadcaster.poll()
+        for queue in (first, second):
+            event, delta = queue.get_nowait()
+            self.assertEqual(event, 'tally')
+            self.assertEqual(delta['c'], {self.green.pk: 1})
+            self.assertEqual(delta['t'], 1)
+
+        # Nothing changed, nothing sent
+        await broadcaster.poll()
+        self.assertTrue(first.empty())
+
+        broadcaster.unsubscribe(self.question.pk, first)
+        broadcaster.unsubscribe(self.question.pk, second)
+        self.assertEqual(broadcaster.watched(), [])
+
+    async def test_stream_endpoint(self):
+        url = reverse('polls:results_stream', args=(self.question.id,))
+        response = await self.async_client.get(url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        event = (await anext(stream)).decode()
+        self.assertTrue(event.startswith(f'id: {self.question.results_version}\nevent: snapshot\n'))
+        await stream.aclose()
+
+    def test_stream_needs_asgi_and_access(self):
+        url = reverse('polls:results_stream', args=(self.question.id,))
+        self.assertEqual(self.client.get(url).status_code, 501)
+
+        private = create_question('Secret?', visibility='private')
+        response = async_to_sync(self.async_client.get)(reverse('polls:results_stream', args=(private.id,)))
+        self.assertEqual(response.status_code, 403)
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_results_cache()
+        self.user = User.objects.create_user('api-user', password='secret-pass-123')
+        self.question = create_question()
+        self.choice = self.question.choice_set.first()
+
+    def test_list_is_cursor_paginated(self):
+        for i in range(3):
+            create_question(f'Extra {i}', pub_date=timezone.now() - timedelta(hours=i + 2))
+        create_question('Hidden', visibility='private')
+        response = self.client.get(reverse('api:poll_list'), {'limit': 2})
+        data = response.json()
+        self.assertEqual([poll['question_text'] for poll in data['results']], ['Extra 0', 'Extra 1'])
+        data = self.client.get(data['next']).json()
+        self.assertEqual([poll['question_text'] for poll in data['results']], ['Extra 2', 'Favourite colour?'])
+        self.assertIsNone(data['next'])
+        self.assertEqual(data['results'][1]['status'], 'active')
+
+    def test_conditional_get(self):
+        url = reverse('api:poll_results', args=(self.question.id,))
+        response = self.client.get(url)
+        self.assertEqual(response.json()['total_votes'], 0)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # A vote changes the results version and so the ETag
+        record_vote(self.user, self.question, [self.choice.id])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_votes'], 1)
+
+        detail_url = reverse('api:poll_detail', args=(self.question.id,))
+        response = self.client.get(detail_url)
+        self.assertEqual(len(response.json()['choices']), 3)
+        self.assertIn('Last-Modified', response)
+        response = self.client.get(detail_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_vote_and_comment(self):
+        vote_url = reverse('api:poll_vote', args=(self.question.id,))
+        self.assertEqual(self.client.post(vote_url, {'choice': self.choice.id}, 'application/json').status_code, 401)
+
+        self.client.force_login(self.user)
+        response = self.client.post(vote_url, {'choice': self.choice.id}, 'application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['choices'], [self.choice.id])
+        response = self.client.post(vote_url, {'choices': []}, 'application/json')
+        self.assertEqual(response.status_code, 400)
+
+        comments_url = reverse('api:poll_comments', args=(self.question.id,))
+        response = self.client.post(comments_url, {'text': 'Nice poll'}, 'application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get(comments_url).json()['results'][0]['text'], 'Nice poll')
+
+    def test_access_rules(self):
+        private = create_question('Secret?', visibility='private')
+        self.assertEqual(self.client.get(reverse('api:poll_detail', args=(private.id,))).status_code, 404)
+
+        locked = create_question('Locked?', visibility='password', password='sesame')
+        url = reverse('api:poll_results', args=(locked.id,))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        unlock_url = reverse('api:poll_unlock', args=(locked.id,))
+        self.assertEqual(self.client.post(unlock_url, {'password': 'nope'}, 'application/json').status_code, 403)
+        self.assertEqual(self.client.post(unlock_url, {'password': 'sesame'}, 'application/json').status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class SearchTests(TestCase):
+    backend_class = search.FTS5Backend
+
+    def setUp(self):
+        patcher = mock.patch.object(search, '_backend', self.backend_class())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sports = Category.objects.create(name='Sports', slug='sports')
+        self.colour = create_question('Favourite colour?', ('Red', 'Green'))
+        self.team = create_question('Best football team?', ('Arsenal', 'Chelsea'), category=self.sports)
+        self.other = create_question('Lunch plans', ('Pizza',), description='Anything but the colour beige')
+
+    def test_ranked_prefix_matching(self):
+        # Title matches rank above description matches; words match as prefixes
+        self.assertEqual(search.search_polls('colo'), [self.colour.pk, self.other.pk])
+        self.assertEqual(search.search_polls('chel'), [self.team.pk])
+        self.assertEqual(search.search_polls('SPORTS'), [self.team.pk])
+        # Every word has to match
+        self.assertEqual(search.search_polls('colour beige'), [self.other.pk])
+        self.assertEqual(search.search_polls('   '), [])
+
+    def test_index_follows_changes(self):
+        choice = self.team.choice_set.get(choice_text='Chelsea')
+        choice.choice_text = 'Liverpool'
+        choice.save()
+        self.assertEqual(search.search_polls('chelsea'), [])
+        self.assertEqual(search.search_polls('liver'), [self.team.pk])
+
+        self.sports.name = 'Athletics'
+        self.sports.save()
+        self.assertEqual(search.search_polls('athletics'), [self.team.pk])
+
+        self.team.delete()
+        self.assertEqual(search.search_polls('liver'), [])
+
+    def test_rebuild_and_index_view(self):
+        self.assertEqual(search.rebuild_index(batch_size=2), 3)
+        response = self.client.get(reverse('polls:index'), {'search': 'colour'})
+        self.assertEqual([poll.pk for poll in response.context['polls']], [self.colour.pk, self.other.pk])
+
+
+class TermsSearchTests(SearchTests):
+    backend_class = search.TermsBackend
+
+
+class QueryPlanTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_results_cache()
+        self.user = User.objects.create_user('planner', password='secret-pass-123')
+        self.question = create_question()
+        record_vote(self.user, self.question, [self.question.choice_set.first().pk])
+
+    def test_full_scans_are_detected(self):
+        plan = ['SCAN pollApp_question', 'SEARCH U0 USING COVERING INDEX pollapp_vote_user_q_idx (user_id=?)']
+        self.assertEqual(query_plans.full_scans(plan), ['pollApp_question'])
+        self.assertEqual(query_plans.full_scans(['SCAN pollApp_question USING INDEX pollapp_q_listing_idx']), [])
+
+    def test_hot_pages_use_indexes(self):
+        pages = [
+            ('index', 'get', reverse('polls:index'), None),
+            ('results', 'get', reverse('polls:results', args=(self.question.id,)), None),
+            ('profile', 'get', reverse('accounts:profile'), None),
+        ]
+        explained, problems = query_plans.check_plans(query_plans.capture_queries(pages, self.user))
+        self.assertGreater(explained, 5)
+        self.assertEqual([(problem.page, problem.table) for problem in problems], [])
+
+
+class SqliteProfileTests(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_follow_the_profile(self):
+        with override_settings(SQLITE_PROFILE='performance', SQLITE_PRAGMAS={'busy_timeout': 4321, 'cache_size': -1234}):
+            signals.tune_sqlite_connection(sender=None, connection=connection)
+        self.assertEqual(self.pragma('busy_timeout'), 4321)
+        self.assertEqual(self.pragma('cache_size'), -1234)
+
+        with override_settings(SQLITE_PROFILE='default', SQLITE_PRAGMAS={'busy_timeout': 1}):
+            signals.tune_sqlite_connection(sender=None, connection=connection)
+        self.assertEqual(self.pragma('busy_timeout'), 4321)
+
+    def test_write_transactions_take_the_lock_up_front_in_every_profile(self):
+        # Deferred ones fail with "database is locked" when two voters upgrade at once
+        self.assertEqual(connection.settings_dict['OPTIONS'].get('transaction_mode'), 'IMMEDIATE')
+
+
+@override_settings(
+    DATABASE_ROUTERS=['pollApp.routers.PrimaryReplicaRouter'],
+    MIDDLEWARE=settings.MIDDLEWARE + ['pollApp.routers.PrimaryPinMiddleware'],
+)
+@skipIf(
+    'replica' not in settings.DATABASES or settings.DATABASES['replica'].get('TEST', {}).get('MIRROR'),
+    'needs a replica separate from the primary',
+)
+class ReplicaRoutingTests(TestCase):
+    """The test replica is its own empty SQLite database, so each read shows where it went"""
+    databases = {'default', 'replica'} & set(settings.DATABASES)
+
+    def setUp(self):
+        cache.clear()
+        clear_local_results_cache()
+        self.user = User.objects.create_user('reader', password='secret-pass-123')
+        # Replicated as is: the session checks the password hash
+        User.objects.using('replica').create(pk=self.user.pk, username='reader', password=self.user.password)
+        self.primary_question = create_question('On the primary?')
+        self.replica_question = Question.objects.using('replica').create(
+            pk=1000, question_text='On the replica?', pub_date=timezone.now() - timedelta(days=1),
+        )
+        self.client.force_login(self.user)
+
+    def listed(self):
+        response = self.client.get(reverse('polls:index'))
+        return [poll.question_text for poll in response.context['polls']]
+
+    def test_listing_and_results_read_from_the_replica(self):
+        self.assertEqual(self.listed(), ['On the replica?'])
+        response = self.client.get(reverse('polls:results', args=(self.replica_question.pk,)))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('accounts:profile'))
+        self.assertEqual(response.context['user'].username, 'reader')
+
+        # Everything else reads from the primary
+        self.assertEqual(list(Question.objects.values_list('question_text', flat=True)), ['On the primary?'])
+        response = self.client.get(reverse('polls:detail', args=(self.replica_question.pk,)))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_async_results_read_from_the_replica(self):
+        url = reverse('polls:results', args=(self.replica_question.pk,), current_app='polls-async')
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['question'].question_text, 'On the replica?')
+
+    def test_votes_go_to_the_primary_and_pin_the_client_to_it(self):
+        choice = self.primary_question.choice_set.first()
+        response = self.client.post(reverse('polls:vote', args=(self.primary_question.pk,)), {'choice': choice.pk})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Vote.objects.filter(user=self.user, choice=choice).exists())
+        self.assertFalse(Vote.objects.using('replica').exists())
+
+        # Until the pin expires the client reads its own vote from the primary
+        self.assertEqual(self.listed(), ['On the primary?'])
+        response = self.client.get(reverse('polls:results', args=(self.primary_question.pk,)))
+        self.assertEqual(response.context['results']['total_votes'], 1)
+
+        with mock.patch('pollApp.routers.time.time', return_value=time.time() + 60):
+            self.assertEqual(self.listed(), ['On the replica?'])
+
+    def test_a_write_switches_the_rest_of_the_view_to_the_primary(self):
+        @use_replica
+        def view(request):
+            before = list(Question.objects.values_list('question_text', flat=True))
+            Category.objects.create(name='Written', slug='written')
+            after = list(Question.objects.values_list('question_text', flat=True))
+            return before, after
+
+        request = RequestFactory().get('/')
+        request.session = {}
+        self.assertEqual(view(request), (['On the replica?'], ['On the primary?']))
+        self.assertTrue(Category.objects.using('default').filter(slug='written').exists())
+        self.assertFalse(Category.objects.using('replica').exists())
+
+    def test_migrations_skip_the_replica(self):
+        router = PrimaryReplicaRouter()
+        self.assertIs(router.allow_migrate('replica', 'pollApp'), False)
+        self.assertIsNone(router.allow_migrate('default', 'pollApp'))
+
+
+class BenchmarkTests(TestCase):
+    """The hot path benchmark, small enough to run with the tests, doubling as a query budget"""
+
+    # Most queries each page may make for a logged-in user
+    QUERY_BUDGETS = {'index': 5, 'detail': 7, 'results': 7, 'vote': 13, 'profile': 6}
+
+    def setUp(self):
+        cache.clear()
+        clear_local_results_cache()
+
+    def test_hot_path_stays_within_its_query_budget(self):
+        data = fixtures.seed(polls=3, choices=3, users=4, votes_per_poll=2)
+        for page, requests in hotpath.hot_path_requests(data, 6, random.Random(0)):
+            measurement = replay(page, requests, data['users'], concurrency=1)
+            self.assertEqual(measurement.requests, 6)
+            self.assertLessEqual(max(measurement.queries), self.QUERY_BUDGETS[page], page)
+            self.assertEqual(set(measurement.as_dict()), {
+                'label', 'requests', 'rate', 'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms', 'queries_per_request', 'locked',
+            })
+            self.assertEqual(measurement.locked, 0)
+
+    def test_lock_errors_are_counted_instead_of_ending_the_run(self):
+        data = fixtures.seed(polls=1, choices=2, users=1, votes_per_poll=0)
+        requests = [('get', reverse('polls:index'), None)] * 2
+        with mock.patch('django.test.Client.get', side_effect=OperationalError('database is locked')):
+            measurement = replay('index', requests, data['users'], concurrency=1)
+        self.assertEqual((measurement.requests, measurement.locked), (0, 2))
+        self.assertIn('2 "database is locked"', measurement.summary())
+
+    def test_compare_flags_slower_pages_and_extra_queries(self):
+        def report(p95, queries):
+            return {'scenarios': {'hotpath': [{'label': 'vote', 'p95_ms': p95, 'queries_per_request': queries}]}}
+
+        self.assertEqual(compare(report(10.0, 5.0), report(12.0, 5.0))[1], [])
+        self.assertIn('slower', compare(report(10.0, 5.0), report(13.0, 5.0))[1][0])
+        self.assertIn('more queries', compare(report(10.0, 5.0), report(10.0, 6.0))[1][0])
+        lines, regressions = compare({'scenarios': {}}, report(10.0, 5.0))
+        self.assertEqual((lines, regressions), (['hotpath: vote: no baseline'], []))
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_results_cache()
+        registry.clear()
+        self.question = create_question()
+
+    def histogram(self, name, view):
+        return registry.histograms[name, view]
+
+    def test_records_queries_and_render_time_by_view(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('polls:index'))
+        self.assertEqual(self.histogram('poll_request_queries', 'polls:index').sum, len(queries))
+        self.assertEqual(self.histogram('poll_request_duration_seconds', 'polls:index').count, 1)
+        self.assertGreater(self.histogram('poll_request_sql_seconds', 'polls:index').sum, 0)
+        self.assertGreater(self.histogram('poll_request_template_seconds', 'polls:index').sum, 0)
+
+    def test_counts_queries_of_async_views(self):
+        self.client.get(reverse('polls-async:detail', args=[self.question.id]))
+        self.assertGreater(self.histogram('poll_request_queries', 'polls-async:detail').sum, 0)
+
+    @override_settings(POLL_QUERY_BUDGETS={'polls:detail': 1})
+    def test_over_budget_raises_under_test(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('polls:detail', args=[self.question.id]))
+        # The async instance of the namespace shares the budget
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('polls-async:detail', args=[self.question.id]))
+
+    @override_settings(POLL_QUERY_BUDGETS={'polls:index': 1}, POLL_QUERY_BUDGET_ACTION='log')
+    def test_over_budget_logs_and_counts(self):
+        with self.assertLogs('pollApp.instrumentation', 'WARNING') as logs:
+            response = self.client.get(reverse('polls:index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('over its budget of 1', logs.output[0])
+        self.assertEqual(registry.counters['poll_query_budget_exceeded_total', 'polls:index'], 1)
+
+    @override_settings(POLL_METRICS_TOKEN='scrape-token')
+    def test_endpoint_is_for_staff_or_the_token(self):
+        url = reverse('polls:metrics')
+        self.client.get(reverse('polls:index'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(User.objects.create_user('voter', password='secret-pass-123'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(User.objects.create_user('staff', password='secret-pass-123', is_staff=True))
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn('# TYPE poll_request_queries histogram', body)
+        self.assertIn('poll_request_queries_count{view="polls:index"} 1', body)
+        self.assertIn('poll_request_duration_seconds_bucket{view="polls:index",le="+Inf"} 1', body)
+
+        self.client.logout()
+        response = self.client.get(url, headers={'Authorization': 'Bearer scrape-token'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url, headers={'Authorization': 'Bearer wrong'}).status_code, 403)
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 app_name = 'polls'
 
@@ -7,8 +7,11 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('<int:question_id>/', views.detail, name='detail'),
     path('<int:question_id>/results/', views.results, name='results'),
+    path('<int:question_id>/results/stream/', async_views.results_stream, name='results_stream'),
     path('<int:question_id>/vote/', views.vote, name='vote'),
     path('<int:question_id>/comment/', views.add_comment, name='add_comment'),
     path('comment/<int:comment_id>/delete/', views.delete_comment, name='delete_comment'),
     path('category/<slug:slug>/', views.category_polls, name='category'),
+    path('export/votes/', views.export_votes, name='export_votes'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -1,77 +1,70 @@
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import (
+    HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse,
+)
 from django.template import loader
 from django.urls import reverse
 from django.http import Http404
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
-from django.db.models import Count, Q
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Count
+from django.utils.crypto import constant_time_compare
 from .models import Question, Choice, Vote, Category, Comment
+from .pagination import paginate_newest_first, paginate_ranked, page_url
+from .routers import use_replica
+from .services import access, unlock
+from .services.export import EXPORT_FORMATS, export_lines, filter_votes, parse_bound
+from .services.metrics import registry
+from .services.results_cache import get_results
+from .services.search import search_polls
+from .services.throttle import throttle
+from .services.voting import ranking_from_form, record_vote
 
 
+@use_replica
 def index(request):
     """List all active polls with filtering and search"""
-    # Get active, non-draft polls
-    polls = Question.objects.filter(is_draft=False)
-    
-    # Apply visibility filter
-    if not request.user.is_authenticated:
-        # Non-authenticated users can only see public polls
-        polls = polls.filter(visibility='public')
-    else:
-        # Authenticated users can see:
-        # - Public polls
-        # - Password-protected polls (they'll need to enter password to vote)
-        # - Their own private polls
-        # - Private polls they're invited to
-        polls = polls.filter(
-            Q(visibility='public') | 
-            Q(visibility='password') | 
-            Q(visibility='private', created_by=request.user) |
-            Q(visibility='private', invited_users=request.user)
-        ).distinct()  # distinct() to avoid duplicates from invited_users
+    # Get non-draft polls the user is allowed to see
+    polls = Question.objects.visible_to(request.user)
     
     # Filter by category if specified
     category_slug = request.GET.get('category')
     if category_slug:
         polls = polls.filter(category__slug=category_slug)
     
-    # Search functionality
+    # Search functionality: best matches from the full-text index
     search_query = request.GET.get('search')
-    if search_query:
-        polls = polls.filter(
-            Q(question_text__icontains=search_query) |
-            Q(description__icontains=search_query)
-        )
+    ranked_ids = search_polls(search_query) if search_query else None
     
     # Filter by status
     status = request.GET.get('status', 'active')
-    if status == 'active':
-        # Only active polls
-        polls = [p for p in polls if p.is_active()]
-    elif status == 'upcoming':
-        polls = [p for p in polls if p.is_upcoming()]
+    if status == 'upcoming':
+        polls = polls.upcoming()
     elif status == 'expired':
-        polls = [p for p in polls if p.is_expired()]
-    elif status == 'all':
-        polls = list(polls)
+        polls = polls.expired()
+    elif status != 'all':
+        # Only active polls
+        polls = polls.active()
+    
+    polls = polls.select_related('category').with_invitation_flag(request.user)
+    if ranked_ids is not None:
+        page = paginate_ranked(polls, ranked_ids, request.GET.get('cursor'), settings.POLLS_PER_PAGE)
     else:
-        polls = [p for p in polls if p.is_active()]
+        page = paginate_newest_first(polls, request.GET.get('cursor'), settings.POLLS_PER_PAGE)
     
-    # Get user votes if authenticated
-    user_votes = {}
-    if request.user.is_authenticated:
-        votes = Vote.objects.filter(user=request.user)
-        for vote in votes:
-            if vote.question_id not in user_votes:
-                user_votes[vote.question_id] = []
-            user_votes[vote.question_id].append(vote.choice_id)
+    # Get user votes for the polls on this page
+    user_votes = _user_votes_by_question(request.user, page)
     
     # Get all categories for filter
     categories = Category.objects.all()
     
     context = {
-        'polls': polls,
+        'polls': page,
+        'next_page_url': page_url(request, page.next_cursor) if page.has_next else None,
+        'first_page_url': None if page.is_first else page_url(request, None),
         'user_votes': user_votes,
         'categories': categories,
         'selected_category': category_slug,
@@ -81,37 +74,35 @@ def index(request):
     return render(request, 'polls/index.html', context)
 
 
+def _user_votes_by_question(user, polls):
+    """Map question id -> chosen choice ids for the given polls"""
+    user_votes = {}
+    if user.is_authenticated:
+        votes = Vote.objects.filter(user=user, question__in=[p.id for p in polls])
+        for question_id, choice_id in votes.values_list('question_id', 'choice_id'):
+            user_votes.setdefault(question_id, []).append(choice_id)
+    return user_votes
+
+
+@throttle('unlock')
 def detail(request, question_id):
     """Show poll details and voting interface"""
-    question = get_object_or_404(Question, pk=question_id)
+    question = get_object_or_404(Question.objects.select_related('category'), pk=question_id)
     
-    # Check if poll is draft
-    if question.is_draft and (not request.user.is_authenticated or request.user != question.created_by):
-        messages.error(request, 'This poll is not available.')
-        return redirect('polls:index')
-    
-    # Check visibility
-    if question.visibility == 'private':
-        # Private polls only accessible by creator and invited users
-        if not request.user.is_authenticated:
-            messages.error(request, 'You do not have permission to view this poll.')
-            return redirect('polls:index')
-        
-        is_creator = request.user == question.created_by
-        is_invited = question.invited_users.filter(id=request.user.id).exists()
-        
-        if not (is_creator or is_invited):
-            messages.error(request, 'You do not have permission to view this poll.')
-            return redirect('polls:index')
+    # Check draft status and visibility
+    denied = _deny_access(request, question, 'view')
+    if denied:
+        return denied
     
     # Handle password-protected polls
+    unlocked_now = False
     if question.visibility == 'password':
-        if not request.session.get(f'poll_password_{question_id}'):
+        if not unlock.is_unlocked(request, question):
             # Check if password is being submitted
             if request.method == 'POST' and 'poll_password' in request.POST:
                 entered_password = request.POST.get('poll_password')
-                if entered_password == question.password:
-                    request.session[f'poll_password_{question_id}'] = True
+                if question.check_password(entered_password):
+                    unlocked_now = True
                 else:
                     messages.error(request, 'Incorrect password.')
                     return render(request, 'polls/password.html', {'question': question})
@@ -119,93 +110,125 @@ def detail(request, question_id):
                 return render(request, 'polls/password.html', {'question': question})
     
     # Check if user already voted
-    user_votes = []
+    user_ranks = {}
     if request.user.is_authenticated:
-        user_votes = Vote.objects.filter(user=request.user, question=question).values_list('choice_id', flat=True)
+        user_ranks = dict(Vote.objects.filter(user=request.user, question=question).values_list('choice_id', 'rank'))
     
-    # Get comments
-    comments = question.comments.all()[:20]
+    choices = list(question.choice_set.all())
+    for choice in choices:
+        # Preselects the user's ranking on ranked polls
+        choice.user_rank = user_ranks.get(choice.id)
     
     context = {
         'question': question,
-        'user_votes': list(user_votes),
-        'comments': comments,
+        'choices': choices,
+        'is_invited': access.is_invited(request.user, question, request),
+        'user_votes': list(user_ranks),
+        **_comments_context(question),
     }
-    return render(request, 'polls/detail.html', context)
+    response = render(request, 'polls/detail.html', context)
+    if unlocked_now:
+        unlock.grant(response, question)
+    return response
 
 
+@use_replica
 def results(request, question_id):
     """Display poll results"""
-    question = get_object_or_404(Question, pk=question_id)
+    question = get_object_or_404(Question.objects.select_related('category'), pk=question_id)
     
-    # Check visibility (same as detail)
-    if question.is_draft and (not request.user.is_authenticated or request.user != question.created_by):
-        messages.error(request, 'This poll is not available.')
-        return redirect('polls:index')
-    
-    if question.visibility == 'private':
-        # Private polls only accessible by creator and invited users
-        if not request.user.is_authenticated:
-            messages.error(request, 'You do not have permission to view this poll.')
-            return redirect('polls:index')
-        
-        is_creator = request.user == question.created_by
-        is_invited = question.invited_users.filter(id=request.user.id).exists()
-        
-        if not (is_creator or is_invited):
-            messages.error(request, 'You do not have permission to view this poll.')
-            return redirect('polls:index')
+    # Check draft status and visibility (same as detail)
+    denied = _deny_access(request, question, 'view')
+    if denied:
+        return denied
     
     # Handle password-protected polls
     if question.visibility == 'password':
-        if not request.session.get(f'poll_password_{question_id}'):
+        if not unlock.is_unlocked(request, question):
             messages.warning(request, 'This poll is password protected. Please enter the password first.')
             return redirect('polls:detail', question_id=question_id)
     
     # Check if user voted
     user_votes = []
     if request.user.is_authenticated:
-        user_votes = Vote.objects.filter(user=request.user, question=question)
+        user_votes = list(Vote.objects.filter(user=request.user, question=question).select_related('choice'))
     
-    # Get comments
-    comments = question.comments.all()[:20]
+    # Tallies, percentages and chart data come from the versioned results cache
+    results = get_results(question)
     
     context = {
         'question': question,
+        'results': results,
+        'choices': results['choices'],
+        'is_invited': access.is_invited(request.user, question, request),
         'user_votes': user_votes,
-        'comments': comments,
+        'user_choice_ids': [vote.choice_id for vote in user_votes],
+        # Live updates need the SSE stream, which is only served under ASGI
+        'live_results': question.is_active() and isinstance(request, ASGIRequest),
+        **_comments_context(question),
     }
     return render(request, 'polls/results.html', context)
 
 
+def _deny_access(request, question, action):
+    """Redirect with an error if the user may not access the poll, else None"""
+    if access.can_access(request.user, question, request):
+        return None
+    if question.is_draft:
+        messages.error(request, 'This poll is not available.')
+    else:
+        messages.error(request, f'You do not have permission to {action} this poll.')
+    return redirect('polls:index')
+
+
+def _comments_context(question):
+    """Latest comments with their authors, plus the total count"""
+    return {
+        'comments': question.comments.select_related('user')[:20],
+        'comment_count': question.comments.count(),
+    }
+
+
+@throttle('vote')
 @login_required(login_url='accounts:login')
 def vote(request, question_id):
     """Handle voting with support for single and multiple choice"""
     question = get_object_or_404(Question, pk=question_id)
     
     # Check visibility and password protection
-    if question.visibility == 'private':
-        is_creator = request.user == question.created_by
-        is_invited = question.invited_users.filter(id=request.user.id).exists()
-        
-        if not (is_creator or is_invited):
-            messages.error(request, 'You do not have permission to vote on this poll.')
-            return redirect('polls:index')
+    denied = _deny_access(request, question, 'vote on')
+    if denied:
+        return denied
     
     if question.visibility == 'password':
-        if not request.session.get(f'poll_password_{question_id}'):
+        if not unlock.is_unlocked(request, question):
             messages.warning(request, 'Please enter the password to access this poll.')
             return redirect('polls:detail', question_id=question_id)
     
     # Check if poll is active
-    if not question.is_active():
+    if not question.accepts_votes():
         messages.error(request, 'This poll is not currently accepting votes.')
         return redirect('polls:results', question_id=question_id)
     
     if request.method != 'POST':
         return redirect('polls:detail', question_id=question_id)
     
-    if question.allow_multiple_choices:
+    if question.ranking_method:
+        # Ranked ballot: one rank_<choice id> field per choice
+        ranking = ranking_from_form(request.POST)
+        if not ranking:
+            messages.error(request, 'You must rank at least one choice.')
+            return redirect('polls:detail', question_id=question_id)
+        
+        try:
+            result = record_vote(request.user, question, ranking)
+        except Choice.DoesNotExist:
+            messages.error(request, 'You did not select a valid choice.')
+            return redirect('polls:detail', question_id=question_id)
+        
+        messages.success(request, f'Your ranking has been recorded! ({len(result.ranking)} choices)')
+    
+    elif question.allow_multiple_choices:
         # Multiple choice voting
         selected_choices = request.POST.getlist('choice')
         
@@ -213,76 +236,43 @@ def vote(request, question_id):
             messages.error(request, 'You must select at least one choice.')
             return redirect('polls:detail', question_id=question_id)
         
-        # Remove old votes for this question
-        old_votes = Vote.objects.filter(user=request.user, question=question)
-        for old_vote in old_votes:
-            old_vote.choice.votes -= 1
-            old_vote.choice.save()
-        old_votes.delete()
-        
-        # Add new votes
-        for choice_id in selected_choices:
-            try:
-                choice = question.choice_set.get(pk=choice_id)
-                Vote.objects.create(user=request.user, choice=choice, question=question)
-                choice.votes += 1
-                choice.save()
-            except Choice.DoesNotExist:
-                continue
+        try:
+            result = record_vote(request.user, question, selected_choices)
+        except Choice.DoesNotExist:
+            messages.error(request, 'You did not select a valid choice.')
+            return redirect('polls:detail', question_id=question_id)
         
-        messages.success(request, f'Your votes have been recorded! ({len(selected_choices)} choices)')
+        messages.success(request, f'Your votes have been recorded! ({len(result.choice_ids)} choices)')
     
     else:
         # Single choice voting
         try:
-            selected_choice = question.choice_set.get(pk=request.POST['choice'])
+            result = record_vote(request.user, question, [request.POST['choice']])
         except (KeyError, Choice.DoesNotExist):
             messages.error(request, 'You did not select a valid choice.')
             return redirect('polls:detail', question_id=question_id)
         
-        # Check if user already voted
-        existing_votes = Vote.objects.filter(user=request.user, question=question)
-        
-        if existing_votes.exists():
-            # Update existing vote
-            for old_vote in existing_votes:
-                old_choice = old_vote.choice
-                old_choice.votes -= 1
-                old_choice.save()
-                old_vote.delete()
-            
-            Vote.objects.create(user=request.user, choice=selected_choice, question=question)
-            selected_choice.votes += 1
-            selected_choice.save()
-            
+        if result.is_update:
             messages.success(request, 'Your vote has been updated!')
         else:
-            # Create new vote
-            Vote.objects.create(user=request.user, choice=selected_choice, question=question)
-            selected_choice.votes += 1
-            selected_choice.save()
-            
             messages.success(request, 'Your vote has been recorded!')
     
     return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
 
 
+@throttle('comment')
 @login_required(login_url='accounts:login')
 def add_comment(request, question_id):
     """Add a comment to a poll"""
     question = get_object_or_404(Question, pk=question_id)
     
     # Check visibility and password protection
-    if question.visibility == 'private':
-        is_creator = request.user == question.created_by
-        is_invited = question.invited_users.filter(id=request.user.id).exists()
-        
-        if not (is_creator or is_invited):
-            messages.error(request, 'You do not have permission to comment on this poll.')
-            return redirect('polls:index')
+    denied = _deny_access(request, question, 'comment on')
+    if denied:
+        return denied
     
     if question.visibility == 'password':
-        if not request.session.get(f'poll_password_{question_id}'):
+        if not unlock.is_unlocked(request, question):
             messages.warning(request, 'Please enter the password to access this poll.')
             return redirect('polls:detail', question_id=question_id)
     
@@ -317,39 +307,64 @@ def delete_comment(request, comment_id):
     return redirect('polls:results', question_id=question_id)
 
 
+@use_replica
 def category_polls(request, slug):
     """Show polls in a specific category"""
     category = get_object_or_404(Category, slug=slug)
-    polls = Question.objects.filter(category=category, is_draft=False)
-    
-    # Filter by visibility
-    if not request.user.is_authenticated:
-        polls = polls.filter(visibility='public')
-    else:
-        # Authenticated users can see public, password-protected, their own private polls, and polls they're invited to
-        polls = polls.filter(
-            Q(visibility='public') | 
-            Q(visibility='password') | 
-            Q(visibility='private', created_by=request.user) |
-            Q(visibility='private', invited_users=request.user)
-        ).distinct()
     
-    # Only active polls
-    polls = [p for p in polls if p.is_active()]
+    # Only active polls the user is allowed to see
+    polls = (
+        Question.objects.visible_to(request.user)
+        .filter(category=category)
+        .active()
+        .with_invitation_flag(request.user)
+    )
+    page = paginate_newest_first(polls, request.GET.get('cursor'), settings.POLLS_PER_PAGE)
     
     # Get user votes
-    user_votes = {}
-    if request.user.is_authenticated:
-        votes = Vote.objects.filter(user=request.user, question__in=[p.id for p in polls])
-        for vote in votes:
-            if vote.question_id not in user_votes:
-                user_votes[vote.question_id] = []
-            user_votes[vote.question_id].append(vote.choice_id)
+    user_votes = _user_votes_by_question(request.user, page)
     
     context = {
         'category': category,
-        'polls': polls,
+        'polls': page,
+        'next_page_url': page_url(request, page.next_cursor) if page.has_next else None,
+        'first_page_url': None if page.is_first else page_url(request, None),
         'user_votes': user_votes,
     }
     return render(request, 'polls/category.html', context)
-    
\ No newline at end of file
+
+
+@staff_member_required
+def export_votes(request):
+    """Stream votes as CSV or NDJSON (staff only)"""
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest('Unknown export format.')
+    
+    try:
+        question_ids = [int(pk) for pk in request.GET.getlist('question')]
+        since = parse_bound(request.GET.get('since'))
+        until = parse_bound(request.GET.get('until'), end_of_day=True)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid filter value.')
+    
+    votes = filter_votes(question_ids, request.GET.get('category'), since, until)
+    if export_format == 'ndjson':
+        content_type, filename = 'application/x-ndjson', 'votes.ndjson'
+    else:
+        content_type, filename = 'text/csv', 'votes.csv'
+    
+    response = StreamingHttpResponse(export_lines(votes, export_format), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def metrics(request):
+    """Request metrics in the Prometheus text format (staff, or a bearer POLL_METRICS_TOKEN)"""
+    token = settings.POLL_METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    has_token = bool(token) and constant_time_compare(authorization, f'Bearer {token}')
+    if not has_token and not (request.user.is_active and request.user.is_staff):
+        return HttpResponseForbidden('Staff only.')
+    
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -16,7 +16,6 @@ import os
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/6.0/howto/deployment/checklist/
 
@@ -44,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its wall time covers the rest of the middleware
+    'pollApp.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -57,15 +58,22 @@ ROOT_URLCONF = 'poll_project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's backend, timing renders for RequestMetricsMiddleware
+        'BACKEND': 'pollApp.instrumentation.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, "templates")],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Compiled templates are kept in memory (runserver still reloads edited ones)
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -76,14 +84,121 @@ WSGI_APPLICATION = 'poll_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
+# SQLite unless DB_ENGINE=postgresql; both read DB_NAME, PostgreSQL also
+# DB_USER, DB_PASSWORD, DB_HOST and DB_PORT.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite3')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'poll_project'),
+            'USER': os.environ.get('DB_USER', 'poll_project'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+        }
+    }
+
+# SQLite tuning
+# Write transactions always start with BEGIN IMMEDIATE: a vote reads the
+# ballot and then writes in one transaction, and two of those that both
+# started as readers would fail with "database is locked" on the lock upgrade
+# instead of queueing on the busy timeout. The 'performance' profile also
+# applies SQLITE_PRAGMAS to every new connection (see pollApp.signals) and
+# keeps connections open between requests; 'default', the default, leaves
+# SQLite's own pragmas alone.
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'default')
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 128 * 1024 * 1024,
+    'cache_size': -20000,  # KiB
+    'temp_store': 'MEMORY',
+}
+if DB_ENGINE == 'sqlite3':
+    DATABASES['default']['OPTIONS'] = {'transaction_mode': 'IMMEDIATE'}
+    if SQLITE_PROFILE == 'performance':
+        DATABASES['default'].update({
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+            'CONN_HEALTH_CHECKS': True,
+        })
+
+# PostgreSQL connection pooling
+# DB_POOL=psycopg keeps a pool of DB_POOL_MIN_SIZE to DB_POOL_MAX_SIZE
+# connections in each worker process (needs psycopg[pool]); requests borrow
+# one and give it back. DB_POOL=pgbouncer is for a PgBouncer in transaction
+# mode in front of the server: Django keeps its connection to PgBouncer open
+# and skips server-side cursors, which don't survive transaction pooling.
+# DB_POOL=off connects once per request.
+DB_POOL = os.environ.get('DB_POOL', 'psycopg')
+if DB_ENGINE == 'postgresql' and DB_POOL == 'psycopg':
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        },
+    }
+elif DB_ENGINE == 'postgresql' and DB_POOL == 'pgbouncer':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'DISABLE_SERVER_SIDE_CURSORS': True,
+    })
+
+# Read replica
+# DB_REPLICA_HOST (PostgreSQL) or DB_REPLICA_NAME (an SQLite copy kept in
+# sync with the primary) adds a 'replica' alias with the primary's other
+# settings. pollApp.routers then serves the listing, results and profile
+# views from it and keeps clients on the primary for
+# DATABASE_REPLICA_PIN_SECONDS after they post, so they see their own votes.
+# Under test the replica mirrors the primary's test database (poll_project/test_settings.py
+# adds a separate one when none is configured).
+replica = {}
+if DB_ENGINE == 'postgresql' and os.environ.get('DB_REPLICA_HOST'):
+    replica = {
+        'HOST': os.environ['DB_REPLICA_HOST'],
+        'PORT': os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+    }
+elif DB_ENGINE == 'sqlite3' and os.environ.get('DB_REPLICA_NAME'):
+    replica = {'NAME': os.environ['DB_REPLICA_NAME']}
+if replica:
+    DATABASES['replica'] = {**DATABASES['default'], **replica, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_ROUTERS = ['pollApp.routers.PrimaryReplicaRouter']
+    MIDDLEWARE.append('pollApp.routers.PrimaryPinMiddleware')
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get('DB_REPLICA_PIN_SECONDS', 5))
+
+
+# Cache
+# Local memory by default; point DJANGO_CACHE_BACKEND at
+# django.core.cache.backends.filebased.FileBasedCache (with a directory as
+# DJANGO_CACHE_LOCATION) or a shared backend to share entries between workers.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'poll-project'),
     }
 }
 
 
+# Sessions
+# Database-backed by default. Nothing on the poll pages writes to the session
+# (password polls are unlocked with signed cookies), so busy sites can use
+# django.contrib.sessions.backends.signed_cookies or .cached_db instead.
+SESSION_ENGINE = os.environ.get('DJANGO_SESSION_ENGINE', 'django.contrib.sessions.backends.db')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -134,3 +249,107 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_URL = 'accounts:login'
 LOGIN_REDIRECT_URL = 'polls:index'
 LOGOUT_REDIRECT_URL = 'index'
+
+# Vote ingestion
+# With buffering on, Choice.votes is updated by a background flusher every
+# POLL_VOTE_FLUSH_INTERVAL_MS instead of inside each vote transaction.
+# Run `python manage.py reconcile_votes` after a crash to rebuild the counters.
+POLL_VOTE_BUFFERING = os.environ.get('POLL_VOTE_BUFFERING', '') == '1'
+POLL_VOTE_FLUSH_INTERVAL_MS = int(os.environ.get('POLL_VOTE_FLUSH_INTERVAL_MS', 500))
+
+# Poll listings
+POLLS_PER_PAGE = 20
+# Rendered poll cards are cached per poll version and viewer class; 0 renders every time
+POLL_CARD_CACHE_TIMEOUT = int(os.environ.get('POLL_CARD_CACHE_TIMEOUT', 600))
+
+# Results cache
+# Entries are tied to Question.results_version, which every vote bumps.
+# POLL_RESULTS_MAX_STALENESS lets readers reuse results that are up to that
+# many seconds behind during vote storms; 0 always serves the current version.
+POLL_RESULTS_LRU_SIZE = 256
+POLL_RESULTS_CACHE_TIMEOUT = 300
+POLL_RESULTS_MAX_STALENESS = float(os.environ.get('POLL_RESULTS_MAX_STALENESS', 0))
+
+# Private poll access
+# Each user's invited poll ids are cached and invalidated when invitations change
+POLL_INVITES_CACHE_TIMEOUT = 3600
+# Password polls stay unlocked for this long after the password is entered (signed cookie)
+POLL_UNLOCK_MAX_AGE = int(os.environ.get('POLL_UNLOCK_MAX_AGE', 60 * 60 * 24))
+
+# Live results (Server-Sent Events, ASGI only)
+# One task per worker polls the watched polls every POLL_LIVE_RESULTS_INTERVAL
+# seconds; streams send a keepalive comment when idle and are recycled after
+# POLL_LIVE_RESULTS_MAX_DURATION seconds (browsers reconnect by themselves).
+POLL_LIVE_RESULTS_INTERVAL = float(os.environ.get('POLL_LIVE_RESULTS_INTERVAL', 1.0))
+POLL_LIVE_RESULTS_KEEPALIVE = 15
+POLL_LIVE_RESULTS_MAX_DURATION = 300
+
+# Poll search
+# 'auto' uses an SQLite FTS5 table where available and the portable SearchTerm
+# index otherwise ('fts5' or 'terms' to force one). Rebuild with
+# `python manage.py rebuild_search_index` after switching.
+POLL_SEARCH_BACKEND = os.environ.get('POLL_SEARCH_BACKEND', 'auto')
+POLL_SEARCH_MAX_RESULTS = 500
+
+# Throttling
+# Sliding-window limits per scope, counted per logged-in user and per client
+# IP in the POLL_THROTTLE_CACHE cache; with several workers, point it at a
+# shared backend. Rates are '<count>/<s|m|h|d>'. Excess requests get a 429.
+POLL_THROTTLE_CACHE = os.environ.get('POLL_THROTTLE_CACHE', 'default')
+POLL_THROTTLE_RATES = {
+    'vote': {'user': '20/m', 'ip': '60/m'},
+    'comment': {'user': '5/m', 'ip': '20/m'},
+    # Password guesses on password-protected polls
+    'unlock': {'user': '10/m', 'ip': '10/m'},
+}
+
+
+# Request metrics
+# RequestMetricsMiddleware records query counts, SQL, template and wall time
+# per view; staff (or a bearer POLL_METRICS_TOKEN) read them in the
+# Prometheus text format at /polls/metrics/. A view making more queries than
+# its POLL_QUERY_BUDGETS entry is logged ('log') or fails ('raise').
+POLL_METRICS_TOKEN = os.environ.get('POLL_METRICS_TOKEN', '')
+POLL_QUERY_BUDGETS = {
+    'polls:index': 10,
+    'polls:detail': 10,
+    'polls:results': 10,
+    'polls:vote': 15,
+    'polls:category': 10,
+    'accounts:profile': 10,
+    'api:poll_list': 10,
+    'api:poll_detail': 10,
+    'api:poll_results': 10,
+    'api:poll_timeline': 10,
+}
+POLL_QUERY_BUDGET_ACTION = os.environ.get('POLL_QUERY_BUDGET_ACTION', 'log')
+
+
+# Vote timelines
+# The results page and /api/v1/polls/<id>/timeline/ read per-minute, hour or
+# day rollups; the finest granularity that fits in this many buckets is used.
+POLL_TIMELINE_MAX_BUCKETS = int(os.environ.get('POLL_TIMELINE_MAX_BUCKETS', 500))
+
+
+# Background jobs
+# Poll deletes, counter reconciliation, exports and timeline rebuilds started
+# from the admin are queued as Job rows and run by `python manage.py run_workers`.
+# A failed job is retried after POLL_JOB_RETRY_DELAY seconds, doubling after
+# each attempt up to POLL_JOB_RETRY_MAX_DELAY; a running job that has reported
+# no progress for POLL_JOB_STALE_AFTER seconds (its worker died) is queued again.
+POLL_JOB_WORKERS = int(os.environ.get('POLL_JOB_WORKERS', 2))
+POLL_JOB_MAX_ATTEMPTS = 5
+POLL_JOB_RETRY_DELAY = 30
+POLL_JOB_RETRY_MAX_DELAY = 3600
+POLL_JOB_STALE_AFTER = 600
+POLL_JOB_CHUNK_SIZE = 1000
+# Export files name voters, so they are kept out of MEDIA_ROOT and served by the admin
+POLL_JOB_EXPORT_ROOT = os.environ.get('POLL_JOB_EXPORT_ROOT', BASE_DIR / 'exports')
+
+
+# Poll scheduler
+# `python manage.py poll_scheduler` opens and closes polls at their start and
+# end dates; listings go by Question.status (votes check the dates), so keep
+# it running. It sleeps until the next boundary, or at most this many seconds,
+# which is how late a poll saved with a start or end that close can flip.
+POLL_SCHEDULER_INTERVAL = float(os.environ.get('POLL_SCHEDULER_INTERVAL', 1.0))
@@ -0,0 +1,18 @@
+"""Settings for the test suite
+
+`python manage.py test` uses this module unless DJANGO_SETTINGS_MODULE is set;
+other runners should point DJANGO_SETTINGS_MODULE at poll_project.test_settings.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES
+
+
+if 'replica' not in DATABASES:
+    # A separate, empty database, so the router tests can tell reads apart
+    DATABASES['replica'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'db-replica.sqlite3'}
+
+# Every test client shares 127.0.0.1; the throttle tests set their own rates
+POLL_THROTTLE_RATES = {}
+
+# Going over a budget fails the test that made the request
+POLL_QUERY_BUDGET_ACTION = 'raise'
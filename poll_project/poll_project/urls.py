@@ -22,8 +22,10 @@ from django.conf.urls.static import static
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('landingPage.urls')),
+    path('polls/async/', include('pollApp.async_urls', namespace='polls-async')),
     path('polls/', include('pollApp.urls')),
     path('accounts/', include('accounts.urls')),
+    path('api/v1/', include('pollApp.api_urls')),
 ]
 
 # Serve media files in development